@@ -7,6 +7,10 @@ import socket
 import time
 import sys
 import argparse
+from wolff_api_plugins.common.framing import FrameReader, OpcodeFramer
+from wolff_api_plugins.common import codec
+from wolff_api_plugins.client.encoder import EtsyEncoder
+from wolff_api_plugins.common.tracing import Tracer
 
 
 def main():
@@ -15,12 +19,16 @@ def main():
     argp.add_argument( '--ip', help = "IP of the Proxy server that an update request will be sent to.", required = True )
     argp.add_argument( '--port', help = "Port of the proxy server's update_listing service.", type = int, required = True )
     argp.add_argument( '--listing_id', help = "Integer ID of the listing to check for an update to. This should be the ID "
-                       "returned by the proxy server when the listing was originally posted.", type = int,
-                       required = True 
+                       "returned by the proxy server when the listing was originally posted. Several IDs "
+                       "can be given, and are checked together in a single message.", type = int,
+                       nargs = '+', required = True 
                      )
     argp.add_argument( '--log_file', help = "The name of the file to write log "
                        "information to.", default = "check_product_purchase.log"
                      )
+    argp.add_argument( '--trace_file', help = "A file the latency of the request is appended "
+                       "to, as a line of JSON.", default = None
+                     )
 
     args = argp.parse_args()
 
@@ -37,59 +45,90 @@ def main():
                                f"--port: {args.port}\n"
                                f"--listing_id: {args.listing_id}\n"
                                f"--log_file: {args.log_file}\n"
+                               f"--trace_file: {args.trace_file}\n"
     )
 
-    start_time = time.time()
-
-    logging.getLogger().info( f"TIMESTAMP beginning of check_product_purchase: {start_time}" )
+    tracer = Tracer( export_file = args.trace_file )
+    trace = tracer.start_trace()
 
     to_hex = lambda x: str( binascii.hexlify( x ) )
 
-    message = bytearray( 2 )
-    message[ 0 ] = 0x01
-    message[ 1 ] = 0x02
+    if len( args.listing_id ) > 1:
+        trace.set_api( 'etsy', 'check_listing_stock_batch' )
+        message = EtsyEncoder().encode( { 'method': { 'name': 'check_listing_stock_batch',
+                                                      'params': { 'record_ids': args.listing_id }
+                                                    }
+                                        }
+        )
+        logging.getLogger().debug( f"Message: {to_hex( message )}" )
+    else:
+        trace.set_api( 'etsy', 'check_listing_stock' )
+        message = bytearray( 2 )
+        message[ 0 ] = 0x01
+        message[ 1 ] = 0x02
+
+        logging.getLogger().debug( f"First 2 bytes of message: {to_hex( message )}" )
 
-    logging.getLogger().debug( f"First 2 bytes of message: {to_hex( message )}" )
+        listing_id_bytes = args.listing_id[ 0 ].to_bytes( 4, byteorder = 'big' )
 
-    listing_id_bytes = args.listing_id.to_bytes( 4, byteorder = 'big' )
+        logging.getLogger().debug( f"Listing ID: {args.listing_id[ 0 ]}, as bytes: {to_hex( listing_id_bytes )}" )
 
-    logging.getLogger().debug( f"Listing ID: {args.listing_id}, as bytes: {to_hex( listing_id_bytes )}" )
+        message += listing_id_bytes
 
-    message += listing_id_bytes
+        logging.getLogger().debug( f"Message after adding the ID: {to_hex( message ) }" )
 
-    logging.getLogger().debug( f"Message after adding the ID: {to_hex( message ) }" )
+        message += bytearray( 7 )
 
-    message += bytearray( 7 )
+        logging.getLogger().debug( f"Message after adding padding: {to_hex( message ) }" )
 
-    logging.getLogger().debug( f"Message after adding padding: {to_hex( message ) }" )
     logging.getLogger().debug( f"Message length: {len( message )}" )
 
 
     logging.getLogger().debug( f"Attempting to connect to server at IP: {args.ip}, Port: {args.port}" )
     with socket.socket( socket.AF_INET, socket.SOCK_STREAM ) as s:
-        s.connect( ( args.ip, args.port ) )
+        with trace.span( 'connect' ):
+            s.connect( ( args.ip, args.port ) )
 
         logging.getLogger().debug( f"Successfully connected to server." )
         logging.getLogger().debug( f"Sending request to server." )
 
-        s.sendall( message )
+        with trace.span( 'request' ):
+            s.sendall( message )
 
-        logging.getLogger().debug( f"Data succesfully sent, waiting on response..." )
+            logging.getLogger().debug( f"Data succesfully sent, waiting on response..." )
 
-        data = s.recv( 1024 )
+            data = FrameReader( s, OpcodeFramer.for_client() ).read()
+
+        # the server closes the connection without responding if handling the message fails
+        if data is None:
+            logging.getLogger().error( "The server closed the connection without a response" )
+            trace.finish( error = ConnectionError( "The server closed the connection without a response" ) )
+            tracer.log_report()
+            tracer.close()
+            sys.exit( 1 )
 
         logging.getLogger().debug( f"Response received from server: {to_hex( data )}" )
 
 
-        response_region = data[ 2:6 ]
-        num_purchased = int.from_bytes( response_region, byteorder = 'big' )
-        logging.getLogger().debug( f"Number of items that have been purchased: {num_purchased}" )
+        if len( args.listing_id ) > 1:
+            # a batch response is followed by the 4 byte number sold of each listing
+            size = codec.ETSY_STOCK_CHECK_SOLD.size
+            for listing_id, start in zip( args.listing_id, range( 3, len( data ), size ) ):
+                num_purchased = codec.ETSY_STOCK_CHECK_SOLD.decode( data, start )[ 'sold' ]
+                if num_purchased == codec.STOCK_CHECK_FAILED:
+                    logging.getLogger().error( f"The stock of listing {listing_id} could not be checked" )
+                else:
+                    logging.getLogger().debug( f"Number of items of listing {listing_id} "
+                                               f"that have been purchased: {num_purchased}"
+                    )
+        else:
+            response_region = data[ 2:6 ]
+            num_purchased = int.from_bytes( response_region, byteorder = 'big' )
+            logging.getLogger().debug( f"Number of items that have been purchased: {num_purchased}" )
         
-    end_time = time.time()
-
-    logging.getLogger().info( f"TIMESTAMP end of check_product_purchase: {end_time}" )
-
-    logging.getLogger().info( f"Elapsed time: {end_time - start_time}" )
+    trace.finish()
+    tracer.log_report()
+    tracer.close()
 
 
 if __name__ == '__main__':
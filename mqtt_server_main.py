@@ -1,7 +1,16 @@
 #!/usr/bin/env python3
 import wolff_api_plugins.server.server as wolff_server
 import wolff_api_plugins.server.DBConnection as wolff_db
+from wolff_api_plugins.server.session_pool import SessionPool
+from wolff_api_plugins.server.lookup_cache import CachingDBConnection
+from wolff_api_plugins.server.recent_requests import RecentRequests
+from wolff_api_plugins.server.transport import RequestsTransport, AsyncioTransport
+from wolff_api_plugins.server.api_map import APIMap
+from wolff_api_plugins.common.log_config import LEVELS, configure_logging
+from wolff_api_plugins.common.tracing import Tracer
+from wolff_api_plugins.common.metrics import MetricsRegistry, MetricsServer
 import argparse
+import atexit
 import sys
 import logging
 
@@ -18,6 +27,11 @@ def main():
                        "handling update messages from clients.",
                        type = int, default = 1884
                      )
+    argp.add_argument( '--update_framing', help = "How update messages are framed. "
+                       "'json' reads JSON documents sent back to back, 'length' expects each "
+                       "to be prefixed with its length.", choices = [ 'json', 'length' ],
+                       default = 'json'
+                     )
     argp.add_argument( '--db_file', help = "The name of the file containing a "
                        "SQLite3 database containing WOLFF information. ",
                        type = str, default = 'wolff_db.db'
@@ -25,37 +39,170 @@ def main():
     argp.add_argument( '--log_file', help = "The name of the file to write log "
                        "information to.", default = "mqtt_server_main.log"
                      )
-
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
+    argp.add_argument( '--log_level', help = "The lowest level of the messages logged. "
+                       "Below 'debug', messages on the path of each request are skipped "
+                       "at almost no cost.", choices = list( LEVELS ), default = 'debug'
+                     )
+    argp.add_argument( '--async_logging', help = "Write log records from a background thread "
+                       "instead of the thread logging them, so that slow writes to the log "
+                       "file do not hold up messages.", action = 'store_true'
+                     )
+    argp.add_argument( '--workers', help = "The number of worker threads that handle "
+                       "messages from the broker. If 0, messages are handled by the MQTT "
+                       "client's network thread.", type = int, default = 0
+                     )
+    argp.add_argument( '--db_synchronous', help = "When SQLite waits for writes to reach the "
+                       "disk. With 'normal', the last transactions committed can be lost to a "
+                       "power failure or an OS crash, but never to the server crashing. 'full' "
+                       "waits for every commit to reach the disk.", choices = [ 'normal', 'full' ],
+                       default = 'normal'
+                     )
+    argp.add_argument( '--stock_write_interval', help = "If greater than 0, listing stock is "
+                       "written to the database behind the requests that change it, every this "
+                       "many seconds. Stock changed since the last write is lost if the server is "
+                       "killed or crashes.", type = float, default = 0
+                     )
+    argp.add_argument( '--stock_write_batch', help = "With --stock_write_interval, stock is also "
+                       "written as soon as the stock of this many listings is waiting.",
+                       type = int, default = 256
+                     )
+    argp.add_argument( '--lookup_cache_size', help = "The maximum number of mappings between "
+                       "listings, their record ids and their clients cached in memory, for each "
+                       "kind of mapping. If 0, every lookup is made in the database.",
+                       type = int, default = 65536
+                     )
+    argp.add_argument( '--recent_requests', help = "The maximum number of responses to recent "
+                       "requests kept in memory, to answer requests that are delivered more than "
+                       "once without handling them again. Only requests posted to "
+                       "'posts/<sender>/req/<request id>' are recognized.", type = int, default = 10000
+                     )
+    argp.add_argument( '--recent_request_ttl', help = "The number of seconds the responses to "
+                       "requests are kept in the database, so that requests delivered again after "
+                       "the server restarts are recognized.", type = float, default = 86400
+                     )
+    argp.add_argument( '--session_pool_size', help = "The maximum number of client sessions "
+                       "kept open for reuse. If 0, a new session is created for every request.",
+                       type = int, default = 128
+                     )
+    argp.add_argument( '--session_idle_timeout', help = "The number of seconds a client session "
+                       "may go unused before it is closed.", type = float, default = 300
+                     )
+    argp.add_argument( '--session_pool_maxsize', help = "The maximum number of connections each "
+                       "client session keeps open to a host.", type = int, default = 8
+                     )
+    argp.add_argument( '--transport', help = "How requests are made to services. 'requests' "
+                       "makes each request on a thread of its own, 'asyncio' makes requests "
+                       "from a single event loop.", choices = [ 'requests', 'asyncio' ],
+                       default = 'requests'
+                     )
+    argp.add_argument( '--max_in_flight', help = "The maximum number of requests to services "
+                       "in flight at once with the 'asyncio' transport.", type = int, default = 256
+                     )
+    argp.add_argument( '--upstream_url', help = "Replace Etsy's base url, for example with the "
+                       "url of a local stub server.", type = str, default = None
+                     )
+    argp.add_argument( '--client_watch_interval', help = "If greater than 0, the clients "
+                       "directory is checked for changes every this many seconds, and clients "
+                       "are reloaded when it changes.", type = float, default = 0
+                     )
+    argp.add_argument( '--queue_depth', help = "The maximum number of messages waiting "
+                       "for a worker.", type = int, default = 100
+                     )
+    argp.add_argument( '--trace_file', help = "A file the stages of handling each message "
+                       "are appended to, with their latency, as lines of JSON.", default = None
+                     )
+    argp.add_argument( '--trace_report_interval', help = "If greater than 0, the p50, p95 and "
+                       "p99 latency of each stage is logged every this many seconds. It is "
+                       "always logged when the server exits.", type = float, default = 0
+                     )
+    argp.add_argument( '--metrics_port', help = "If greater than 0, the server's metrics are "
+                       "served at http://127.0.0.1:<port>/metrics, in the Prometheus text format.",
+                       type = int, default = 0
+                     )
 
     args = argp.parse_args()
-    logging.basicConfig( level = logging.NOTSET,
-                         format = '%(asctime)s [%(levelname)-5.5s] %(message)s', 
-                         handlers = [
-                             logging.FileHandler( args.log_file ),
-                             logging.StreamHandler( sys.stdout )
-                         ]
-    )
+    configure_logging( args.log_file, level = args.log_level, asynchronous = args.async_logging )
 
     logging.getLogger().debug( "Parsed arguments with values: \n"
                                f"--ip: {args.ip}\n"
                                f"--port: {args.port}\n"
                                f"--update_port: {args.update_port}\n"
+                               f"--update_framing: {args.update_framing}\n"
                                f"--db_file: {args.db_file}\n"
+                               f"--db_synchronous: {args.db_synchronous}\n"
+                               f"--stock_write_interval: {args.stock_write_interval}\n"
+                               f"--stock_write_batch: {args.stock_write_batch}\n"
+                               f"--lookup_cache_size: {args.lookup_cache_size}\n"
+                               f"--recent_requests: {args.recent_requests}\n"
+                               f"--recent_request_ttl: {args.recent_request_ttl}\n"
                                f"--log_file: {args.log_file}\n"
+                               f"--log_level: {args.log_level}\n"
+                               f"--async_logging: {args.async_logging}\n"
+                               f"--workers: {args.workers}\n"
+                               f"--queue_depth: {args.queue_depth}\n"
+                               f"--client_watch_interval: {args.client_watch_interval}\n"
+                               f"--session_pool_size: {args.session_pool_size}\n"
+                               f"--session_idle_timeout: {args.session_idle_timeout}\n"
+                               f"--session_pool_maxsize: {args.session_pool_maxsize}\n"
+                               f"--transport: {args.transport}\n"
+                               f"--max_in_flight: {args.max_in_flight}\n"
+                               f"--upstream_url: {args.upstream_url}\n"
+                               f"--trace_file: {args.trace_file}\n"
+                               f"--trace_report_interval: {args.trace_report_interval}\n"
+                               f"--metrics_port: {args.metrics_port}\n"
     )
     logging.getLogger().debug( f"Creating a SQLITE connection to DB file: {args.db_file}" )
-    connection = wolff_db.SQLite3DBConnection( args.db_file )
+    connection = wolff_db.SQLite3DBConnection( args.db_file, synchronous = args.db_synchronous,
+                                               stock_write_interval = args.stock_write_interval,
+                                               stock_write_batch = args.stock_write_batch
+    )
+    schema_version = connection.migrate()
+    logging.getLogger().debug( f"The database is at schema version {schema_version}" )
 
     logging.getLogger().debug( f"Creating a server connection to server: {args.ip}:{args.port}" )
     logging.getLogger().debug( f"Update port: {args.update_port}" )
+    session_pool = SessionPool( max_sessions = args.session_pool_size,
+                                idle_timeout = args.session_idle_timeout,
+                                pool_maxsize = args.session_pool_maxsize
+                              )
+    if args.transport == 'asyncio':
+        transport = AsyncioTransport( max_in_flight = args.max_in_flight )
+    else:
+        transport = RequestsTransport( session_pool )
+
+    api_map = APIMap( base_urls = { 'etsy': args.upstream_url } if args.upstream_url else None )
+
+    tracer = Tracer( export_file = args.trace_file )
+    atexit.register( tracer.log_report )
+    if args.trace_report_interval > 0:
+        tracer.log_report_every( args.trace_report_interval )
+
+    metrics_registry = MetricsRegistry()
+    if args.metrics_port > 0:
+        MetricsServer( metrics_registry, port = args.metrics_port ).start()
+
+    if args.lookup_cache_size > 0:
+        connection = CachingDBConnection( connection, max_entries = args.lookup_cache_size,
+                                          metrics_registry = metrics_registry
+        )
+
     server = wolff_server.MQTTServer( connection,
                                       ip = args.ip,
                                       port = args.port,
-                                      update_port = args.update_port
+                                      update_port = args.update_port,
+                                      num_workers = args.workers,
+                                      queue_depth = args.queue_depth,
+                                      client_watch_interval = args.client_watch_interval,
+                                      session_pool = session_pool,
+                                      transport = transport,
+                                      api_map = api_map,
+                                      update_framing = args.update_framing,
+                                      tracer = tracer,
+                                      metrics_registry = metrics_registry,
+                                      recent_requests = RecentRequests( connection,
+                                                                        max_entries = args.recent_requests,
+                                                                        ttl = args.recent_request_ttl
+                                      )
                                      )
 
 
@@ -2,6 +2,8 @@
 import argparse
 import wolff_api_plugins.server.server as wolff_server
 import wolff_api_plugins.server.DBConnection as wolff_db
+from wolff_api_plugins.common.metrics import MetricsRegistry, MetricsServer
+from wolff_api_plugins.common.log_config import LEVELS, configure_logging
 import logging
 import sys
 
@@ -25,20 +27,62 @@ def main():
     argp.add_argument( '--broker_port', help = "The port of the MQTT broker",
                        type = int, default = 1883
                      )
+    argp.add_argument( '--framing', help = "How messages are framed on client connections.",
+                       choices = [ 'opcode', 'length' ], default = 'opcode'
+                     )
+    argp.add_argument( '--node_id', help = "The id of this node, which must differ from every "
+                       "other node's. Requests are posted to 'posts/<node_id>/req/<request id>', and "
+                       "only the responses published to 'responses/<node_id>/#' are received. "
+                       "Defaults to the host name.", type = str, default = None
+                     )
+    argp.add_argument( '--mode', help = "How client connections are served. 'serial' handles "
+                       "one connection at a time, 'threaded' handles up to --max_workers "
+                       "connections concurrently, with their requests waiting for responses "
+                       "at the same time.", choices = wolff_server.WOLFFServer.MODES,
+                       default = wolff_server.WOLFFServer.SERIAL
+                     )
+    argp.add_argument( '--max_workers', help = "The maximum number of connections handled "
+                       "concurrently in 'threaded' mode.", type = int, default = 8
+                     )
+    argp.add_argument( '--response_timeout', help = "The number of seconds to wait for the "
+                       "response to a request before closing the client's connection.",
+                       type = float, default = 30
+                     )
+    argp.add_argument( '--outbox_file', help = "If given, requests are put in an outbox kept in "
+                       "this database file, and published whenever the broker is reachable, "
+                       "instead of being published directly. Requests in the outbox survive "
+                       "restarts of the proxy.", type = str, default = None
+                     )
+    argp.add_argument( '--outbox_max_depth', help = "The maximum number of requests in the outbox.",
+                       type = int, default = 100000
+                     )
+    argp.add_argument( '--outbox_batch', help = "The maximum number of requests published from the "
+                       "outbox before waiting for the broker to acknowledge them.", type = int, default = 64
+                     )
+    argp.add_argument( '--outbox_rate', help = "If greater than 0, the maximum number of requests "
+                       "published from the outbox per second.", type = float, default = 0
+                     )
+    argp.add_argument( '--metrics_port', help = "If greater than 0, the proxy's metrics, including "
+                       "the depth and age of its outbox, are served at "
+                       "http://127.0.0.1:<port>/metrics, in the Prometheus text format.",
+                       type = int, default = 0
+                     )
     argp.add_argument( '--log_file', help = "The name of the file to write log "
                        "information to.", default = "node_proxy.log"
                      )
+    argp.add_argument( '--log_level', help = "The lowest level of the messages logged. "
+                       "Below 'debug', messages on the path of each request are skipped "
+                       "at almost no cost.", choices = list( LEVELS ), default = 'debug'
+                     )
+    argp.add_argument( '--async_logging', help = "Write log records from a background thread "
+                       "instead of the thread logging them, so that slow writes to the log "
+                       "file do not hold up messages.", action = 'store_true'
+                     )
 
 
     args = argp.parse_args()
 
-    logging.basicConfig( level = logging.NOTSET,
-                         format = '%(asctime)s [%(levelname)-5.5s] %(message)s', 
-                         handlers = [
-                             logging.FileHandler( args.log_file ),
-                             logging.StreamHandler( sys.stdout )
-                         ]
-    )
+    configure_logging( args.log_file, level = args.log_level, asynchronous = args.async_logging )
 
 
     logging.getLogger().debug( "Parsed arguments with values: \n"
@@ -46,16 +90,42 @@ def main():
                                f"--client_port: {args.client_port}\n"
                                f"--broker_ip: {args.broker_ip}\n"
                                f"--broker_port: {args.broker_port}\n"
+                               f"--framing: {args.framing}\n"
+                               f"--node_id: {args.node_id}\n"
+                               f"--mode: {args.mode}\n"
+                               f"--max_workers: {args.max_workers}\n"
+                               f"--response_timeout: {args.response_timeout}\n"
+                               f"--outbox_file: {args.outbox_file}\n"
+                               f"--outbox_max_depth: {args.outbox_max_depth}\n"
+                               f"--outbox_batch: {args.outbox_batch}\n"
+                               f"--outbox_rate: {args.outbox_rate}\n"
+                               f"--metrics_port: {args.metrics_port}\n"
                                f"--log_file: {args.log_file}\n"
+                               f"--log_level: {args.log_level}\n"
+                               f"--async_logging: {args.async_logging}\n"
     )
 
     logging.getLogger().debug( "Creating a WOLFF Node proxy" )
 
+    metrics_registry = MetricsRegistry()
+    if args.metrics_port > 0:
+        MetricsServer( metrics_registry, port = args.metrics_port ).start()
+
 
     server = wolff_server.WOLFFNodeProxy( client_ip = args.client_ip,
                                           client_port = args.client_port,
                                           broker_ip = args.broker_ip,
-                                          broker_port = args.broker_port 
+                                          broker_port = args.broker_port,
+                                          framing = args.framing,
+                                          node_id = args.node_id,
+                                          mode = args.mode,
+                                          max_workers = args.max_workers,
+                                          response_timeout = args.response_timeout,
+                                          outbox_file = args.outbox_file,
+                                          outbox_max_depth = args.outbox_max_depth,
+                                          outbox_batch = args.outbox_batch,
+                                          outbox_rate = args.outbox_rate,
+                                          metrics_registry = metrics_registry
                                         )
 
     server.start()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of encoding and decoding binary WOLFF messages.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from wolff_api_plugins.client.encoder import EtsyEncoder
+from wolff_api_plugins.server.decoder import DecoderFactory
+
+LISTING = { 'quantity': 2, 'title': 'title_1', 'description': 'desc_1',
+            'price': 1.11, 'who_made': 'i_did', 'is_supply': True,
+            'when_made': 'made_to_order', 'shipping_template_id': 84634415230
+          }
+
+def measure( name, fn, iterations ):
+    start = time.perf_counter()
+    for _ in range( iterations ):
+        fn()
+    elapsed = time.perf_counter() - start
+
+    print( f"  {name:<36} {iterations / elapsed:12.0f} msg/s  "
+           f"{elapsed / iterations * 1e6:8.2f} us/msg"
+    )
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark the WOLFF message codec." )
+    argp.add_argument( '--iterations', help = "The number of messages to encode or decode.",
+                       type = int, default = 200000
+                     )
+
+    args = argp.parse_args()
+
+    create_listing = { 'method': { 'name': 'create_listing', 'params': LISTING } }
+    batch = { 'method': { 'name': 'create_listing_batch',
+                          'params': { 'listings': [ LISTING ] * 50 }
+                        }
+            }
+
+    message = bytes( EtsyEncoder().encode( create_listing ) )
+    view = memoryview( message )
+    batch_message = bytes( EtsyEncoder().encode( batch ) )
+
+    print( f"{args.iterations} messages" )
+    measure( 'encode create_listing',
+             lambda: EtsyEncoder().encode( create_listing ),
+             args.iterations
+    )
+    measure( 'decode create_listing',
+             lambda: DecoderFactory().get_decoder( message ).decode( message ),
+             args.iterations
+    )
+    measure( 'decode create_listing (memoryview)',
+             lambda: DecoderFactory().get_decoder( view ).decode( view ),
+             args.iterations
+    )
+    # 50 listings in each message
+    measure( 'decode create_listing_batch of 50',
+             lambda: DecoderFactory().get_decoder( batch_message ).decode( batch_message ),
+             args.iterations // 50
+    )
+
+if __name__ == '__main__':
+    main()
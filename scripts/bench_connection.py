@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Compare sending create_listing messages with TCPServerConnection over a
+new connection per message, over a persistent connection, and pipelined
+over a persistent connection. Messages are sent to a local server that
+answers each with a 13-byte response, so the time measured is the
+time spent by the connection itself.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from wolff_api_plugins.client.message import EtsyMessage
+from wolff_api_plugins.client.server_connection import TCPServerConnection
+from wolff_api_plugins.common.framing import FrameReader, OpcodeFramer
+
+LISTING = { 'method': { 'name': 'create_listing',
+                        'params': { 'quantity': 2, 'title': 'title_1', 'description': 'desc_1',
+                                    'price': 1.11, 'who_made': 'i_did', 'is_supply': True,
+                                    'when_made': 'made_to_order',
+                                    'shipping_template_id': 84634415230
+                                  }
+                      }
+          }
+
+RESPONSE = bytes( [ 0x01, 0x01, 0x00, 0x00, 0x00, 0x01 ] ) + bytes( 7 )
+
+def serve( sock, delay ):
+    """
+    Answer every message received on connections to sock.
+
+    @param delay Seconds to wait before accepting each connection,
+           to imitate the round trip of a slow link.
+    """
+    def handle( conn ):
+        conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        with conn:
+            for message in FrameReader( conn, OpcodeFramer() ):
+                conn.sendall( RESPONSE )
+
+    while True:
+        conn, addr = sock.accept()
+        if delay:
+            time.sleep( delay )
+        threading.Thread( target = handle, args = ( conn, ), daemon = True ).start()
+
+def run( connection, num_messages, batch_size ):
+    """
+    Send num_messages messages, batch_size at a time.
+
+    @returns the number of seconds taken
+    """
+    message = EtsyMessage( LISTING )
+
+    start = time.monotonic()
+    for sent in range( 0, num_messages, batch_size ):
+        count = min( batch_size, num_messages - sent )
+        if count == 1:
+            responses = [ connection.send( message ) ]
+        else:
+            responses = connection.send_many( [ message ] * count )
+        assert responses[ -1 ] == RESPONSE
+    return time.monotonic() - start
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark TCPServerConnection." )
+    argp.add_argument( '--messages', help = "The number of messages to send in each mode.",
+                       type = int, default = 2000
+                     )
+    argp.add_argument( '--batch_size', help = "The number of messages pipelined at once.",
+                       type = int, default = 50
+                     )
+    argp.add_argument( '--connect_delay', help = "Seconds added to each new connection.",
+                       type = float, default = 0.0
+                     )
+
+    args = argp.parse_args()
+
+    sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    sock.bind( ( '127.0.0.1', 0 ) )
+    sock.listen( 128 )
+    ip, port = sock.getsockname()
+    threading.Thread( target = serve, args = ( sock, args.connect_delay ), daemon = True ).start()
+
+    modes = [ ( 'new connection per message', False, 1 ),
+              ( 'persistent', True, 1 ),
+              ( f'persistent, pipelined x{args.batch_size}', True, args.batch_size )
+            ]
+
+    print( f"{args.messages} messages, {args.connect_delay * 1000:.0f} ms added per connection" )
+    for name, persistent, batch_size in modes:
+        with TCPServerConnection( ip = ip, port = port, persistent = persistent ) as connection:
+            elapsed = run( connection, args.messages, batch_size )
+
+        print( f"  {name:<32} {elapsed:7.3f} s  {args.messages / elapsed:9.1f} msg/s" )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of SQLite3DBConnection under concurrent load:
+writer threads record created listings and their stock, as the server
+does for each create_listing response, while reader threads look up
+listings, as the client manager and the stock checks do.
+
+Each configuration is run against a new database file, in a temporary
+directory, which is first filled with --listings listings.
+
+With --workload create, listings are instead recorded one after another
+from a single thread, through add_listing() and add_listing_stock(), and
+through record_created_listing(), which records both in one transaction.
+
+With --workload stock, threads check the stock of listings, reading it and
+updating it as a stock check does, with each update committed on its own
+and with the updates written behind, every --stock_write_interval seconds.
+
+With --workload lookup, listings are looked up by their listing id in a
+database at schema version 1, without indexes, then again once it is
+migrated to the latest version. Run it with --listings 1000000 to see the
+difference at scale.
+
+With --workload cache, the lookups made for each stock check are made
+for --hot_listings listings, directly and through a CachingDBConnection.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from wolff_api_plugins.common.tracing import LatencyHistogram
+from wolff_api_plugins.server.DBConnection import SQLite3DBConnection
+from wolff_api_plugins.server.lookup_cache import CachingDBConnection
+from wolff_api_plugins.server.schema import LATEST_VERSION
+
+CONFIGURATIONS = [ ( 'rollback journal, synchronous=full, one connection',
+                     dict( journal_mode = 'delete', synchronous = 'full', per_thread_readers = False ) ),
+                   ( 'wal, synchronous=full, per-thread readers',
+                     dict( journal_mode = 'wal', synchronous = 'full' ) ),
+                   ( 'wal, synchronous=normal, per-thread readers',
+                     dict( journal_mode = 'wal', synchronous = 'normal' ) )
+                 ]
+
+def create_db( file_name, num_listings, version = LATEST_VERSION, **kwargs ):
+    db = SQLite3DBConnection( file_name, **kwargs )
+    db.migrate( version )
+    db.conn.executemany( 'INSERT INTO AppRecord ( RecordId, ListingValue ) VALUES ( ?, ? )',
+                         ( ( index, str( index ) ) for index in range( 1, num_listings + 1 ) )
+    )
+    db.conn.executemany( 'INSERT INTO AppUser ( EtsyListingID, ClientID ) VALUES ( ?, ? )',
+                         ( ( str( index ), f'client_{index % 100}' )
+                           for index in range( 1, num_listings + 1 )
+                         )
+    )
+    db.conn.executemany( 'INSERT INTO EtsyListingStock ( RecordId, QuantityInStock ) VALUES ( ?, ? )',
+                         ( ( index, 1 ) for index in range( 1, num_listings + 1 ) )
+    )
+    db.conn.commit()
+    return db
+
+def run( db, num_listings, num_writers, num_readers, duration ):
+    """
+    Run the writers and readers for duration seconds.
+
+    @returns a LatencyHistogram of the listings written, and one of the lookups made
+    """
+    stop = threading.Event()
+    listing_ids = itertools.count( num_listings + 1 )
+    lock = threading.Lock()
+    writes = LatencyHistogram()
+    reads = LatencyHistogram()
+
+    def write():
+        while not stop.is_set():
+            listing_id = str( next( listing_ids ) )
+            start = time.perf_counter()
+            record_id = db.add_listing( listing_id, 'client_1' )
+            db.add_listing_stock( record_id, 1 )
+            elapsed = time.perf_counter() - start
+            with lock:
+                writes.add( elapsed )
+
+    def read():
+        rand = random.Random()
+        while not stop.is_set():
+            listing_id = str( rand.randint( 1, num_listings ) )
+            start = time.perf_counter()
+            db.get_listing_stock( db.get_record_id( listing_id ) )
+            db.get_client_by_listing_id( listing_id )
+            elapsed = time.perf_counter() - start
+            with lock:
+                reads.add( elapsed )
+
+    threads = [ threading.Thread( target = write ) for _ in range( num_writers ) ] \
+            + [ threading.Thread( target = read ) for _ in range( num_readers ) ]
+    for thread in threads:
+        thread.start()
+    time.sleep( duration )
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return writes, reads
+
+def run_create( db, num_listings, num_created, atomic ):
+    """
+    Record num_created listings one after another.
+
+    @param atomic If True, record each listing with record_created_listing(),
+           otherwise with add_listing() and add_listing_stock().
+    @returns the number of seconds taken
+    """
+    start = time.perf_counter()
+    for listing_id in range( num_listings + 1, num_listings + num_created + 1 ):
+        if atomic:
+            db.record_created_listing( str( listing_id ), 'client_1', 1 )
+        else:
+            record_id = db.add_listing( str( listing_id ), 'client_1' )
+            db.add_listing_stock( record_id, 1 )
+    return time.perf_counter() - start
+
+def run_stock( db, num_listings, num_threads, hot_listings, duration ):
+    """
+    Check the stock of one of the first hot_listings listings,
+    from each of num_threads threads, for duration seconds.
+
+    @returns a LatencyHistogram of the checks
+    """
+    stop = threading.Event()
+    lock = threading.Lock()
+    checks = LatencyHistogram()
+
+    def check():
+        rand = random.Random()
+        while not stop.is_set():
+            record_id = rand.randint( 1, min( hot_listings, num_listings ) )
+            start = time.perf_counter()
+            db.update_listing_stock( record_id, db.get_listing_stock( record_id ) + 1 )
+            elapsed = time.perf_counter() - start
+            with lock:
+                checks.add( elapsed )
+
+    threads = [ threading.Thread( target = check ) for _ in range( num_threads ) ]
+    for thread in threads:
+        thread.start()
+    time.sleep( duration )
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return checks
+
+def run_lookup( db, num_listings, num_lookups ):
+    """
+    Look up num_lookups listings by their listing id, and the client of each.
+
+    @returns a LatencyHistogram of the lookups of each kind
+    """
+    rand = random.Random( 0 )
+    by_listing = LatencyHistogram()
+    by_client = LatencyHistogram()
+    for _ in range( num_lookups ):
+        listing_id = str( rand.randint( 1, num_listings ) )
+        start = time.perf_counter()
+        db.get_record_id( listing_id )
+        by_listing.add( time.perf_counter() - start )
+
+        start = time.perf_counter()
+        db.conn.execute( 'SELECT COUNT(*) FROM AppUser WHERE ClientID = ?',
+                         ( f'client_{rand.randrange( 100 )}', )
+        ).fetchone()
+        by_client.add( time.perf_counter() - start )
+
+    return by_listing, by_client
+
+def run_resolve( db, num_listings, hot_listings, num_checks ):
+    """
+    Make the lookups of num_checks stock checks of the first hot_listings
+    listings: the listing id of the record, twice, the client of the
+    listing, and the record id of the listing.
+
+    @returns the number of seconds taken
+    """
+    rand = random.Random( 0 )
+    start = time.perf_counter()
+    for _ in range( num_checks ):
+        record_id = rand.randint( 1, min( hot_listings, num_listings ) )
+        db.get_listing_id( record_id )
+        listing_id = db.get_listing_id( str( record_id ) )
+        db.get_client_by_listing_id( listing_id )
+        db.get_record_id( listing_id )
+    return time.perf_counter() - start
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark concurrent inserts and lookups "
+                                    "in the WOLFF database."
+    )
+    argp.add_argument( '--listings', help = "The number of listings in the database before each run.",
+                       type = int, default = 10000
+                     )
+    argp.add_argument( '--writers', help = "The number of threads writing listings.",
+                       type = int, default = 2
+                     )
+    argp.add_argument( '--readers', help = "The number of threads looking up listings.",
+                       type = int, default = 4
+                     )
+    argp.add_argument( '--duration', help = "The number of seconds each configuration is run for.",
+                       type = float, default = 5
+                     )
+    argp.add_argument( '--workload', help = "'concurrent' runs writers and readers at once, "
+                       "'create' compares the ways of recording a created listing, "
+                       "'stock' compares writing stock updates at once and behind, "
+                       "'lookup' compares lookups before and after the schema migrations, "
+                       "'cache' compares lookups with and without a cache.",
+                       choices = [ 'concurrent', 'create', 'stock', 'lookup', 'cache' ],
+                       default = 'concurrent'
+                     )
+    argp.add_argument( '--created', help = "The number of listings recorded by each way "
+                       "with --workload create.", type = int, default = 2000
+                     )
+    argp.add_argument( '--hot_listings', help = "The number of listings whose stock is checked "
+                       "with --workload stock.", type = int, default = 100
+                     )
+    argp.add_argument( '--stock_write_interval', help = "The interval stock updates are written "
+                       "at when they are written behind.", type = float, default = 0.1
+                     )
+    argp.add_argument( '--lookups', help = "The number of lookups of each kind made "
+                       "with --workload lookup.", type = int, default = 200
+                     )
+
+    args = argp.parse_args()
+
+    if args.workload == 'create':
+        main_create( args )
+        return
+    if args.workload == 'stock':
+        main_stock( args )
+        return
+    if args.workload == 'lookup':
+        main_lookup( args )
+        return
+    if args.workload == 'cache':
+        main_cache( args )
+        return
+
+    print( f"{args.listings} listings, {args.writers} writers, {args.readers} readers, "
+           f"{args.duration} s per configuration"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for index, ( name, kwargs ) in enumerate( CONFIGURATIONS ):
+            db = create_db( os.path.join( directory, f'bench_{index}.db' ), args.listings, **kwargs )
+            writes, reads = run( db, args.listings, args.writers, args.readers, args.duration )
+            db.close()
+
+            print( f"  {name}" )
+            for label, histogram in [ ( 'inserts', writes ), ( 'lookups', reads ) ]:
+                if not histogram.count:
+                    print( f"    {label:<8} none" )
+                    continue
+                print( f"    {label:<8} {histogram.count / args.duration:10.0f}/s  "
+                       f"p50 {histogram.percentile( 50 ) * 1000:8.3f} ms  "
+                       f"p99 {histogram.percentile( 99 ) * 1000:8.3f} ms"
+                )
+
+def main_create( args ):
+    print( f"{args.listings} listings, {args.created} listings recorded by each way" )
+    with tempfile.TemporaryDirectory() as directory:
+        for index, ( name, kwargs ) in enumerate( CONFIGURATIONS ):
+            print( f"  {name}" )
+            for atomic, way in [ ( False, 'add_listing + add_listing_stock' ),
+                                 ( True, 'record_created_listing' )
+                               ]:
+                db = create_db( os.path.join( directory, f'bench_{index}_{atomic}.db' ),
+                                args.listings, **kwargs
+                )
+                elapsed = run_create( db, args.listings, args.created, atomic )
+                db.close()
+                print( f"    {way:<32} {args.created / elapsed:10.0f}/s  "
+                       f"{elapsed / args.created * 1e6:10.1f} us per listing"
+                )
+
+def main_stock( args ):
+    print( f"{args.listings} listings, {args.writers + args.readers} threads checking the "
+           f"stock of {args.hot_listings} listings, {args.duration} s per configuration"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for index, ( name, kwargs ) in enumerate( CONFIGURATIONS ):
+            print( f"  {name}" )
+            for interval in [ 0, args.stock_write_interval ]:
+                db = create_db( os.path.join( directory, f'bench_{index}_{interval}.db' ),
+                                args.listings, stock_write_interval = interval, **kwargs
+                )
+                checks = run_stock( db, args.listings, args.writers + args.readers,
+                                    args.hot_listings, args.duration
+                )
+                start = time.perf_counter()
+                db.close()
+                closed = time.perf_counter() - start
+
+                way = f'written every {interval} s' if interval else 'committed at once'
+                print( f"    {way:<24} {checks.count / args.duration:10.0f} checks/s  "
+                       f"p99 {checks.percentile( 99 ) * 1000:8.3f} ms  "
+                       f"{closed * 1000:8.3f} ms to close"
+                )
+
+def main_lookup( args ):
+    print( f"{args.listings} listings, {args.lookups} lookups of each kind" )
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        db = create_db( os.path.join( directory, 'bench.db' ), args.listings, version = 1 )
+        print( f"  created the database in {time.perf_counter() - start:.1f} s" )
+
+        for name in [ 'schema version 1', f'schema version {LATEST_VERSION}' ]:
+            if name != 'schema version 1':
+                start = time.perf_counter()
+                db.migrate()
+                print( f"  migrated in {time.perf_counter() - start:.1f} s" )
+
+            print( f"  {name}" )
+            for label, histogram in zip( [ 'by listing id', 'by client' ],
+                                         run_lookup( db, args.listings, args.lookups )
+                                       ):
+                print( f"    {label:<14} p50 {histogram.percentile( 50 ) * 1000:10.3f} ms  "
+                       f"p99 {histogram.percentile( 99 ) * 1000:10.3f} ms"
+                )
+        db.close()
+
+def main_cache( args ):
+    num_checks = args.lookups * 100
+    print( f"{args.listings} listings, {num_checks} stock checks of {args.hot_listings} listings" )
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_db( os.path.join( directory, 'bench.db' ), args.listings )
+        cached = CachingDBConnection( db )
+        for name, connection in [ ( 'database', db ), ( 'cache', cached ) ]:
+            elapsed = run_resolve( connection, args.listings, args.hot_listings, num_checks )
+            print( f"  {name:<10} {elapsed / num_checks * 1e6:8.1f} us per check" )
+        for mapping, stats in cached.get_cache_stats().items():
+            print( f"  {mapping:<18} {stats[ 'hits' ]:8} hits {stats[ 'misses' ]:8} misses" )
+        db.close()
+
+if __name__ == '__main__':
+    main()
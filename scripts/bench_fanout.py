@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Measure what it costs each node proxy to receive the responses to every
+node's requests, against receiving only its own.
+
+--nodes WOLFFNodeProxy instances share a StubBroker with a gateway that
+answers each request by publishing it back to its reply topic, as
+MQTTServer does. Every node forwards --requests requests from
+--concurrency threads. The proxies are subscribed either to 'responses/#',
+as they were when every response was broadcast on 'responses', or only
+to their own 'responses/<node id>/#'.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from stub_broker import StubBroker, use_client
+from wolff_api_plugins.server.server import WOLFFNodeProxy
+
+# a check_listing_stock message
+PAYLOAD = bytes( [ 0x01, 0x02, 0x00, 0x00, 0x00, 0x01 ] )
+
+def run( num_nodes, num_requests, concurrency, broadcast ):
+    """
+    @returns the number of seconds taken, the number of responses delivered
+             to the proxies, and the number of requests forwarded
+    """
+    broker = StubBroker()
+
+    gateway = broker.client()
+    gateway.subscribe( 'posts/#' )
+    gateway.on_message = lambda client, userdata, msg: \
+                         client.publish( 'responses/' + msg.topic[ len( 'posts/' ): ], msg.payload )
+
+    proxies = list()
+    for node in range( num_nodes ):
+        proxy = WOLFFNodeProxy( node_id = f'node_{node}', response_timeout = 10 )
+        use_client( proxy, broker.client() )
+        if broadcast:
+            proxy.get_client().subscribe( 'responses/#' )
+        proxies.append( proxy )
+
+    def forward( proxy, count ):
+        for _ in range( count ):
+            assert proxy.forward( PAYLOAD ) == PAYLOAD
+
+    per_thread = num_requests // concurrency
+    threads = [ threading.Thread( target = forward, args = ( proxy, per_thread ) )
+                for proxy in proxies for _ in range( concurrency )
+              ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # the first client is the gateway
+    delivered = sum( broker.get_deliveries()[ 1: ] )
+    return elapsed, delivered, per_thread * len( threads )
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark broadcast and per-node response topics." )
+    argp.add_argument( '--nodes', help = "The number of node proxies.", type = int, default = 16 )
+    argp.add_argument( '--requests', help = "The number of requests each node forwards.",
+                       type = int, default = 200
+                     )
+    argp.add_argument( '--concurrency', help = "The number of threads forwarding requests on each node.",
+                       type = int, default = 4
+                     )
+    args = argp.parse_args()
+
+    print( f"{args.nodes} nodes, {args.requests} requests each, {args.concurrency} threads per node" )
+    for name, broadcast in [ ( "responses/#", True ), ( "responses/<node id>/#", False ) ]:
+        elapsed, delivered, forwarded = run( args.nodes, args.requests, args.concurrency, broadcast )
+        print( f"  {name:<22} {forwarded / elapsed:8.0f} requests/s  "
+               f"{delivered / forwarded:6.1f} messages received per response"
+        )
+
+if __name__ == '__main__':
+    main()
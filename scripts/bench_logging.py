@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Measure the time logging adds to each message handled by a WOLFFServer,
+at each log level, with records written synchronously and through a
+queue. Messages are sent over a local connection and answered from a
+canned upstream response and an in-memory database, so the rest of the
+time spent on each message is as small as possible.
+
+Log records are written to a file in a temporary directory, and to
+stdout, which is redirected to /dev/null while measuring.
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from wolff_api_plugins.client.encoder import EtsyEncoder
+from wolff_api_plugins.common.log_config import configure_logging
+from wolff_api_plugins.server.DBConnection import SQLite3DBConnection
+from wolff_api_plugins.server.server import WOLFFServer
+from wolff_api_plugins.server.transport import UpstreamResponse, UpstreamTransport
+
+SHIPPING_TEMPLATE_ID = 84634415230
+
+LISTING = { 'quantity': 2, 'title': 'title_1', 'description': 'desc_1',
+            'price': 1.11, 'who_made': 'i_did', 'is_supply': True,
+            'when_made': 'made_to_order', 'shipping_template_id': SHIPPING_TEMPLATE_ID
+          }
+
+class CannedTransport( UpstreamTransport ):
+    """
+    Answers every request immediately with a newly created listing.
+    """
+    def __init__( self ):
+        self._next_id = 1000000000
+        self._lock = threading.Lock()
+
+    def request( self, http_method, url, credentials, data = None ):
+        with self._lock:
+            listing_id = self._next_id
+            self._next_id += 1
+
+        body = { 'results': [ { 'listing_id': listing_id, 'quantity': LISTING[ 'quantity' ] } ] }
+        return UpstreamResponse( 201, dict(), json.dumps( body ).encode( 'utf-8' ) )
+
+def create_environment( directory ):
+    """
+    Create a client in directory/clients, and an in-memory database.
+
+    @returns the connection to the database
+    """
+    for resource, file_name, content in [ ( 'oauth1', 'keys.tsv',
+                                            'client_key\tkey\nclient_secret\tsecret\n'
+                                            'resource_owner_key\towner_key\n'
+                                            'resource_owner_secret\towner_secret\n' ),
+                                          ( 'shipping_template_id', 'shipping_template_id.txt',
+                                            f'{SHIPPING_TEMPLATE_ID}\n' )
+                                        ]:
+        resource_dir = os.path.join( directory, 'clients', 'client_1', 'etsy', resource )
+        os.makedirs( resource_dir )
+        with open( os.path.join( resource_dir, file_name ), 'w' ) as resource_file:
+            resource_file.write( content )
+
+    db = SQLite3DBConnection( ':memory:' )
+    db.migrate()
+    return db
+
+def run( server, message, num_messages ):
+    """
+    Send num_messages messages back to back over one connection
+    and wait for every response.
+
+    @returns the number of seconds taken
+    """
+    with socket.create_server( ( '127.0.0.1', 0 ) ) as sock:
+        client = socket.create_connection( sock.getsockname() )
+        conn, addr = sock.accept()
+
+    def send():
+        client.sendall( message * num_messages )
+        client.shutdown( socket.SHUT_WR )
+
+    def receive():
+        remaining = num_messages * 13
+        while remaining:
+            remaining -= len( client.recv( 65536 ) )
+
+    threads = [ threading.Thread( target = send, daemon = True ),
+                threading.Thread( target = receive, daemon = True )
+              ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    server.handle_connection( conn, server.get_client_manager() )
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    return elapsed
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark the cost of logging per message." )
+    argp.add_argument( '--messages', help = "The number of messages to send in each mode.",
+                       type = int, default = 5000
+                     )
+
+    args = argp.parse_args()
+
+    modes = [ ( 'logging disabled', None, False ),
+              ( 'warning', 'warning', False ),
+              ( 'info', 'info', False ),
+              ( 'info, async', 'info', True ),
+              ( 'debug', 'debug', False ),
+              ( 'debug, async', 'debug', True )
+            ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir( directory )
+        server = WOLFFServer( create_environment( directory ), transport = CannedTransport() )
+        message = bytes( EtsyEncoder().encode( { 'method': { 'name': 'create_listing',
+                                                             'params': LISTING
+                                                           }
+                                               }
+                  ) )
+
+        # warm up the client manager and the database
+        logging.getLogger().setLevel( logging.CRITICAL )
+        run( server, message, 100 )
+
+        print( f"{args.messages} messages" )
+        baseline = None
+        for name, level, asynchronous in modes:
+            root = logging.getLogger()
+            stdout = sys.stdout
+            sys.stdout = open( os.devnull, 'w' )
+            try:
+                listener = None
+                if level:
+                    listener = configure_logging( os.path.join( directory, 'bench.log' ),
+                                                  level = level, asynchronous = asynchronous
+                    )
+                else:
+                    root.setLevel( logging.CRITICAL )
+
+                elapsed = run( server, message, args.messages )
+
+                # the time taken to write the records still in the queue
+                start = time.perf_counter()
+                if listener:
+                    listener.stop()
+                    atexit.unregister( listener.stop )
+                drained = time.perf_counter() - start
+            finally:
+                for handler in list( root.handlers ):
+                    root.removeHandler( handler )
+                    handler.close()
+                sys.stdout.close()
+                sys.stdout = stdout
+
+            per_message = elapsed / args.messages * 1e6
+            if baseline is None:
+                baseline = per_message
+            print( f"  {name:<18} {per_message:8.1f} us/msg  "
+                   f"(+{per_message - baseline:6.1f} us for logging)"
+                   + ( f"  {drained:6.3f} s writing the queue after" if listener else '' )
+            )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Measure the outbox of WOLFFNodeProxy through an outage of the link to the
+broker and a restart of the proxy.
+
+A proxy that is not connected to the broker accepts --requests requests
+into its outbox. It is then replaced by a new proxy using the same outbox
+file, as if it had been restarted, which connects to a StubBroker and
+publishes them to a gateway, --batch at a time, at up to --rate requests
+per second.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from stub_broker import StubBroker, use_client
+from wolff_api_plugins.server.server import WOLFFNodeProxy
+
+# a check_listing_stock message
+PAYLOAD = bytes( [ 0x01, 0x02, 0x00, 0x00, 0x00, 0x01 ] )
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark the outbox of the node proxy." )
+    argp.add_argument( '--requests', help = "The number of requests accepted during the outage.",
+                       type = int, default = 5000
+                     )
+    argp.add_argument( '--batch', help = "The number of requests published before waiting for "
+                       "the broker to acknowledge them.", type = int, default = 64
+                     )
+    argp.add_argument( '--rate', help = "If greater than 0, the maximum number of requests "
+                       "published per second.", type = float, default = 0
+                     )
+    args = argp.parse_args()
+
+    broker = StubBroker()
+    received = list()
+    done = threading.Event()
+
+    def on_post( client, userdata, msg ):
+        received.append( msg.topic )
+        if len( received ) == args.requests:
+            done.set()
+
+    gateway = broker.client()
+    gateway.subscribe( 'posts/#' )
+    gateway.on_message = on_post
+
+    with tempfile.TemporaryDirectory() as directory:
+        outbox_file = os.path.join( directory, 'outbox.db' )
+
+        proxy = WOLFFNodeProxy( node_id = 'node_1', outbox_file = outbox_file,
+                                outbox_batch = args.batch, outbox_rate = args.rate
+        )
+        client = broker.client()
+        use_client( proxy, client )
+        client.disconnect()
+
+        start = time.perf_counter()
+        for request in range( args.requests ):
+            proxy.do_request( PAYLOAD, f'posts/node_1/req/{request}' )
+        elapsed = time.perf_counter() - start
+        print( f"accepted {args.requests} requests while disconnected: "
+               f"{elapsed / args.requests * 1e6:.0f} us per request" )
+        time.sleep( 0.5 )
+        stats = proxy.get_outbox_stats()
+        print( f"  outbox depth {stats[ 'depth' ]}, oldest {stats[ 'oldest_age' ]:.2f} s old, "
+               f"{len( received )} published" )
+
+        # the first proxy never reconnects, its outbox is taken over by the second
+        restarted = WOLFFNodeProxy( node_id = 'node_1', outbox_file = outbox_file,
+                                    outbox_batch = args.batch, outbox_rate = args.rate
+        )
+        print( f"restarted with {restarted.get_outbox_stats()[ 'depth' ]} requests in the outbox" )
+        start = time.perf_counter()
+        use_client( restarted, broker.client() )
+        if not done.wait( 600 ):
+            print( f"  only {len( received )} requests were published" )
+            sys.exit( 1 )
+        elapsed = time.perf_counter() - start
+
+        # the last batch is removed once it is acknowledged
+        while restarted.get_outbox_stats()[ 'depth' ]:
+            time.sleep( 0.01 )
+        in_order = received == [ f'posts/node_1/req/{request}' for request in range( args.requests ) ]
+        print( f"  published {len( received )} requests in {elapsed:.2f} s, "
+               f"{len( received ) / elapsed:.0f} requests/s, in order: {in_order}, "
+               f"outbox depth {restarted.get_outbox_stats()[ 'depth' ]}" )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of the upstream transports against a local stub
+of the Etsy API that answers each request after a fixed delay.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from stub_upstream import StubUpstreamServer
+from wolff_api_plugins.server.session_pool import SessionPool
+from wolff_api_plugins.server.transport import RequestsTransport, AsyncioTransport
+
+CREDENTIALS = { 'client_key': 'key', 'client_secret': 'secret',
+                'resource_owner_key': 'owner_key',
+                'resource_owner_secret': 'owner_secret'
+              }
+
+LISTING = { 'title': 'title_1', 'description': 'desc_1', 'quantity': 1,
+            'price': 1.11, 'who_made': 'i_did', 'when_made': 'made_to_order',
+            'is_supply': 1, 'shipping_template_id': 84634415230
+          }
+
+def run( transport, url, num_requests ):
+    """
+    Submit num_requests requests at once and wait for all of them.
+
+    @returns the number of seconds taken
+    """
+    start = time.monotonic()
+    futures = [ transport.submit( 'post', url, CREDENTIALS, data = LISTING )
+                for _ in range( num_requests )
+              ]
+    for future in futures:
+        assert future.result().status_code == 201
+    return time.monotonic() - start
+
+def main():
+    argp = argparse.ArgumentParser( description = "Benchmark the upstream transports." )
+    argp.add_argument( '--requests', help = "The number of requests to make with each transport.",
+                       type = int, default = 500
+                     )
+    argp.add_argument( '--delay', help = "Seconds the stub waits before answering each request.",
+                       type = float, default = 0.05
+                     )
+    argp.add_argument( '--max_in_flight', help = "The maximum number of requests in flight.",
+                       type = int, default = 256
+                     )
+
+    args = argp.parse_args()
+
+    stub = StubUpstreamServer( delay = args.delay )
+    stub.start()
+    url = f'{stub.get_base_url()}/listings/'
+
+    transports = [ ( 'requests', 16,
+                     RequestsTransport( SessionPool( pool_maxsize = 16 ), max_in_flight = 16 )
+                   ),
+                   ( 'requests', args.max_in_flight,
+                     RequestsTransport( SessionPool( pool_maxsize = args.max_in_flight ),
+                                        max_in_flight = args.max_in_flight
+                     )
+                   ),
+                   ( 'asyncio', args.max_in_flight,
+                     AsyncioTransport( max_in_flight = args.max_in_flight )
+                   )
+                 ]
+
+    print( f"{args.requests} requests, {args.delay * 1000:.0f} ms upstream delay" )
+    for name, max_in_flight, transport in transports:
+        # warm up connections before timing
+        run( transport, url, 16 )
+        elapsed = run( transport, url, args.requests )
+        transport.close()
+
+        print( f"  {name:<10} max_in_flight={max_in_flight:<5} "
+               f"{elapsed:7.3f} s  {args.requests / elapsed:9.1f} req/s"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Check that each implementation of DBConnection behaves as DBConnection
+describes, then measure the throughput of each. A new backend is added
+by adding a function that creates it to BACKENDS.
+
+Exits with a non-zero status if any check fails.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from wolff_api_plugins.server.DBConnection import SQLite3DBConnection
+from wolff_api_plugins.server.lookup_cache import CachingDBConnection
+from wolff_api_plugins.server.memory_db import InMemoryDBConnection
+
+"""
+The backends checked, by name: each is a function that is given a
+directory of its own, and returns a new, empty DBConnection.
+"""
+BACKENDS = { 'sqlite': lambda directory: SQLite3DBConnection( os.path.join( directory, 'wolff.db' ) ),
+             'sqlite :memory:': lambda directory: SQLite3DBConnection( ':memory:' ),
+             'sqlite, stock written behind':
+                 lambda directory: SQLite3DBConnection( os.path.join( directory, 'wolff.db' ),
+                                                        stock_write_interval = 0.05
+                 ),
+             'in memory': lambda directory: InMemoryDBConnection(),
+             'cached sqlite':
+                 lambda directory: CachingDBConnection(
+                     SQLite3DBConnection( os.path.join( directory, 'wolff.db' ) )
+                 )
+           }
+
+def expect( condition, message ):
+    if not condition:
+        raise AssertionError( message )
+
+def expect_raises( exception, function, *args ):
+    try:
+        function( *args )
+    except exception:
+        return
+    raise AssertionError( f"{function.__name__}{args} did not raise {exception.__name__}" )
+
+def check_round_trip( db ):
+    record_id = db.record_created_listing( 1001, 'client_1', 5 )
+    expect( isinstance( record_id, int ), f"the record id {record_id!r} is not an int" )
+    expect( db.get_listing_id( record_id ) == '1001', "the listing id was not returned as a str" )
+    expect( db.get_listing_id( str( record_id ) ) == '1001', "a record id given as a str was not found" )
+    expect( db.get_record_id( '1001' ) == record_id, "the record id was not found by listing id" )
+    expect( db.get_record_id( 1001 ) == record_id, "a listing id given as an int was not found" )
+    expect( db.get_client_by_listing_id( '1001' ) == 'client_1', "the client was not found" )
+    expect( db.get_listing_stock( record_id ) == 5, "the stock was not recorded" )
+
+def check_missing( db ):
+    record_id = db.record_created_listing( '1001', 'client_1', 5 )
+    expect_raises( KeyError, db.get_listing_id, record_id + 1 )
+    expect_raises( KeyError, db.get_record_id, '1002' )
+    expect_raises( KeyError, db.get_client_by_listing_id, '1002' )
+    expect_raises( KeyError, db.get_listing_stock, record_id + 1 )
+
+def check_record_atomic( db ):
+    record_id = db.record_created_listing( '1001', 'client_1', 5 )
+    try:
+        db.record_created_listing( '1001', 'client_2', 7 )
+    except Exception:
+        pass
+    db.flush()
+    expect( db.get_record_id( '1001' ) == record_id, "the listing was recorded twice" )
+    expect( db.get_client_by_listing_id( '1001' ) == 'client_1', "the client was replaced" )
+    expect( db.get_listing_stock( record_id ) == 5, "the stock was replaced" )
+    expect_raises( KeyError, db.get_listing_id, record_id + 1 )
+
+def check_add_listing( db ):
+    record_id = db.add_listing( '1001', 'client_1' )
+    expect( db.get_record_id( '1001' ) == record_id, "the listing was not recorded" )
+    expect_raises( KeyError, db.get_listing_stock, record_id )
+    expect( db.get_stock_records( [ record_id ] ) == dict(),
+            "a record without stock was returned by get_stock_records"
+    )
+    db.add_listing_stock( record_id, 3 )
+    expect( db.get_listing_stock( record_id ) == 3, "the stock was not recorded" )
+
+def check_update( db ):
+    record_id = db.record_created_listing( '1001', 'client_1', 5 )
+    db.update_listing_stock( record_id, 4 )
+    expect( db.get_listing_stock( record_id ) == 4, "the stock was not updated" )
+    db.update_listing_stock( record_id + 1, 4 )
+    db.flush()
+    expect_raises( KeyError, db.get_listing_stock, record_id + 1 )
+    expect( db.get_listing_stock( record_id ) == 4, "the stock was lost when flushed" )
+
+def check_stock_records( db ):
+    record_ids = [ db.record_created_listing( str( 1000 + index ), f'client_{index % 2}', index )
+                   for index in range( 10 )
+                 ]
+    missing = max( record_ids ) + 1
+    records = db.get_stock_records( record_ids + [ missing ] )
+    expect( records == { record_id: ( str( 1000 + index ), f'client_{index % 2}', index )
+                         for index, record_id in enumerate( record_ids )
+                       },
+            f"get_stock_records returned {records}"
+    )
+
+    db.update_listings_stock( { record_id: 100 for record_id in record_ids[ :5 ] } )
+    db.flush()
+    for index, record_id in enumerate( record_ids ):
+        expected = 100 if index < 5 else index
+        expect( db.get_listing_stock( record_id ) == expected,
+                f"the stock of record {record_id} is not {expected}"
+        )
+
+def check_threads( db ):
+    num_threads = 8
+    per_thread = 50
+    errors = []
+
+    def record( thread ):
+        try:
+            for index in range( per_thread ):
+                listing_id = f'{thread}_{index}'
+                record_id = db.record_created_listing( listing_id, f'client_{thread}', index )
+                db.update_listing_stock( record_id, index + 1 )
+                if db.get_listing_id( record_id ) != listing_id:
+                    errors.append( f"record {record_id} is not listing {listing_id}" )
+        except Exception as e:
+            errors.append( repr( e ) )
+
+    threads = [ threading.Thread( target = record, args = ( thread, ) ) for thread in range( num_threads ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expect( not errors, "; ".join( errors[ :3 ] ) )
+    db.flush()
+    record_ids = { db.get_record_id( f'{thread}_{index}' )
+                   for thread in range( num_threads ) for index in range( per_thread )
+                 }
+    expect( len( record_ids ) == num_threads * per_thread, "record ids were given out twice" )
+    records = db.get_stock_records( record_ids )
+    expect( all( quantity == int( listing_id.split( '_' )[ 1 ] ) + 1
+                 for listing_id, _, quantity in records.values()
+               ),
+            "updates of the stock were lost"
+    )
+
+def check_request_responses( db ):
+    expect_raises( KeyError, db.get_request_response, 'posts/node_1/1' )
+    db.record_request_response( 'posts/node_1/1', b'\x01\x01' )
+    db.record_request_response( 'posts/node_1/2', bytearray( b'\x01\x02' ) )
+    expect( db.get_request_response( 'posts/node_1/1' ) == b'\x01\x01', "the response was not recorded" )
+    db.record_request_response( 'posts/node_1/1', b'\x01\x03' )
+    expect( db.get_request_response( 'posts/node_1/1' ) == b'\x01\x03', "the response was not replaced" )
+
+    expect( db.forget_request_responses( time.time() - 60 ) == 0, "recent responses were forgotten" )
+    expect( db.forget_request_responses( time.time() + 1 ) == 2, "old responses were not forgotten" )
+    expect_raises( KeyError, db.get_request_response, 'posts/node_1/2' )
+
+CHECKS = [ check_round_trip, check_missing, check_record_atomic, check_add_listing,
+           check_update, check_stock_records, check_threads, check_request_responses ]
+
+def create( backend ):
+    directory = tempfile.TemporaryDirectory()
+    db = BACKENDS[ backend ]( directory.name )
+    db.migrate()
+    return db, directory
+
+def run_checks( backend ):
+    """
+    @returns the number of checks that failed
+    """
+    failures = 0
+    for check in CHECKS:
+        db, directory = create( backend )
+        try:
+            check( db )
+            result = 'PASS'
+        except Exception:
+            failures += 1
+            result = 'FAIL\n' + traceback.format_exc()
+        finally:
+            db.close()
+            directory.cleanup()
+        print( f"  {check.__name__:<22} {result}" )
+    return failures
+
+def run_throughput( backend, num_listings, num_lookups ):
+    """
+    @returns the operations per second of recording listings, of looking
+             them up, and of checking their stock in batches of 100
+    """
+    db, directory = create( backend )
+    try:
+        start = time.perf_counter()
+        record_ids = [ db.record_created_listing( str( listing_id ), f'client_{listing_id % 100}', 1 )
+                       for listing_id in range( num_listings )
+                     ]
+        db.flush()
+        recorded = num_listings / ( time.perf_counter() - start )
+
+        start = time.perf_counter()
+        for index in range( num_lookups ):
+            listing_id = db.get_listing_id( record_ids[ index % num_listings ] )
+            db.get_client_by_listing_id( listing_id )
+        looked_up = num_lookups / ( time.perf_counter() - start )
+
+        start = time.perf_counter()
+        for index in range( 0, num_lookups, 100 ):
+            batch = record_ids[ index % num_listings:index % num_listings + 100 ]
+            records = db.get_stock_records( batch )
+            db.update_listings_stock( { record_id: record[ 2 ] + 1 for record_id, record in records.items() } )
+        db.flush()
+        checked = num_lookups / ( time.perf_counter() - start )
+    finally:
+        db.close()
+        directory.cleanup()
+
+    return recorded, looked_up, checked
+
+def main():
+    parser = argparse.ArgumentParser( description = "Check and measure the DBConnection backends" )
+    parser.add_argument( '--backend', choices = list( BACKENDS ), action = 'append',
+                         help = "A backend to check, by default all of them" )
+    parser.add_argument( '--listings', type = int, default = 2000, help = "Listings recorded to measure throughput" )
+    parser.add_argument( '--lookups', type = int, default = 20000, help = "Lookups made to measure throughput" )
+    parser.add_argument( '--no_throughput', action = 'store_true', help = "Only run the checks" )
+    args = parser.parse_args()
+
+    backends = args.backend or list( BACKENDS )
+    failures = 0
+    for backend in backends:
+        print( backend )
+        failures += run_checks( backend )
+
+    if not args.no_throughput:
+        print( f"\nthroughput, in operations per second: {args.listings} listings, {args.lookups} lookups" )
+        print( f"  {'backend':<30} {'record':>10} {'lookup':>10} {'check':>10}" )
+        for backend in backends:
+            recorded, looked_up, checked = run_throughput( backend, args.listings, args.lookups )
+            print( f"  {backend:<30} {recorded:10.0f} {looked_up:10.0f} {checked:10.0f}" )
+
+    if failures:
+        print( f"\n{failures} checks failed" )
+        sys.exit( 1 )
+
+if __name__ == '__main__':
+    main()
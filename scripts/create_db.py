@@ -1,28 +1,29 @@
 #!/usr/bin/env python3
+import argparse
+import os
 import sqlite3
+import sys
 
-def main():
-    conn = sqlite3.connect( 'wolff_db.db' )
-    c = conn.cursor()
-    c.execute( '''CREATE TABLE AppRecord ( RecordId INTEGER NOT NULL PRIMARY KEY, 
-                                           ListingValue text 
-                                         )'''
-    )
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
 
-    c.execute( '''CREATE TABLE AppUser ( EtsyListingID TEXT NOT NULL PRIMARY KEY,
-                                         ClientID TEXT
-                                       )'''
-    )
+from wolff_api_plugins.server.schema import migrate
 
-    c.execute( '''CREATE TABLE EtsyListingStock (
-                                                  RecordId INTEGER NOT NULL PRIMARY KEY,
-                                                  QuantityInStock INTEGER NOT NULL
-                                                )'''
+def main():
+    argp = argparse.ArgumentParser( description = "Create the WOLFF database, or bring the "
+                                    "schema of an existing one up to date."
     )
+    argp.add_argument( '--db_file', help = "The name of the SQLite3 database file.",
+                       type = str, default = 'wolff_db.db'
+                     )
+
+    args = argp.parse_args()
 
-    conn.commit()
+    conn = sqlite3.connect( args.db_file )
+    version = migrate( conn )
     conn.close()
 
+    print( f"{args.db_file} is at schema version {version}" )
+
 
 if __name__ == '__main__':
     main()
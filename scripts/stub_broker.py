@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+An in-process stand-in for an MQTT broker, for testing and benchmarking
+the WOLFF servers and node proxies without running a real broker. Its
+clients have the methods of paho's Client that the servers use, and are
+put in place of a server's client with use_client().
+
+As with a real broker, each client is sent the messages published to
+the topics it subscribes to, from a thread of its own, in the order they
+were published. Messages are not persisted, and QoS is ignored: a message
+published while the client is connected is acknowledged at once, and a
+message published while it is disconnected is dropped.
+"""
+import itertools
+import queue
+import threading
+import types
+
+import paho.mqtt.client as mqtt
+
+class StubBroker:
+    """
+    Routes the messages published by its clients to the clients subscribed to them.
+    """
+    def __init__( self ):
+        self._clients = list()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def client( self ):
+        """
+        @returns a new, connected StubBrokerClient
+        """
+        client = StubBrokerClient( self )
+        with self._lock:
+            self._clients.append( client )
+        return client
+
+    def publish( self, topic, payload ):
+        with self._lock:
+            self.published += 1
+            clients = [ client for client in self._clients if client.is_subscribed( topic ) ]
+            self.delivered += len( clients )
+        for client in clients:
+            client.deliver( topic, payload )
+
+    def get_deliveries( self ):
+        """
+        @returns a list of the number of messages delivered to each client
+        """
+        with self._lock:
+            return [ client.delivered for client in self._clients ]
+
+class StubBrokerClient:
+    """
+    A client of a StubBroker, standing in for a connected paho Client.
+    """
+    def __init__( self, broker ):
+        self._broker = broker
+        self._subscriptions = set()
+        self._inbox = queue.SimpleQueue()
+        self._mids = itertools.count( 1 )
+        self._connected = True
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.delivered = 0
+
+        threading.Thread( target = self._deliver_forever, daemon = True ).start()
+
+    def subscribe( self, topic, qos = 0 ):
+        self._subscriptions.add( topic )
+
+    def is_subscribed( self, topic ):
+        return any( mqtt.topic_matches_sub( subscription, topic )
+                    for subscription in list( self._subscriptions )
+                  )
+
+    def publish( self, topic, payload = None, qos = 0, retain = False ):
+        info = mqtt.MQTTMessageInfo( next( self._mids ) )
+        if not self._connected:
+            info.rc = mqtt.MQTT_ERR_NO_CONN
+            return info
+
+        self._broker.publish( topic, bytes( payload ) if payload is not None else b'' )
+        info._set_as_published()
+        return info
+
+    def disconnect( self ):
+        """
+        Imitate losing the connection to the broker.
+        """
+        self._connected = False
+        if self.on_disconnect:
+            self.on_disconnect( self, None, mqtt.MQTT_ERR_CONN_LOST )
+
+    def reconnect( self ):
+        self._connected = True
+        if self.on_connect:
+            self.on_connect( self, None, None, 0 )
+
+    def deliver( self, topic, payload ):
+        self._inbox.put( ( topic, payload ) )
+
+    def _deliver_forever( self ):
+        while True:
+            topic, payload = self._inbox.get()
+            self.delivered += 1
+            if self.on_message:
+                self.on_message( self, None, types.SimpleNamespace( topic = topic, payload = payload,
+                                                                    qos = 1, retain = False
+                ) )
+
+def use_client( server, client ):
+    """
+    Put a StubBrokerClient in place of the paho Client of an MQTTServer or
+    WOLFFNodeProxy, and connect it, subscribing it to the server's topics.
+    """
+    server._client = client
+    client.on_connect = server.on_connect
+    client.on_message = server.on_message
+    client.on_disconnect = getattr( server, 'on_disconnect', None )
+    client.reconnect()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the Etsy API, for testing and benchmarking the
+WOLFF servers without making real requests. It accepts any OAuth1
+credentials and answers the methods listed in APIMap with responses
+shaped like Etsy's.
+
+Point a server at it with --upstream_url http://127.0.0.1:<port>/v2
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+
+LISTING_RE = re.compile( r'^/v2/listings/([0-9,]+)/?$' )
+
+class StubUpstreamServer( ThreadingHTTPServer ):
+    """
+    An HTTP/1.1 server that imitates the Etsy listing methods.
+    Created listings are kept in memory.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__( self, ip = '127.0.0.1', port = 0, delay = 0.0 ):
+        """
+        @param ip The ip to listen on
+        @param port The port to listen on, if 0 a free port is chosen
+        @param delay The number of seconds to wait before answering each request,
+               to imitate the latency of the real service.
+        """
+        super().__init__( ( ip, port ), StubUpstreamHandler )
+        self.delay = delay
+        self.listings = dict()
+        self.lock = threading.Lock()
+        self.next_id = itertools.count( 1000000000 )
+        self.requests = 0
+
+    def get_base_url( self ):
+        ip, port = self.server_address
+        return f'http://{ip}:{port}/v2'
+
+    def start( self ):
+        """
+        Serve requests from a background thread.
+        """
+        thread = threading.Thread( target = self.serve_forever, daemon = True )
+        thread.start()
+        return thread
+
+class StubUpstreamHandler( BaseHTTPRequestHandler ):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message( self, format, *args ):
+        pass
+
+    def get_path( self ):
+        # APIMap joins the base url and uri with a slash, which can double it up
+        return re.sub( '/+', '/', self.path )
+
+    def _read_params( self ):
+        length = int( self.headers.get( 'Content-Length', 0 ) )
+        body = self.rfile.read( length ).decode( 'utf-8' ) if length else ''
+        return { key: values[ -1 ] for key, values in parse_qs( body ).items() }
+
+    def _respond( self, status, results ):
+        body = json.dumps( { 'count': len( results ), 'results': results } ).encode( 'utf-8' )
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def _begin( self ):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.delay:
+            time.sleep( self.server.delay )
+
+        if 'oauth_signature' not in self.headers.get( 'Authorization', '' ):
+            self._respond( 403, list() )
+            return False
+        return True
+
+    def do_POST( self ):
+        params = self._read_params()
+        if not self._begin():
+            return
+
+        if self.get_path().rstrip( '/' ) != '/v2/listings':
+            self._respond( 404, list() )
+            return
+
+        listing = dict( params )
+        listing[ 'quantity' ] = int( params.get( 'quantity', 0 ) )
+        with self.server.lock:
+            listing[ 'listing_id' ] = next( self.server.next_id )
+            self.server.listings[ listing[ 'listing_id' ] ] = listing
+
+        self._respond( 201, [ listing ] )
+
+    def do_PUT( self ):
+        params = self._read_params()
+        if not self._begin():
+            return
+
+        match = LISTING_RE.match( self.get_path() )
+        with self.server.lock:
+            listing = self.server.listings.get( int( match.group( 1 ) ) ) if match else None
+            if listing is None:
+                self._respond( 404, list() )
+                return
+
+            listing.update( params )
+            if 'quantity' in params:
+                listing[ 'quantity' ] = int( params[ 'quantity' ] )
+
+        self._respond( 200, [ listing ] )
+
+    def do_GET( self ):
+        if not self._begin():
+            return
+
+        match = LISTING_RE.match( self.get_path() )
+        if not match:
+            self._respond( 404, list() )
+            return
+
+        # like Etsy, several comma-separated listing ids may be requested at once
+        with self.server.lock:
+            results = [ self.server.listings[ int( listing_id ) ]
+                        for listing_id in match.group( 1 ).split( ',' )
+                        if int( listing_id ) in self.server.listings
+                      ]
+        self._respond( 200 if results else 404, results )
+
+def main():
+    argp = argparse.ArgumentParser( description = "Run a local stand-in for the Etsy API." )
+    argp.add_argument( '--ip', help = "The IP address to listen on.", default = '127.0.0.1' )
+    argp.add_argument( '--port', help = "The port to listen on.", type = int, default = 8080 )
+    argp.add_argument( '--delay', help = "Seconds to wait before answering each request.",
+                       type = float, default = 0.0
+                     )
+
+    args = argp.parse_args()
+
+    server = StubUpstreamServer( args.ip, args.port, delay = args.delay )
+    print( f"Serving a stub upstream at {server.get_base_url()}" )
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 import wolff_api_plugins.server.server as wolff_server
 import wolff_api_plugins.server.DBConnection as wolff_db
+from wolff_api_plugins.server.session_pool import SessionPool
+from wolff_api_plugins.server.lookup_cache import CachingDBConnection
+from wolff_api_plugins.server.transport import RequestsTransport, AsyncioTransport
+from wolff_api_plugins.server.api_map import APIMap
+from wolff_api_plugins.common.tracing import Tracer
+from wolff_api_plugins.common.metrics import MetricsRegistry, MetricsServer
 import argparse
+import atexit
 
 def main():
     argp = argparse.ArgumentParser( description = "Start a WOLFF server than can handle HTTP requests." )
@@ -14,12 +21,114 @@ def main():
                        "SQLite3 database containing WOLFF information. ",
                        type = str, default = 'wolff_db.db'
                      )
+    argp.add_argument( '--db_synchronous', help = "When SQLite waits for writes to reach the "
+                       "disk. With 'normal', the last transactions committed can be lost to a "
+                       "power failure or an OS crash, but never to the server crashing. 'full' "
+                       "waits for every commit to reach the disk.", choices = [ 'normal', 'full' ],
+                       default = 'normal'
+                     )
+    argp.add_argument( '--stock_write_interval', help = "If greater than 0, listing stock is "
+                       "written to the database behind the requests that change it, every this "
+                       "many seconds. Stock changed since the last write is lost if the server is "
+                       "killed or crashes.", type = float, default = 0
+                     )
+    argp.add_argument( '--stock_write_batch', help = "With --stock_write_interval, stock is also "
+                       "written as soon as the stock of this many listings is waiting.",
+                       type = int, default = 256
+                     )
+    argp.add_argument( '--lookup_cache_size', help = "The maximum number of mappings between "
+                       "listings, their record ids and their clients cached in memory, for each "
+                       "kind of mapping. If 0, every lookup is made in the database.",
+                       type = int, default = 65536
+                     )
+    argp.add_argument( '--session_pool_size', help = "The maximum number of client sessions "
+                       "kept open for reuse. If 0, a new session is created for every request.",
+                       type = int, default = 128
+                     )
+    argp.add_argument( '--session_idle_timeout', help = "The number of seconds a client session "
+                       "may go unused before it is closed.", type = float, default = 300
+                     )
+    argp.add_argument( '--session_pool_maxsize', help = "The maximum number of connections each "
+                       "client session keeps open to a host.", type = int, default = 8
+                     )
+    argp.add_argument( '--transport', help = "How requests are made to services. 'requests' "
+                       "makes each request on a thread of its own, 'asyncio' makes requests "
+                       "from a single event loop.", choices = [ 'requests', 'asyncio' ],
+                       default = 'requests'
+                     )
+    argp.add_argument( '--max_in_flight', help = "The maximum number of requests to services "
+                       "in flight at once with the 'asyncio' transport.", type = int, default = 256
+                     )
+    argp.add_argument( '--upstream_url', help = "Replace Etsy's base url, for example with the "
+                       "url of a local stub server.", type = str, default = None
+                     )
+    argp.add_argument( '--client_watch_interval', help = "If greater than 0, the clients "
+                       "directory is checked for changes every this many seconds, and clients "
+                       "are reloaded when it changes.", type = float, default = 0
+                     )
+    argp.add_argument( '--framing', help = "How messages are framed on client connections. "
+                       "'opcode' is understood by every client, 'length' prefixes each message "
+                       "with its length.", choices = [ 'opcode', 'length' ], default = 'opcode'
+                     )
+    argp.add_argument( '--mode', help = "How client connections are served. 'serial' handles "
+                       "one connection at a time, 'threaded' handles up to --max_workers "
+                       "connections concurrently.", choices = wolff_server.WOLFFServer.MODES,
+                       default = wolff_server.WOLFFServer.SERIAL
+                     )
+    argp.add_argument( '--max_workers', help = "The maximum number of connections handled "
+                       "concurrently in 'threaded' mode.", type = int, default = 8
+                     )
+    argp.add_argument( '--trace_file', help = "A file the stages of handling each message "
+                       "are appended to, with their latency, as lines of JSON.", default = None
+                     )
+    argp.add_argument( '--metrics_port', help = "If greater than 0, the server's metrics are "
+                       "served at http://127.0.0.1:<port>/metrics, in the Prometheus text format.",
+                       type = int, default = 0
+                     )
 
     args = argp.parse_args()
 
 
-    connection = wolff_db.SQLite3DBConnection( args.db_file )
-    server = wolff_server.WOLFFServer( connection, ip = args.ip, port = args.port )
+    connection = wolff_db.SQLite3DBConnection( args.db_file, synchronous = args.db_synchronous,
+                                               stock_write_interval = args.stock_write_interval,
+                                               stock_write_batch = args.stock_write_batch
+    )
+    connection.migrate()
+    session_pool = SessionPool( max_sessions = args.session_pool_size,
+                                idle_timeout = args.session_idle_timeout,
+                                pool_maxsize = args.session_pool_maxsize
+                              )
+    if args.transport == 'asyncio':
+        transport = AsyncioTransport( max_in_flight = args.max_in_flight )
+    else:
+        transport = RequestsTransport( session_pool )
+
+    api_map = APIMap( base_urls = { 'etsy': args.upstream_url } if args.upstream_url else None )
+
+    # the latency of each stage is printed when the server exits
+    tracer = Tracer( export_file = args.trace_file )
+    atexit.register( lambda: print( tracer.format_report() ) )
+
+    metrics_registry = MetricsRegistry()
+    if args.metrics_port > 0:
+        MetricsServer( metrics_registry, port = args.metrics_port ).start()
+
+    if args.lookup_cache_size > 0:
+        connection = CachingDBConnection( connection, max_entries = args.lookup_cache_size,
+                                          metrics_registry = metrics_registry
+        )
+
+    server = wolff_server.WOLFFServer( connection, ip = args.ip, port = args.port,
+                                       mode = args.mode,
+                                       max_workers = args.max_workers,
+                                       client_watch_interval = args.client_watch_interval,
+                                       session_pool = session_pool,
+                                       transport = transport,
+                                       api_map = api_map,
+                                       framing = args.framing,
+                                       tracer = tracer,
+                                       metrics_registry = metrics_registry
+                                     )
 
     server.start()
 
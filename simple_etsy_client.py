@@ -3,6 +3,7 @@ import wolff_api_plugins.client.api_hook as hook
 import wolff_api_plugins.client.client as client
 import wolff_api_plugins.client.server_connection as conn
 import wolff_api_plugins.client.message as message
+from wolff_api_plugins.common.tracing import Tracer
 import json
 import sys
 import time
@@ -27,6 +28,13 @@ def main():
                        "the listings that have been created. This will be used by the script that updates "
                        "listings.", default = "submitted_listings.json"
                      )
+    argp.add_argument( '--batch_size', help = "The number of listings to create. If more "
+                       "than 1, the listings are sent together in a single message.",
+                       type = int, default = 1
+                     )
+    argp.add_argument( '--trace_file', help = "A file the latency of the request is appended "
+                       "to, as a line of JSON.", default = None
+                     )
 
     handlers=[
         logging.FileHandler("debug.log"),
@@ -48,6 +56,8 @@ def main():
                                f"--ip: {cli_args.ip}\n"
                                f"--port: {cli_args.port}\n"
                                f"--log_file: {cli_args.log_file}\n"
+                               f"--batch_size: {cli_args.batch_size}\n"
+                               f"--trace_file: {cli_args.trace_file}\n"
     )
 
 
@@ -63,6 +73,12 @@ def main():
                                      name = 'create_listing'
                                    )
 
+    create_listing_batch = hook.APIMethod( uri = 'listings',
+                                           args = { 'listings': [] },
+                                           http_method = 'post',
+                                           name = 'create_listing_batch'
+                                         )
+
 
     connect = conn.TCPServerConnection( ip = cli_args.ip,
                                          port = cli_args.port
@@ -76,13 +92,12 @@ def main():
     #                      )
 
     etsy_hook = hook.APIHook( service = 'etsy',
-                              methods = [ create_listing ]
+                              methods = [ create_listing, create_listing_batch ]
                             )
 
 
-    start_time = time.time()
-
-    logging.getLogger().info( f"TIMESTAMP Beginning of request: {start_time}" )
+    tracer = Tracer( export_file = cli_args.trace_file )
+    trace = tracer.start_trace()
 
     etsy_client = client.Client( connection = connect, endpoint = etsy_hook,
                                  message_type = message.EtsyMessage
@@ -95,23 +110,39 @@ def main():
                      'price': 1.11, 'who_made': 'i_did', 'is_supply': True,
                      'when_made': 'made_to_order', 'shipping_template_id': 84634415230
     }
-    resp = etsy_client.create_listing( **request_args )
-    resp_decoded = int.from_bytes( resp[ 2 : 6 ], 'big' )
-
-    end_time = time.time()
-    logging.getLogger().info( f"TIMESTAMP End of request: {end_time}" )
-    logging.getLogger().info( f"Elapsed time: {end_time - start_time}" )
-    logging.getLogger().debug( f"ID received from server: {resp_decoded}" )
+    if cli_args.batch_size > 1:
+        trace.set_api( 'etsy', 'create_listing_batch' )
+        with trace.span( 'request' ):
+            resp = etsy_client.create_listing_batch( listings = [ request_args ] * cli_args.batch_size )
+        # a batch response is followed by the 4 byte record id of each listing
+        record_ids = [ int.from_bytes( resp[ start : start + 4 ], 'big' )
+                       for start in range( 3, len( resp ), 4 )
+                     ]
+    else:
+        trace.set_api( 'etsy', 'create_listing' )
+        with trace.span( 'request' ):
+            resp = etsy_client.create_listing( **request_args )
+        record_ids = [ int.from_bytes( resp[ 2 : 6 ], 'big' ) ]
+
+    trace.finish()
+    tracer.log_report()
+    tracer.close()
+    logging.getLogger().debug( f"IDs received from server: {record_ids}" )
 
     logging.getLogger().debug( f"Opening {cli_args.output_submitted} to write listing record" )
 
     with open( cli_args.output_submitted, 'a' ) as output_file:
-        request_args[ 'listing_id' ] = resp_decoded
-        to_write = json.dumps( request_args )
+        for record_id in record_ids:
+            # 0 is sent for listings that could not be created
+            if not record_id:
+                continue
+
+            request_args[ 'listing_id' ] = record_id
+            to_write = json.dumps( request_args )
 
-        logging.getLogger().debug( f"String that will be written to file: {to_write}" )
-        output_file.write( f"{to_write}\n" )
-        logging.getLogger().debug( f"Wrote record to file" )
+            logging.getLogger().debug( f"String that will be written to file: {to_write}" )
+            output_file.write( f"{to_write}\n" )
+            logging.getLogger().debug( f"Wrote record to file" )
         
 
 
@@ -11,7 +11,8 @@ def main():
         print( auth.as_dict() )
 
         connect = conn.TCPServerConnection( ip = "127.0.0.1",
-                                            port = 5555
+                                            port = 5555,
+                                            framing = 'json'
         )
 
         args = { 'blog_id': '' }
@@ -5,6 +5,7 @@ import socket
 import time
 import sys
 import argparse
+from wolff_api_plugins.common.tracing import Tracer
 
 
 def main():
@@ -22,6 +23,9 @@ def main():
     argp.add_argument( '--log_file', help = "The name of the file to write log "
                        "information to.", default = "update_listing.log"
                      )
+    argp.add_argument( '--trace_file', help = "A file the latency of the request is appended "
+                       "to, as a line of JSON.", default = None
+                     )
 
     args = argp.parse_args()
 
@@ -45,6 +49,7 @@ def main():
                                f"--listings_file: {args.listings_file}\n"
                                f"{update_str}"
                                f"--log_file: {args.log_file}\n"
+                               f"--trace_file: {args.trace_file}\n"
     )
 
     listings = list()
@@ -80,28 +85,30 @@ def main():
     logging.getLogger().debug( f"Post-encoded update message: {request_string}" )
     logging.getLogger().debug( f"Attempting to connect to server at IP: {args.ip}, Port: {args.port}" )
 
-    start_time = time.time()
-    logging.getLogger().info( f"TIMESTAMP Beginning of request: {start_time}" )
+    tracer = Tracer( export_file = args.trace_file )
+    trace = tracer.start_trace()
+    trace.set_api( *request_dict[ 'api_details' ] )
+
     with socket.socket( socket.AF_INET, socket.SOCK_STREAM ) as s:
-        s.connect( ( args.ip, args.port ) )
+        with trace.span( 'connect' ):
+            s.connect( ( args.ip, args.port ) )
 
         logging.getLogger().debug( f"Successfully connected to server." )
         logging.getLogger().debug( f"Sending update request to server." )
 
-        s.sendall( request_string.encode( 'utf-8' ) )
+        with trace.span( 'request' ):
+            s.sendall( request_string.encode( 'utf-8' ) )
 
-        logging.getLogger().debug( f"Data succesfully sent, waiting on response..." )
+            logging.getLogger().debug( f"Data succesfully sent, waiting on response..." )
 
-        data = s.recv( 1024 )
+            # each response is a single line
+            data = s.makefile( 'rb' ).readline()
 
         logging.getLogger().debug( f"Response received from server: {data.decode( 'utf-8' )}" )
 
-    end_time = time.time()
-
-    elapsed_time = end_time - start_time
-
-    logging.getLogger().info( f"TIMESTAMP End of request: {end_time}" )
-    logging.getLogger().info( f"Elapsed time: {elapsed_time}" )
+    trace.finish()
+    tracer.log_report()
+    tracer.close()
 
 
 def craft_request( listing_dict ):
@@ -1,5 +1,6 @@
 from enum import Enum
 import logging
+from .. common import codec
 
 # TODO: Applications is duplicated between encoder/decoder
 class Applications( Enum ):
@@ -19,46 +20,32 @@ class EtsyEncoder:
         """
         CREATE_LISTING = 1
 
-    def __init__( self ):
+        CREATE_LISTING_BATCH = 4
 
-        # TODO: these maps should be placed in a 'create listing class'
-        # containing maps and their inverses
-        """
-        The title map, specifying how titles should be 
-        mapped to byte values.
-        These can be expanded until there are 0xFF values mapped.
-        """
-        self.title_map       = { 'title_1': 0x01 }
+        CHECK_LISTING_STOCK_BATCH = 5
 
-        """
-        The description map, specifying how descriptions should be 
-        mapped to byte values.
-        These can be expanded until there are 0xFF values mapped.
-        """
-        self.description_map = { 'desc_1': 0x02 }
+    """
+    The title map, specifying how titles should be 
+    mapped to byte values. Titles, and the other maps, are 
+    declared once in wolff_api_plugins.common.codec.
+    """
+    title_map       = { value: code for code, value in codec.ETSY_TITLES.items() }
 
-        """
-        Maps values for create_listing's 'who_made' enum
-        """
-        self.who_made_map    = { 'i_did': 0x01,
-                                 'collective': 0x02,
-                                 'someone_else': 0x03
-                               }
+    """
+    The description map, specifying how descriptions should be 
+    mapped to byte values.
+    """
+    description_map = { value: code for code, value in codec.ETSY_DESCRIPTIONS.items() }
 
-        """
-        Maps values for create_listing's 'when_made' enum
-        """
-        self.when_made_map   = { 'made_to_order': 0x01,
-                                 '2010_2019': 0x02,
-                                 '2000_2009': 0x03,
-                                 'before_2000': 0x04,
-                                 '1990s': 0x05,
-                                 '1980s': 0x06,
-                                 '1970s': 0x07,
-                                 '1960s': 0x08
-                                 
-                               }
+    """
+    Maps values for create_listing's 'who_made' enum
+    """
+    who_made_map    = { value: code for code, value in codec.ETSY_WHO_MADE.items() }
 
+    """
+    Maps values for create_listing's 'when_made' enum
+    """
+    when_made_map   = { value: code for code, value in codec.ETSY_WHEN_MADE.items() }
 
     def encode( self, etsy_data ):
         """
@@ -89,6 +76,65 @@ class EtsyEncoder:
     def _get_encoding_method( self, etsy_data ):
         if etsy_data[ 'method' ][ 'name' ] == 'create_listing':
             return self._encode_create_listing
+        if etsy_data[ 'method' ][ 'name' ] == 'create_listing_batch':
+            return self._encode_create_listing_batch
+        if etsy_data[ 'method' ][ 'name' ] == 'check_listing_stock_batch':
+            return self._encode_check_listing_stock_batch
+
+    def _encode_check_listing_stock_batch( self, batch_data ):
+        """
+        Encode a request that checks the stock of several listings at once.
+
+        @param batch_data a dictionary of the form:
+
+        { 'record_ids': [ record_id, ... ] }
+
+        where each record id is one returned by the server when the listing
+        was created. At most 255 records can be checked at once.
+
+        @returns the encoded message, 3 + 4 bytes for each record
+        """
+        record_ids = batch_data[ 'record_ids' ]
+        assert( 0 < len( record_ids ) and len( record_ids ) < 256 )
+
+        payload = bytearray( 3 )
+        payload[ 0 ] = Applications.ETSY.value
+        payload[ 1 ] = EtsyEncoder.Services.CHECK_LISTING_STOCK_BATCH.value
+        payload[ 2 ] = len( record_ids )
+
+        for record_id in record_ids:
+            payload += codec.ETSY_STOCK_CHECK_RECORD.encode( { 'listing_id': record_id } )
+
+        return payload
+
+    def _encode_create_listing_batch( self, batch_data ):
+        """
+        Encode a request that creates several listings at once, 
+        which the server performs concurrently.
+
+        @param batch_data a dictionary of the form: 
+
+        { 'listings': [ create_listing_data, ... ] }
+
+        where each item of 'listings' is a dictionary of the form taken 
+        by _encode_create_listing. At most 255 listings can be sent at once.
+
+        @returns the encoded message, 3 + 11 bytes for each listing
+        """
+        listings = batch_data[ 'listings' ]
+        assert( 0 < len( listings ) and len( listings ) < 256 )
+
+        payload = bytearray( 3 )
+        payload[ 0 ] = Applications.ETSY.value
+        payload[ 1 ] = EtsyEncoder.Services.CREATE_LISTING_BATCH.value
+        payload[ 2 ] = len( listings )
+
+        # the application and opcode are given once, in the header
+        for listing in listings:
+            assert( listing[ 'quantity' ] > 0 and listing[ 'quantity' ] < 256 )
+            payload += codec.ETSY_CREATE_LISTING.encode( listing )
+
+        return payload
 
     def _encode_create_listing( self, create_listing_data ):
         """
@@ -109,75 +155,17 @@ class EtsyEncoder:
              
         """
         logging.getLogger().debug( "Encoding an 'etsy' 'create_listing' message" )
-        payload = bytearray( [ 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0 ] )
-        payload[ 0 ] |= Applications.ETSY.value
-        payload[ 1 ] |= EtsyEncoder.Services.CREATE_LISTING.value
-
-        title = create_listing_data[ 'title' ]
-        payload[ 2 ] |= self.title_map[ title ]
-
-        description = create_listing_data[ 'description' ]
-        payload[ 3 ] |= self.description_map[ description ]
 
         quantity = create_listing_data[ 'quantity' ]
         assert( quantity > 0 and quantity < 256 )
-        payload[ 4 ] |= quantity
-
-        price = create_listing_data[ 'price' ]
-        price_integral = int( price )
-        price_fraction = int( ( price * 100 ) % 100 )
-
-        assert( price_integral < 4095 )
-        assert( 0 <= price_fraction and price_fraction < 16 )
-
-        integral_left_8digits = price_integral // 16
-        integral_right_4digits = price_integral % 16
-        price_fraction_digits = price_fraction
-
-        payload[ 5 ] |= integral_left_8digits
-
-        integral_mask = 0b11110000
-        fraction_mask = 0b00001111
-
-        payload[ 6 ] |= ( integral_mask & ( integral_right_4digits << 4 ) ) \
-                       | ( fraction_mask & price_fraction_digits )
-
-        # who_made, when_made, is_supply
-        wm_whm_is_byte = 0x00
-        wm_whm_is_byte = 0b10000000 & ( create_listing_data[ 'is_supply' ] << 7 )
-
-        when_made = self.when_made_map[ create_listing_data[ 'when_made' ] ]
-        wm_whm_is_byte |= ( ( when_made << 4 ) & 0b01110000 )
-
-        who_made = self.who_made_map[ create_listing_data[ 'who_made' ] ]
-        wm_whm_is_byte |=  who_made
-
-        payload[ 7 ] |= wm_whm_is_byte
-
-        shipping_template_id = int( create_listing_data[ 'shipping_template_id' ] )
-
-        stp5 = shipping_template_id % 256
-        shipping_template_id //= 256
-
-        stp4 = shipping_template_id % 256
-        shipping_template_id //= 256
-
-        stp3 = shipping_template_id % 256
-        shipping_template_id //= 256
-
-        stp2 = shipping_template_id % 256
-        shipping_template_id //= 256
-
-        stp1 = shipping_template_id
 
-        payload[ 8 ]  = stp1
-        payload[ 9 ]  = stp2
-        payload[ 10 ] = stp3
-        payload[ 11 ] = stp4
-        payload[ 12 ] = stp5
+        payload = bytearray( [ Applications.ETSY.value, EtsyEncoder.Services.CREATE_LISTING.value ] )
+        payload += codec.ETSY_CREATE_LISTING.encode( create_listing_data )
 
-        encoded = ''.join( [ "%02X " %  x for x in payload ] ).strip()
-        logging.getLogger().debug( f"Message encoded by encoder: {encoded}" )
+        if logging.getLogger().isEnabledFor( logging.DEBUG ):
+            logging.getLogger().debug( "Message encoded by encoder: %s",
+                                       ' '.join( "%02X" % x for x in payload )
+            )
         
         return payload
 
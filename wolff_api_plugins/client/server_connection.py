@@ -1,23 +1,72 @@
 from .message import Message as Message
+from .. common.framing import FrameReader, get_framer
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from concurrent.futures import Future, InvalidStateError
 import paho.mqtt.client as mqtt
+import asyncio
+import select
 import socket 
 import time
 import threading
 import logging
+import uuid
 
 
 class TCPServerConnection:
     """
         A connection to a server that takes place 
         over the TCP/IP stack using TCP. 
+
+        By default a new TCP connection is opened for every message. 
+        A persistent TCPServerConnection instead keeps its connections 
+        open between messages, so only the first message pays for 
+        connecting to the server.
     """
 
     def __init__( self, ip = "127.0.0.1",
-                  port = 0
-
+                  port = 0,
+                  framing = 'opcode',
+                  persistent = False,
+                  pool_size = 1,
+                  timeout = None,
+                  retries = 1
                 ):
+        """
+        @param ip The ip of the server
+        @param port The port of the server
+        @param framing How messages are framed, this must match the 
+               framing used by the server. See wolff_api_plugins.common.framing
+        @param persistent If True, connections are kept open and reused 
+               for later messages.
+        @param pool_size The maximum number of connections a persistent 
+               TCPServerConnection keeps open to the server at once. Threads 
+               sending messages while this many connections are in use wait 
+               for one to be released. A connection that is not persistent 
+               opens one for each message, without a limit.
+        @param timeout The number of seconds to wait to connect, or for a 
+               response, before giving up. If None, wait indefinitely.
+        @param retries The number of times a message is resent on a new 
+               connection when sending it on a reused connection fails, 
+               because the connection turns out to have been closed (for 
+               example, because the server restarted). A message that was 
+               sent is never sent again, as the server may have performed 
+               its request even if it closed the connection without a response.
+        """
+        if pool_size < 1:
+            raise ValueError( "pool_size must be at least 1" )
+
         self._ip = ip
         self._port = port
+        self._framer = get_framer( framing, client = True )
+        self._persistent = persistent
+        self._timeout = timeout
+        self._retries = retries
+
+        # idle ( socket, FrameReader ) pairs, most recently used last
+        self._idle = list()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore( pool_size ) if persistent else nullcontext()
 
 
     def get_ip( self ):
@@ -33,6 +82,9 @@ class TCPServerConnection:
         when initiating a connection.
         """
         return self._port
+
+    def is_persistent( self ):
+        return self._persistent
     
     def send( self, message ):
         """
@@ -42,54 +94,206 @@ class TCPServerConnection:
         Waits for a specified amount of time 
         for a response from the server, disconnects 
         after waiting and not getting a response.
+
+        @returns the server's response
+        """
+        return self.send_many( [ message ] )[ 0 ]
+
+    def send_many( self, messages ):
+        """
+        Send several messages at once over a single connection, without 
+        waiting for the response to each before sending the next.
+
+        @param messages A list of messages
+        @returns a list of the server's responses, in the same order as messages
         """
+        data = b''.join( self._framer.encode( message.encode() ) for message in messages )
+
+        with self._slots:
+            attempts = 0
+            while True:
+                sock, reader, reused = self._acquire()
+                responses = list()
+                sent = False
+                try:
+                    logging.getLogger().debug( "Sending %d messages to the server", len( messages ) )
+                    sock.sendall( data )
+                    sent = True
+
+                    logging.getLogger().debug( "Message successfully sent, awaiting response." )
+
+                    for message in messages:
+                        response = reader.read()
+                        if response is None:
+                            raise ConnectionError( "The server closed the connection "
+                                                   "before responding"
+                            )
+                        responses.append( response )
+
+                except OSError as e:
+                    sock.close()
+
+                    # a reused connection may have been closed while it was idle, in
+                    # which case sending the messages fails and the server never saw
+                    # them. Once they are sent, the server may have performed their
+                    # requests, even if it closes the connection without responding
+                    # (as it does when handling a message fails), so they are not
+                    # sent again.
+                    if reused and not sent and not isinstance( e, socket.timeout ) \
+                       and attempts < self._retries:
+                        logging.getLogger().debug( "Reused connection failed (%s), reconnecting", e )
+                        attempts += 1
+                        self._close_idle()
+                        continue
+                    raise
+
+                self._release( sock, reader )
+                return responses
+
+    def _acquire( self ):
+        """
+        Get an idle connection, or open a new one.
+
+        @returns a tuple ( socket, FrameReader, whether the connection was reused )
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                sock, reader = self._idle.pop()
+
+            # an idle connection the server has closed, or sent anything on, 
+            # is readable, and is not used, so nothing is sent on it
+            readable, _, _ = select.select( [ sock ], [], [], 0 )
+            if not readable:
+                return sock, reader, True
+            logging.getLogger().debug( "Idle connection was closed by the server" )
+            sock.close()
+
         # open the socket using this object's host and
         logging.getLogger().debug( "Attempting to connect to server "
-                                  f"at IP: {self._ip}, Port: {self._port}"
+                                   "at IP: %s, Port: %s", self._ip, self._port
         )
-        with socket.socket( socket.AF_INET, socket.SOCK_STREAM ) as sock:
-            sock.connect( ( self._ip, self._port ) )
-            logging.getLogger().debug( "Successfully connected to the server" )
+        sock = socket.create_connection( ( self._ip, self._port ), timeout = self._timeout )
+        # messages are small, send each as soon as it is written
+        sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        logging.getLogger().debug( "Successfully connected to the server" )
 
-            encoded_message = message.encode()
+        return sock, FrameReader( sock, self._framer ), False
 
-            logging.getLogger().debug( f"Sending {encoded_message} to the server" )
-            
-            sock.sendall( encoded_message )
+    def _release( self, sock, reader ):
+        if self._persistent and not reader.get_buffered():
+            with self._lock:
+                self._idle.append( ( sock, reader ) )
+        else:
+            sock.close()
 
-            logging.getLogger().debug( f"Message successfully sent, awaiting response." )
+    def _close_idle( self ):
+        with self._lock:
+            idle = self._idle
+            self._idle = list()
+
+        for sock, reader in idle:
+            sock.close()
+
+    def close( self ):
+        """
+        Close every open connection. A persistent connection 
+        can still be used afterward, and reconnects when it is.
+        """
+        self._close_idle()
 
-            # if timeout is not inf set the timeout
-            return sock.recv( 4096 )
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
 
 class MQTTServerConnection:
     """
     A delay-tolerant connection to an MQTT broker.
-    Clients can send a message to the broker and check 
-    to see if any responses have been sent. 
+    Clients can send a message to the broker and wait for its response, 
+    or check to see if any responses have been sent. 
+
+    Each message is posted to 'posts/<client id>/req/<request id>', where the 
+    request id is unique to the message and is returned by send(), and its 
+    response is received on 'responses/<client id>/req/<request id>'. The 
+    server handles a message posted to such a topic only once, however many 
+    times it is delivered.
+
+    Memory is bounded: the inbox keeps the last inbox_size messages received, 
+    and at most max_requests sent messages are remembered, with their response 
+    once it arrives, until the response is collected.
     """
     def __init__( self, ip = "127.0.0.1",
                   port = 0,
-                  timeout = 60
-
+                  timeout = 60,
+                  client_id = "1",
+                  inbox_size = 1024,
+                  max_requests = 1024
                 ):
+        """
+        @param ip The ip of the MQTT broker
+        @param port The port of the MQTT broker
+        @param timeout The keepalive of the connection to the broker, in seconds
+        @param client_id The id of this client, which must differ from every 
+               other client's: it is the id of the session kept by the broker, 
+               and messages are posted and their responses received under it.
+        @param inbox_size The number of messages kept for check_for_messages(). 
+               Once it is full, the oldest message is dropped for each new one.
+        @param max_requests The number of sent messages whose response is kept 
+               for wait_for_response(). Once this many are waiting, the oldest 
+               is forgotten for each new one, and its future is cancelled.
+        """
+        if '/' in client_id or '+' in client_id or '#' in client_id:
+            raise ValueError( f"Invalid client id '{client_id}', it cannot contain '/', '+' or '#'" )
+        if inbox_size < 1:
+            raise ValueError( "inbox_size must be at least 1" )
+        if max_requests < 1:
+            raise ValueError( "max_requests must be at least 1" )
+
         self._ip = ip
         self._port = port
         self._timeout = timeout
+        self._client_id = client_id
         self._channels = set()
-        self._received_messages = list()
+        self._received_messages = deque( maxlen = inbox_size )
+        self._dropped_messages = 0
+        # request id -> Future of its response, oldest first
+        self._requests = OrderedDict()
+        self._max_requests = max_requests
         self._lock = threading.Lock()
+        self._started = False
         self._connected = False
-            
+
+        # the responses to this client's messages, see send()
+        self._channels.add( self.get_response_topic() )
+
         def on_message( client, userdata, msg ):
             """
             Callback used by paho-mqtt on receipt of message.
             """
-            self._lock.acquire()
-            self._received_messages.append( ( str( msg.topic ), str( msg.payload ) ) )
-            self._lock.release()
-
-        def on_disconnect( client, userdata, flags, rc ):
+            payload = bytes( msg.payload )
+            # topic is of the form responses/<client id>/req/<request id>
+            levels = msg.topic.split( '/' )
+            with self._lock:
+                if len( self._received_messages ) == self._received_messages.maxlen:
+                    self._dropped_messages += 1
+                self._received_messages.append( ( msg.topic, payload ) )
+
+                future = None
+                if len( levels ) == 4 and levels[ 1 ] == self._client_id and levels[ 2 ] == 'req':
+                    future = self._requests.get( levels[ 3 ] )
+
+            # a response delivered again is ignored, as is the response to a 
+            # message forgotten, and its future cancelled, in the meantime
+            if future is not None:
+                try:
+                    future.set_result( payload )
+                except InvalidStateError:
+                    pass
+
+        def on_disconnect( client, userdata, rc ):
             self._connected = False
 
         def on_connect( client, userdata, flags, rc ):
@@ -97,15 +301,14 @@ class MQTTServerConnection:
 
             for item in self.get_channels():
                 client.subscribe( item, qos = 1 ) 
-                
-        # client id initialized to 1 for now, we want a better way to identify clients
-        self._client = mqtt.Client( client_id = "1", clean_session = False )
+
+        self._client = mqtt.Client( client_id = self._client_id, clean_session = False )
         self.on_message = on_message
         self.on_connect = on_connect
         self.on_disconnect = on_disconnect
 
     def get_channels( self ):
-        return self._channels
+        return set( self._channels )
 
     def get_ip( self ):
         return self._ip
@@ -116,8 +319,24 @@ class MQTTServerConnection:
     def get_timeout( self ):
         return self._timeout
 
+    def get_client_id( self ):
+        return self._client_id
+
+    def get_response_topic( self ):
+        """
+        @returns the topic filter the responses to this client's messages match
+        """
+        return f"responses/{self._client_id}/#"
+
     def get_received_messages( self ):
-        return self._received_messages 
+        with self._lock:
+            return list( self._received_messages )
+
+    def get_dropped_messages( self ):
+        """
+        @returns the number of messages dropped from the inbox because it was full
+        """
+        return self._dropped_messages
 
     def check_for_messages( self ):
         """
@@ -125,15 +344,12 @@ class MQTTServerConnection:
         Uses this class' mutex to avoid race conditions with the message-watch thread.
         
         @note Calling this method clears the cache of any existing messages
-        @returns  A list of string messages that have been received by the client
+        @returns  A list of ( topic, payload ) tuples of the messages that have been 
+                  received by the client, oldest first, with each payload as bytes
         """
-
-        self._lock.acquire()
-
-        ret = self.get_received_messages()
-        self._received_messages = list()
-
-        self._lock.release()
+        with self._lock:
+            ret = list( self._received_messages )
+            self._received_messages.clear()
 
         return ret
 
@@ -142,44 +358,117 @@ class MQTTServerConnection:
         Return this class' client, optionally connect 
         to the MQTT broker
         If connect is true, a thread will be started that 
-        watches for messages.
+        watches for messages. The client is only connected once, 
+        and reconnects by itself if the connection is lost.
         """
         self._client.on_message = self.on_message
         self._client.on_connect = self.on_connect
         self._client.on_disconnect = self.on_disconnect
 
         if connect:
-            self._client.connect( self.get_ip(),
-                                  self.get_port(),
-                                  self.get_timeout()
-                                )
-            self._client.loop_start()
+            with self._lock:
+                start = not self._started
+                self._started = True
+            if start:
+                self._client.connect( self.get_ip(),
+                                      self.get_port(),
+                                      self.get_timeout()
+                                    )
+                self._client.loop_start()
         return self._client
 
 
     def subscribe_to( self, topic ):
         self._channels.add( topic )
+        if self._connected:
+            self._client.subscribe( topic, qos = 1 )
         self.get_client( connect = True )
 
+    def send_async( self, message ):
+        """
+        Sends a message to the broker through the client.
+
+        @param message The message to send
+        @returns a concurrent.futures.Future whose result is the response, as 
+                 bytes. Use asyncio.wrap_future() to await it from a coroutine. 
+                 The message is forgotten once the future is done.
+        """
+        request_id, future = self._send( message )
+
+        def forget( future ):
+            with self._lock:
+                self._requests.pop( request_id, None )
+
+        future.add_done_callback( forget )
+        return future
+
     def send( self, message ):
         """
         Sends a message to the broker through the client.
-        Subscribes to the topic where the response will be sent. 
 
         @param message The message to send
-        @returns  status of the attempt to send the message
+        @returns the request id of the message, to wait for its response with
         """
-        # connect if we are not already connected
-        client = self.get_client( connect = not self._connected )
-        service_topic = f"{message.get_data()[ 'service' ]}/" \
-                        f"{message.get_data()[ 'name']}"
+        return self._send( message )[ 0 ]
 
-        post_topic = f"posts/{service_topic}"
-        resp_topic = f"responses/{service_topic}/{client.get_id()}" 
+    def _send( self, message ):
+        """
+        @returns the request id of the message, and the Future of its response
+        """
+        # connect if we are not already connected
+        client = self.get_client( connect = True )
+
+        request_id = uuid.uuid4().hex
+        future = Future()
+        forgotten = list()
+        with self._lock:
+            self._requests[ request_id ] = future
+            while len( self._requests ) > self._max_requests:
+                forgotten.append( self._requests.popitem( last = False )[ 1 ] )
+
+        # cancelling a future runs its callbacks, which may take the lock
+        for forgotten_future in forgotten:
+            forgotten_future.cancel()
+
+        # the server publishes the response to a message posted to 'posts/<rest>'
+        # to 'responses/<rest>', so only this client's responses are received
+        client.publish( f"posts/{self._client_id}/req/{request_id}", message.encode(), qos = 1 )
+        return request_id, future
+
+    def wait_for_response( self, request_id, timeout = None ):
+        """
+        Wait for the response to a message, and forget the message.
+
+        @param request_id The request id returned by send()
+        @param timeout The number of seconds to wait, or None to wait as long as necessary
+        @returns the response, as bytes
+        @throws KeyError if no message with request_id is remembered, e.g. because 
+                its response was already collected
+        @throws TimeoutError if the response does not arrive in time. The 
+                message is still remembered, and can be waited for again.
+        @throws concurrent.futures.CancelledError if the message was forgotten 
+                while waiting, because max_requests more were sent
+        """
+        with self._lock:
+            future = self._requests[ request_id ]
 
-        if resp_topic not in self.get_channels():
-            self.subscribe_to( resp_topic )
+        response = future.result( timeout )
+        with self._lock:
+            self._requests.pop( request_id, None )
+        return response
 
-        ret = self._client.publish( post_topic, message.encode() )
-        return ret.mid
+    async def request( self, message, timeout = None ):
+        """
+        Send a message, and wait for its response without blocking the event loop.
 
+        @param message The message to send
+        @param timeout The number of seconds to wait, or None to wait as long as necessary
+        @returns the response, as bytes
+        @throws asyncio.TimeoutError if the response does not arrive in time
+        """
+        request_id, future = self._send( message )
+        try:
+            return await asyncio.wait_for( asyncio.wrap_future( future ), timeout )
+        finally:
+            with self._lock:
+                self._requests.pop( request_id, None )
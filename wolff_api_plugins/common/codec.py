@@ -0,0 +1,274 @@
+"""
+Declarative layouts for the binary WOLFF messages.
+
+Each message is described once, as a list of fields, and the list is
+compiled into a single struct.Struct that unpacks or packs every field
+of the message in one call (see Layout). The client's encoder and the
+server's decoder share the layouts, so the two cannot disagree about
+a format.
+
+Details of the encoded messages can be found here:
+https://github.com/CANIS-NAU/WOLFF_Protocol/wiki
+"""
+import struct
+
+class Field:
+    """
+    A value stored in a single struct item, optionally
+    mapped to and from the codes that are sent.
+    """
+    def __init__( self, name, format, values = None ):
+        """
+        @param name The name of the field in decoded messages
+        @param format The struct format character of the field, e.g. 'B' or 'I'
+        @param values A dictionary mapping the codes sent to the values they
+               represent, or None if the value is sent as is.
+        """
+        self.name = name
+        self.format = format
+        self._values = values
+
+    def compile( self, prefix, items, namespace ):
+        """
+        Get the source of the expressions that decode and encode this field.
+        Every kind of field implements this method.
+
+        @param prefix A prefix unique to this field, for the names it adds to namespace
+        @param items The names of the variables holding the struct items of this field
+        @param namespace The globals of the compiled code, which the field can add to
+        @returns a tuple ( [ ( name, decoding expression ) ], [ encoding expression ] ),
+                 where the encoding expressions compute the struct items of the
+                 field from the dictionary 'data'.
+        """
+        item, = items
+        value = f'data[ {self.name!r} ]'
+
+        if not self._values:
+            return [ ( self.name, item ) ], [ value ]
+
+        namespace[ f'{prefix}_values' ] = self._values
+        namespace[ f'{prefix}_codes' ] = { value: code for code, value in self._values.items() }
+        return [ ( self.name, f'{prefix}_values[ {item} ]' ) ], [ f'{prefix}_codes[ {value} ]' ]
+
+class BitFields:
+    """
+    Several small values packed into the bits of a single struct item.
+    """
+    def __init__( self, format, *fields ):
+        """
+        @param format The struct format character of the item holding the bits
+        @param fields Tuples ( name, shift, width, values ), where shift is the
+               position of the lowest bit of the value, width its number of
+               bits, and values a dictionary mapping codes to values, or None.
+        """
+        self.format = format
+        self._fields = fields
+
+    def compile( self, prefix, items, namespace ):
+        item, = items
+        decoders = list()
+        encoders = list()
+
+        for number, ( name, shift, width, values ) in enumerate( self._fields ):
+            mask = ( 1 << width ) - 1
+            code = f'( {item} >> {shift} ) & {mask}'
+            value = f'data[ {name!r} ]'
+
+            if values:
+                namespace[ f'{prefix}_{number}_values' ] = values
+                namespace[ f'{prefix}_{number}_codes' ] = { value: code for code, value in values.items() }
+                code = f'{prefix}_{number}_values[ {code} ]'
+                value = f'{prefix}_{number}_codes[ {value} ]'
+
+            decoders.append( ( name, code ) )
+            encoders.append( f'( _fit( {value}, {mask}, {name!r} ) << {shift} )' )
+
+        return decoders, [ ' | '.join( encoders ) ]
+
+class PriceField:
+    """
+    A price in two bytes: a 12-bit integral part followed by a 4-bit
+    fractional part, in hundredths. Only fractions below 0.16 can be sent.
+    """
+    format = 'H'
+
+    def __init__( self, name ):
+        self.name = name
+
+    def compile( self, prefix, items, namespace ):
+        item, = items
+        return [ ( self.name, f'( {item} >> 4 ) + ( {item} & 0x0F ) / 100.0' ) ], \
+               [ f'_encode_price( data[ {self.name!r} ] )' ]
+
+class UInt40Field:
+    """
+    A 5-byte unsigned big endian integer, such as an Etsy shipping template id.
+    """
+    format = 'BI'
+
+    def __init__( self, name ):
+        self.name = name
+
+    def compile( self, prefix, items, namespace ):
+        high, low = items
+        value = f'int( data[ {self.name!r} ] )'
+        return [ ( self.name, f'( {high} << 32 ) | {low}' ) ], \
+               [ f'{value} >> 32', f'{value} & 0xFFFFFFFF' ]
+
+class Padding:
+    """
+    Bytes that are sent as zeros, and ignored when received.
+    """
+    def __init__( self, size ):
+        self.format = f'{size}x'
+
+    def compile( self, prefix, items, namespace ):
+        return list(), list()
+
+def _fit( code, mask, name ):
+    """
+    Check that a code fits in the bits of a BitFields value.
+    """
+    if code & ~mask:
+        raise ValueError( f"{name} value {code} does not fit in its bits" )
+    return code
+
+def _encode_price( price ):
+    integral = int( price )
+    fraction = int( ( price * 100 ) % 100 )
+
+    if integral >= 4095 or not 0 <= fraction < 16:
+        raise ValueError( f"The price {price} cannot be encoded" )
+    return ( integral << 4 ) | fraction
+
+class Layout:
+    """
+    The layout of a message. Each layout is compiled, when it is created,
+    into a function that decodes the message with a single unpack_from()
+    and builds the dictionary of its values directly, and a function that
+    encodes the message with a single pack(), so decoding and encoding
+    cost no more than the struct calls and the expressions of the fields.
+    """
+    def __init__( self, *fields ):
+        """
+        @param fields The fields of the message, in the order they are sent.
+        """
+        self._struct = struct.Struct( '>' + ''.join( field.format for field in fields ) )
+        self.size = self._struct.size
+
+        namespace = { 'unpack_from': self._struct.unpack_from,
+                      'pack': self._struct.pack,
+                      '_fit': _fit,
+                      '_encode_price': _encode_price
+                    }
+        decoders = list()
+        encoders = list()
+        items = list()
+
+        for number, field in enumerate( fields ):
+            # the number of struct items in the field, padding has none
+            count = len( struct.unpack( '>' + field.format,
+                                        bytes( struct.calcsize( '>' + field.format ) )
+                       ) )
+            field_items = [ f'_{len( items ) + index}' for index in range( count ) ]
+            items += field_items
+
+            field_decoders, field_encoders = field.compile( f'_field{number}', field_items, namespace )
+            decoders += field_decoders
+            encoders += field_encoders
+
+        entries = ', '.join( f'{name!r}: {expression}' for name, expression in decoders )
+        source = f"def decode( buffer, offset ):\n" \
+                 f"    {', '.join( items )}, = unpack_from( buffer, offset )\n" \
+                 f"    return {{ {entries} }}\n" \
+                 f"def encode( data ):\n" \
+                 f"    return pack( {', '.join( encoders )} )\n"
+
+        exec( compile( source, f'<Layout {self._struct.format}>', 'exec' ), namespace )
+        self._decode = namespace[ 'decode' ]
+        self._encode = namespace[ 'encode' ]
+        self.source = source
+
+    def decode( self, buffer, offset = 0 ):
+        """
+        Decode the message at offset in buffer. The buffer can be any object
+        supporting the buffer protocol, such as bytes or a memoryview,
+        and is not copied.
+
+        @returns a dictionary mapping the names of the fields to their values
+        """
+        return self._decode( buffer, offset )
+
+    def encode( self, data ):
+        """
+        Encode a dictionary mapping the names of the fields to their values.
+
+        @returns the encoded message, as bytes
+        """
+        try:
+            return self._encode( data )
+        except struct.error as e:
+            raise ValueError( f"Unable to encode {data}: {e}" )
+
+"""
+The values of the enumerated fields of Etsy's create_listing.
+"""
+ETSY_TITLES       = { 0x01: 'title_1' }
+ETSY_DESCRIPTIONS = { 0x02: 'desc_1' }
+ETSY_WHO_MADE     = { 0x01: 'i_did',
+                      0x02: 'collective',
+                      0x03: 'someone_else'
+                    }
+ETSY_WHEN_MADE    = { 0x01: 'made_to_order',
+                      0x02: '2010_2019',
+                      0x03: '2000_2009',
+                      0x04: 'before_2000',
+                      0x05: '1990s',
+                      0x06: '1980s',
+                      0x07: '1970s',
+                      0x08: '1960s'
+                    }
+
+"""
+The two bytes at the start of every message: the application and the opcode.
+"""
+HEADER = Layout( Field( 'application', 'B' ), Field( 'opcode', 'B' ) )
+
+"""
+The 11 bytes of an Etsy create_listing message that follow its header.
+"""
+ETSY_CREATE_LISTING = Layout( Field( 'title', 'B', ETSY_TITLES ),
+                              Field( 'description', 'B', ETSY_DESCRIPTIONS ),
+                              Field( 'quantity', 'B' ),
+                              PriceField( 'price' ),
+                              BitFields( 'B', ( 'is_supply', 7, 1, None ),
+                                              ( 'when_made', 4, 3, ETSY_WHEN_MADE ),
+                                              ( 'who_made', 0, 4, ETSY_WHO_MADE )
+                              ),
+                              UInt40Field( 'shipping_template_id' )
+                            )
+
+"""
+The 11 bytes of an Etsy check_listing_stock message that follow its header.
+"""
+ETSY_CHECK_LISTING_STOCK = Layout( Field( 'listing_id', 'I' ),
+                                   Padding( 7 )
+                                 )
+
+"""
+A record id of an Etsy check_listing_stock_batch message, which follows
+its header and count once for each listing checked. As in check_listing_stock,
+the record id of a listing is sent as its 'listing_id'.
+"""
+ETSY_STOCK_CHECK_RECORD = Layout( Field( 'listing_id', 'I' ) )
+
+"""
+The number of a listing sold, in the response to a check_listing_stock_batch
+message, once for each listing checked. It is signed, as stock may be added.
+"""
+ETSY_STOCK_CHECK_SOLD = Layout( Field( 'sold', 'i' ) )
+
+"""
+The number sold sent for a listing whose stock could not be checked.
+"""
+STOCK_CHECK_FAILED = -0x80000000
@@ -0,0 +1,253 @@
+"""
+Framing for messages sent over a TCP stream.
+
+TCP does not preserve message boundaries: one recv() may return part
+of a message, or several messages at once. A framer describes where
+each message begins and ends within a stream, so messages can be
+reassembled from whatever recv() returns, and several messages can be
+pipelined over a single connection.
+"""
+import json
+import logging
+import struct
+
+class LengthPrefixFramer:
+    """
+    Frames each message with a 2-byte (big endian) length prefix.
+    """
+    HEADER = struct.Struct( '!H' )
+    MAX_SIZE = 0xFFFF
+
+    def encode( self, message ):
+        if len( message ) > LengthPrefixFramer.MAX_SIZE:
+            raise ValueError( f"A message of {len( message )} bytes is too large to frame, "
+                              f"the maximum is {LengthPrefixFramer.MAX_SIZE}"
+            )
+        return LengthPrefixFramer.HEADER.pack( len( message ) ) + bytes( message )
+
+    def find_frame( self, buffer, start ):
+        """
+        Find the frame at the start of a buffer.
+
+        @param buffer A bytearray of data received from the stream
+        @param start The offset in buffer the frame starts at
+        @returns a tuple ( message start, message end, frame end ) of offsets
+                 into buffer, or None if buffer does not yet contain
+                 the complete frame.
+        """
+        header_end = start + LengthPrefixFramer.HEADER.size
+        if len( buffer ) < header_end:
+            return None
+
+        size, = LengthPrefixFramer.HEADER.unpack_from( buffer, start )
+        if len( buffer ) < header_end + size:
+            return None
+        return header_end, header_end + size, header_end + size
+
+def counted_size( item_size, header_size = 3 ):
+    """
+    Get a function that sizes messages made of a header, whose last byte
+    is a count of items, followed by that many items of item_size bytes.
+    """
+    def get_size( buffer, start ):
+        if len( buffer ) < start + header_size:
+            return None
+        return header_size + buffer[ start + header_size - 1 ] * item_size
+    return get_size
+
+"""
+The sizes of binary WOLFF messages that are not 13 bytes long, by
+( application, opcode ), for requests sent by clients and for the
+responses sent back to them.
+"""
+REQUEST_SIZES  = { ( 0x01, 0x04 ): counted_size( 11 ),
+                   ( 0x01, 0x05 ): counted_size( 4 )
+                 }
+RESPONSE_SIZES = { ( 0x01, 0x04 ): counted_size( 4 ),
+                   ( 0x01, 0x05 ): counted_size( 4 )
+                 }
+
+class OpcodeFramer:
+    """
+    Frames binary WOLFF messages by their size, which is known from the
+    application and opcode in their first two bytes. Messages are sent
+    without a header, so this framing is compatible with clients that
+    send a single unframed message per connection.
+    """
+    HEADER_SIZE = 2
+
+    def __init__( self, receive_sizes = REQUEST_SIZES,
+                  send_sizes = RESPONSE_SIZES,
+                  default_size = 13
+                ):
+        """
+        The default sizes are those of a server, which receives requests 
+        and sends responses. See for_client().
+
+        @param receive_sizes A dictionary mapping ( application, opcode ) to the size
+               of the messages received. A size may also be a function that takes 
+               the buffer and the offset of a message, and returns the size of the
+               message or None if not enough of the message has been received
+               to tell.
+        @param send_sizes The same, for the messages sent
+        @param default_size The size of messages not in the dictionaries
+        """
+        self._receive_sizes = receive_sizes
+        self._send_sizes = send_sizes
+        self._default_size = default_size
+
+    @classmethod
+    def for_client( cls ):
+        """
+        Create an OpcodeFramer for a client, which sends requests and receives responses.
+        """
+        return cls( receive_sizes = RESPONSE_SIZES, send_sizes = REQUEST_SIZES )
+
+    def get_size( self, buffer, start, sizes ):
+        """
+        Get the size of the message starting at offset start of buffer.
+
+        @returns the size, or None if it cannot be determined yet
+        """
+        if len( buffer ) < start + OpcodeFramer.HEADER_SIZE:
+            return None
+
+        size = sizes.get( ( buffer[ start ], buffer[ start + 1 ] ), self._default_size )
+        if callable( size ):
+            size = size( buffer, start )
+        return size
+
+    def encode( self, message ):
+        size = self.get_size( message, 0, self._send_sizes )
+        if size is not None and size != len( message ):
+            raise ValueError( f"Expected a message of {size} bytes, got {len( message )}" )
+        return bytes( message )
+
+    def find_frame( self, buffer, start ):
+        size = self.get_size( buffer, start, self._receive_sizes )
+        if size is None or len( buffer ) < start + size:
+            return None
+        return start, start + size, start + size
+
+class JSONFramer:
+    """
+    Frames JSON documents sent back to back. Each document delimits
+    itself, so no header is needed and a client that sends a single
+    document per connection does not need to change.
+    """
+    WHITESPACE = b' \t\r\n'
+
+    def __init__( self, max_size = 65536 ):
+        """
+        @param max_size The maximum size of a document, in bytes
+        """
+        self._max_size = max_size
+        self._decoder = json.JSONDecoder()
+
+    def encode( self, message ):
+        return bytes( message )
+
+    def _skip_whitespace( self, buffer, offset ):
+        while offset < len( buffer ) and buffer[ offset ] in JSONFramer.WHITESPACE:
+            offset += 1
+        return offset
+
+    def find_frame( self, buffer, start ):
+        message_start = self._skip_whitespace( buffer, start )
+        if message_start == len( buffer ):
+            return None
+
+        try:
+            text = buffer[ message_start: ].decode( 'utf-8' )
+            document, end = self._decoder.raw_decode( text )
+        except ( UnicodeDecodeError, ValueError ):
+            # the document is either incomplete or malformed,
+            # it can only be told which once it is too large
+            if len( buffer ) - message_start > self._max_size:
+                raise ValueError( f"No complete JSON document within {self._max_size} bytes" )
+            return None
+
+        message_end = message_start + len( text[ :end ].encode( 'utf-8' ) )
+        return message_start, message_end, self._skip_whitespace( buffer, message_end )
+
+"""
+The framers that can be chosen by name, e.g. with a command line argument.
+"""
+FRAMERS = { 'length': LengthPrefixFramer,
+            'opcode': OpcodeFramer,
+            'json': JSONFramer
+          }
+
+def get_framer( name, client = False ):
+    """
+    Create the framer called name, one of the keys of FRAMERS.
+
+    @param client True if the framer is used by a client, which sends requests 
+           and receives responses, False if it is used by a server.
+    """
+    if name not in FRAMERS:
+        raise ValueError( f"Invalid framing '{name}', expected one of {tuple( FRAMERS )}" )
+    if client and FRAMERS[ name ] is OpcodeFramer:
+        return OpcodeFramer.for_client()
+    return FRAMERS[ name ]()
+
+class FrameReader:
+    """
+    Reads framed messages from a socket, buffering data received
+    beyond the end of a message until the next message is read.
+    """
+    def __init__( self, sock, framer, recv_size = 4096 ):
+        """
+        @param sock A connected socket
+        @param framer The framer messages are framed with
+        @param recv_size The maximum number of bytes read from sock at once
+        """
+        self._sock = sock
+        self._framer = framer
+        self._recv_size = recv_size
+        self._buffer = bytearray()
+        self._start = 0
+
+    def get_buffered( self ):
+        """
+        @returns the number of bytes received but not yet read as a message
+        """
+        return len( self._buffer ) - self._start
+
+    def read( self ):
+        """
+        Read the next message, waiting for it to be received.
+
+        @returns the message, or None if the connection was closed
+                 before another message was received.
+        """
+        while True:
+            frame = self._framer.find_frame( self._buffer, self._start )
+            if frame:
+                message_start, message_end, frame_end = frame
+                message = bytes( self._buffer[ message_start:message_end ] )
+                self._start = frame_end
+                return message
+
+            # discard the messages already read before receiving more
+            if self._start:
+                del self._buffer[ :self._start ]
+                self._start = 0
+
+            data = self._sock.recv( self._recv_size )
+            if not data:
+                if self._buffer:
+                    logging.getLogger().warning( f"Connection closed with {len( self._buffer )} "
+                                                 "bytes of an incomplete message received."
+                    )
+                return None
+            self._buffer += data
+
+    def __iter__( self ):
+        """
+        Iterate over messages until the connection is closed.
+        """
+        message = self.read()
+        while message is not None:
+            yield message
+            message = self.read()
@@ -0,0 +1,64 @@
+"""
+Logging configuration shared by the WOLFF programs.
+
+Messages on the request path are logged lazily, with their arguments
+passed separately (e.g. debug( "Decoded data: %s", data_dict )), so a
+message below the configured level costs no more than the call itself.
+With asynchronous logging the records that are emitted are put on a
+queue by the thread logging them, and written to the log file and to
+stdout by a separate thread, so a slow disk does not hold up requests.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+FORMAT = '%(asctime)s [%(levelname)-5.5s] %(message)s'
+
+"""
+The levels that can be chosen by name, e.g. with a command line argument.
+"""
+LEVELS = { 'debug': logging.DEBUG,
+           'info': logging.INFO,
+           'warning': logging.WARNING,
+           'error': logging.ERROR
+         }
+
+def configure_logging( log_file, level = 'debug', asynchronous = False ):
+    """
+    Log to log_file and to stdout.
+
+    @param log_file The name of the file to write log records to
+    @param level The name of the lowest level logged, one of the keys of LEVELS
+    @param asynchronous If True, records are written by a background thread
+    @returns the QueueListener writing the records if asynchronous, otherwise None.
+             The listener is stopped, writing any records left in the queue,
+             when the program exits.
+    """
+    if level not in LEVELS:
+        raise ValueError( f"Invalid log level '{level}', expected one of {tuple( LEVELS )}" )
+
+    formatter = logging.Formatter( FORMAT )
+    handlers = [ logging.FileHandler( log_file ),
+                 logging.StreamHandler( sys.stdout )
+               ]
+    for handler in handlers:
+        handler.setFormatter( formatter )
+
+    root = logging.getLogger()
+    root.setLevel( LEVELS[ level ] )
+
+    if not asynchronous:
+        for handler in handlers:
+            root.addHandler( handler )
+        return None
+
+    # put() on a SimpleQueue never blocks, and takes no lock shared with the writer
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener( records, *handlers )
+    root.addHandler( logging.handlers.QueueHandler( records ) )
+    listener.start()
+    atexit.register( listener.stop )
+
+    return listener
@@ -0,0 +1,292 @@
+"""
+An in-process registry of metrics: counters, gauges and histograms,
+optionally with labels, e.g. the number of messages received per opcode.
+
+Updating a metric takes a lock held only for a dictionary update, so
+metrics can be updated on the path of every message. The registry is
+read in the Prometheus text exposition format, either with format_text()
+or over HTTP from a MetricsServer.
+"""
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _escape( value ):
+    return str( value ).replace( '\\', '\\\\' ).replace( '"', '\\"' ).replace( '\n', '\\n' )
+
+class _Metric:
+    """
+    A metric with a value for each combination of the values of its labels.
+    """
+    TYPE = None
+
+    def __init__( self, name, help, labels = () ):
+        """
+        @param name The name of the metric, e.g. 'wolff_messages_received_total'
+        @param help A description of the metric
+        @param labels The names of the labels of the metric. Their values
+               are given, in the same order, whenever the metric is updated.
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple( labels )
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def _check_labels( self, values ):
+        if len( values ) != len( self.labels ):
+            raise ValueError( f"{self.name} expects the labels {self.labels}, got {values}" )
+
+    def _format_labels( self, values, extra = None ):
+        pairs = [ f'{name}="{_escape( value )}"' for name, value in zip( self.labels, values ) ]
+        if extra:
+            pairs.append( f'{extra[ 0 ]}="{extra[ 1 ]}"' )
+        return '{' + ','.join( pairs ) + '}' if pairs else ''
+
+    def collect( self ):
+        """
+        @returns the lines of the metric in the text exposition format
+        """
+        lines = [ f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}" ]
+        with self._lock:
+            values = list( self._values.items() )
+        for labels, value in sorted( values ):
+            lines.append( f"{self.name}{self._format_labels( labels )} {value}" )
+        return lines
+
+class Counter( _Metric ):
+    """
+    A count that only increases, e.g. of messages received.
+    """
+    TYPE = 'counter'
+
+    def inc( self, *labels, amount = 1 ):
+        """
+        @param labels The values of the labels of the metric
+        @param amount The amount to increase the count by
+        """
+        self._check_labels( labels )
+        with self._lock:
+            self._values[ labels ] = self._values.get( labels, 0 ) + amount
+
+    def get( self, *labels ):
+        with self._lock:
+            return self._values.get( labels, 0 )
+
+class Gauge( _Metric ):
+    """
+    A value that can go up and down, e.g. the number of requests in flight.
+    """
+    TYPE = 'gauge'
+
+    def __init__( self, name, help, labels = (), function = None ):
+        """
+        @param function If not None, a function called whenever the metric is
+               read, which returns the value of the gauge. Such a gauge has no labels.
+        """
+        super().__init__( name, help, labels )
+        if function and labels:
+            raise ValueError( f"The gauge {name} is read from a function, and cannot have labels" )
+        self._function = function
+
+    def set( self, value, *labels ):
+        self._check_labels( labels )
+        with self._lock:
+            self._values[ labels ] = value
+
+    def inc( self, *labels, amount = 1 ):
+        self._check_labels( labels )
+        with self._lock:
+            self._values[ labels ] = self._values.get( labels, 0 ) + amount
+
+    def dec( self, *labels, amount = 1 ):
+        self._check_labels( labels )
+        with self._lock:
+            self._values[ labels ] = self._values.get( labels, 0 ) - amount
+
+    def get( self, *labels ):
+        if self._function:
+            return self._function()
+        with self._lock:
+            return self._values.get( labels, 0 )
+
+    def collect( self ):
+        if not self._function:
+            return super().collect()
+
+        try:
+            value = self._function()
+        except Exception as e:
+            logging.getLogger().error( "Failed to read the gauge %s: %s", self.name, e )
+            value = float( 'nan' )
+        return [ f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}",
+                 f"{self.name} {value}"
+               ]
+
+"""
+The upper bounds, in seconds, of the buckets of a latency Histogram.
+"""
+LATENCY_BUCKETS = ( 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+                  )
+
+class Histogram( _Metric ):
+    """
+    Counts observed values, e.g. latencies, in buckets.
+    """
+    TYPE = 'histogram'
+
+    def __init__( self, name, help, labels = (), buckets = LATENCY_BUCKETS ):
+        """
+        @param buckets The upper bounds of the buckets, in increasing order.
+               Values above the last bound are counted in a final bucket.
+        """
+        super().__init__( name, help, labels )
+        self.buckets = tuple( buckets )
+
+    def observe( self, value, *labels ):
+        self._check_labels( labels )
+        index = bisect.bisect_left( self.buckets, value )
+        with self._lock:
+            state = self._values.get( labels )
+            if state is None:
+                # [ count in each bucket, sum, count ]
+                state = self._values[ labels ] = [ [ 0 ] * ( len( self.buckets ) + 1 ), 0.0, 0 ]
+            state[ 0 ][ index ] += 1
+            state[ 1 ] += value
+            state[ 2 ] += 1
+
+    def time( self, *labels ):
+        """
+        Observe the number of seconds spent in a with statement.
+        """
+        return _Timer( self, labels )
+
+    def get_count( self, *labels ):
+        with self._lock:
+            state = self._values.get( labels )
+            return state[ 2 ] if state else 0
+
+    def collect( self ):
+        lines = [ f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}" ]
+        with self._lock:
+            values = [ ( labels, ( list( counts ), total, count ) )
+                       for labels, ( counts, total, count ) in self._values.items()
+                     ]
+
+        for labels, ( counts, total, count ) in sorted( values ):
+            cumulative = 0
+            for bound, bucket_count in zip( self.buckets + ( '+Inf', ), counts ):
+                cumulative += bucket_count
+                lines.append( f"{self.name}_bucket{self._format_labels( labels, ( 'le', bound ) )} "
+                              f"{cumulative}"
+                )
+            lines.append( f"{self.name}_sum{self._format_labels( labels )} {total}" )
+            lines.append( f"{self.name}_count{self._format_labels( labels )} {count}" )
+        return lines
+
+class _Timer:
+    """
+    The context manager returned by Histogram.time(). It is a class rather
+    than a generator, as it is used on the path of every message, and its
+    overhead is half that of a generator.
+    """
+    __slots__ = ( '_histogram', '_labels', '_start' )
+
+    def __init__( self, histogram, labels ):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__( self ):
+        self._start = time.monotonic()
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self._histogram.observe( time.monotonic() - self._start, *self._labels )
+
+class MetricsRegistry:
+    """
+    The metrics of a process. Metrics are created through the registry,
+    and asking for a metric that already exists returns the existing one.
+    """
+    def __init__( self ):
+        self._lock = threading.Lock()
+        self._metrics = dict()
+
+    def _get( self, metric_type, name, *args, **kwargs ):
+        with self._lock:
+            metric = self._metrics.get( name )
+            if metric is None:
+                metric = self._metrics[ name ] = metric_type( name, *args, **kwargs )
+            elif type( metric ) is not metric_type:
+                raise ValueError( f"The metric {name} is already registered as a {metric.TYPE}" )
+            return metric
+
+    def counter( self, name, help, labels = () ):
+        return self._get( Counter, name, help, labels )
+
+    def gauge( self, name, help, labels = (), function = None ):
+        return self._get( Gauge, name, help, labels, function = function )
+
+    def histogram( self, name, help, labels = (), buckets = LATENCY_BUCKETS ):
+        return self._get( Histogram, name, help, labels, buckets = buckets )
+
+    def format_text( self ):
+        """
+        @returns every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list( self._metrics.values() )
+
+        lines = list()
+        for metric in metrics:
+            lines += metric.collect()
+        return '\n'.join( lines ) + '\n'
+
+class MetricsServer:
+    """
+    Serves the metrics of a MetricsRegistry over HTTP, at /metrics,
+    from a daemon thread.
+    """
+    def __init__( self, registry, ip = '127.0.0.1', port = 9100 ):
+        """
+        @param registry The MetricsRegistry to serve
+        @param ip The ip to listen on. By default only local clients can connect.
+        @param port The port to listen on, or 0 for any free port
+        """
+        class Handler( BaseHTTPRequestHandler ):
+            def do_GET( self ):
+                if self.path.split( '?' )[ 0 ] != '/metrics':
+                    self.send_error( 404 )
+                    return
+
+                body = registry.format_text().encode( 'utf-8' )
+                self.send_response( 200 )
+                self.send_header( 'Content-Type', 'text/plain; version=0.0.4; charset=utf-8' )
+                self.send_header( 'Content-Length', str( len( body ) ) )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def log_message( self, format, *args ):
+                logging.getLogger().debug( "Metrics request from %s: " + format,
+                                           self.address_string(), *args
+                )
+
+        self._server = ThreadingHTTPServer( ( ip, port ), Handler )
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def get_port( self ):
+        return self._server.server_address[ 1 ]
+
+    def start( self ):
+        self._thread = threading.Thread( target = self._server.serve_forever,
+                                         name = 'metrics', daemon = True
+        )
+        self._thread.start()
+        logging.getLogger().debug( "Serving metrics on port %d", self.get_port() )
+
+    def stop( self ):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,264 @@
+"""
+Per-message latency tracing.
+
+Each WOLFF message handled is given a Trace, with a request id, in which
+the time spent in each stage of handling it is recorded as a span. Spans
+are measured with the monotonic clock, so they are not affected by changes
+to the system time. The stages recorded by the servers are:
+
+  queue          waiting for a worker thread (MQTTServer with workers)
+  decode         decoding the message
+  annotate       adding the client, url and parameters of the request,
+                 which includes client_lookup
+  client_lookup  identifying the client that sent the message
+  upstream       the request to the service, e.g. Etsy
+  db             handling the response, including waiting for the database
+  publish        sending the response back to the client
+
+and the whole of each trace is recorded as 'total'.
+
+A Tracer aggregates the spans of finished traces into a histogram for
+each ( service, method ) and stage, from which percentiles can be read,
+and can export each finished trace as a line of JSON.
+"""
+import bisect
+import contextlib
+import itertools
+import json
+import logging
+import math
+import threading
+import time
+
+class LatencyHistogram:
+    """
+    Counts latencies in buckets whose bounds grow geometrically, from 10 us
+    to about 3 minutes, so any number of latencies is kept in a fixed
+    amount of memory. Percentiles are accurate to within about 9%.
+    """
+    BOUNDS = [ 1e-5 * 2 ** ( index / 8 ) for index in range( 8 * 24 + 1 ) ]
+
+    def __init__( self ):
+        self._counts = [ 0 ] * ( len( LatencyHistogram.BOUNDS ) + 1 )
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add( self, seconds ):
+        self._counts[ bisect.bisect_left( LatencyHistogram.BOUNDS, seconds ) ] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max( self.max, seconds )
+
+    def percentile( self, percent ):
+        """
+        @param percent The percentile, between 0 and 100
+        @returns the upper bound of the bucket containing the percentile,
+                 in seconds, or None if nothing has been counted.
+        """
+        if not self.count:
+            return None
+
+        rank = max( 1, math.ceil( self.count * percent / 100 ) )
+        seen = 0
+        for index, count in enumerate( self._counts ):
+            seen += count
+            if seen >= rank:
+                break
+
+        if index == len( LatencyHistogram.BOUNDS ):
+            return self.max
+        return min( LatencyHistogram.BOUNDS[ index ], self.max )
+
+class Trace:
+    """
+    The spans recorded while handling a single message.
+    """
+    def __init__( self, tracer, request_id ):
+        self.request_id = request_id
+        self.service = None
+        self.method = None
+        self.time = time.time()
+        self.start = time.monotonic()
+        self.spans = list()
+        self._tracer = tracer
+        self._open = dict()
+
+    def set_api( self, service, method ):
+        """
+        Set the service and method of the message, once it is known.
+        """
+        self.service = service
+        self.method = method
+
+    def begin( self, name ):
+        """
+        Begin a span that is ended by a call to end(), possibly
+        on another thread, e.g. when a response arrives.
+        """
+        self._open[ name ] = time.monotonic()
+
+    def end( self, name ):
+        """
+        End the span begun by begin(). Nothing is recorded if the span
+        was not begun, or has already ended.
+        """
+        start = self._open.pop( name, None )
+        if start is not None:
+            self.spans.append( ( name, start, time.monotonic() ) )
+
+    @contextlib.contextmanager
+    def span( self, name ):
+        """
+        Record the time spent in a with statement as a span.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.spans.append( ( name, start, time.monotonic() ) )
+
+    def finish( self, error = None ):
+        """
+        Record the trace with its Tracer.
+
+        @param error The exception that stopped the message from being
+               handled, if any. The trace is exported with the error,
+               but its spans are not added to the histograms.
+        """
+        self._tracer.record( self, time.monotonic(), error )
+
+    def to_dict( self, end ):
+        """
+        @param end The monotonic time the trace finished at
+        @returns a dictionary of the trace, with its spans in milliseconds
+                 from the start of the trace.
+        """
+        return { 'request_id': self.request_id,
+                 'service': self.service,
+                 'method': self.method,
+                 'time': self.time,
+                 'total_ms': round( ( end - self.start ) * 1000, 3 ),
+                 'spans': [ { 'name': name,
+                              'start_ms': round( ( start - self.start ) * 1000, 3 ),
+                              'duration_ms': round( ( span_end - start ) * 1000, 3 )
+                            } for name, start, span_end in self.spans
+                          ]
+               }
+
+class _NullTrace:
+    """
+    A trace that records nothing, for messages handled without a Tracer.
+    """
+    request_id = None
+
+    def set_api( self, service, method ):
+        pass
+
+    def begin( self, name ):
+        pass
+
+    def end( self, name ):
+        pass
+
+    def span( self, name ):
+        return contextlib.nullcontext()
+
+    def finish( self, error = None ):
+        pass
+
+"""
+The trace given to methods that take an optional trace, when none is given.
+"""
+NULL_TRACE = _NullTrace()
+
+class Tracer:
+    """
+    Creates traces and aggregates them once they finish.
+    """
+    def __init__( self, export_file = None ):
+        """
+        @param export_file The name of a file each finished trace is appended
+               to, as a line of JSON, or None if traces are not exported.
+        """
+        self._ids = itertools.count( 1 )
+        self._lock = threading.Lock()
+        self._histograms = dict()
+        self._export = open( export_file, 'a' ) if export_file else None
+
+    def start_trace( self ):
+        """
+        Start the trace of a message, assigning it the next request id.
+        """
+        return Trace( self, next( self._ids ) )
+
+    def record( self, trace, end, error = None ):
+        """
+        Aggregate a finished trace, and export it.
+        Called by Trace.finish().
+        """
+        with self._lock:
+            if error is None:
+                histograms = self._histograms.setdefault( ( trace.service, trace.method ), dict() )
+                for name, start, span_end in trace.spans:
+                    histograms.setdefault( name, LatencyHistogram() ).add( span_end - start )
+                histograms.setdefault( 'total', LatencyHistogram() ).add( end - trace.start )
+
+            if self._export:
+                record = trace.to_dict( end )
+                if error is not None:
+                    record[ 'error' ] = str( error )
+                self._export.write( json.dumps( record ) + '\n' )
+                self._export.flush()
+
+    def get_percentiles( self, percentiles = ( 50, 95, 99 ) ):
+        """
+        @returns a dictionary mapping each ( service, method ) to a dictionary
+                 mapping each stage to a dictionary with the 'count' of its spans
+                 and, for each percentile p, 'p<p>': the percentile in seconds.
+        """
+        output = dict()
+        with self._lock:
+            for api, histograms in self._histograms.items():
+                output[ api ] = dict()
+                for name, histogram in histograms.items():
+                    stage = { 'count': histogram.count }
+                    for percent in percentiles:
+                        stage[ f'p{percent}' ] = histogram.percentile( percent )
+                    output[ api ][ name ] = stage
+        return output
+
+    def format_report( self ):
+        """
+        @returns the p50, p95 and p99 of every stage, as a table in milliseconds
+        """
+        lines = [ f"{'service/method':<32} {'stage':<14} {'count':>8} "
+                  f"{'p50':>10} {'p95':>10} {'p99':>10}"
+                ]
+        for ( service, method ), stages in sorted( self.get_percentiles().items(), key = str ):
+            for name, stage in stages.items():
+                lines.append( f"{f'{service}/{method}':<32} {name:<14} {stage[ 'count' ]:>8} "
+                              f"{stage[ 'p50' ] * 1000:>10.3f} {stage[ 'p95' ] * 1000:>10.3f} "
+                              f"{stage[ 'p99' ] * 1000:>10.3f}"
+                )
+        return '\n'.join( lines )
+
+    def log_report( self ):
+        logging.getLogger().info( "Latency of each stage (ms):\n%s", self.format_report() )
+
+    def log_report_every( self, interval ):
+        """
+        Log the report every interval seconds, from a daemon thread.
+        """
+        def report():
+            while True:
+                time.sleep( interval )
+                self.log_report()
+
+        threading.Thread( target = report, name = 'trace-report', daemon = True ).start()
+
+    def close( self ):
+        with self._lock:
+            if self._export:
+                self._export.close()
+                self._export = None
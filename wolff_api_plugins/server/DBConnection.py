@@ -1,89 +1,538 @@
+import atexit
+import logging
 import sqlite3
+import threading
+import time
+from . import schema
 
-class SQLite3DBConnection:
-    def __init__( self, file_name ):
+# the statements of record_created_listing(). sqlite3 keeps the statements
+# it has prepared in a cache keyed by their text, so each is prepared once
+# per connection.
+_INSERT_RECORD = 'INSERT INTO AppRecord ( ListingValue ) VALUES ( ? )'
+_INSERT_USER = 'INSERT INTO AppUser ( EtsyListingID, ClientID ) VALUES ( ?, ? )'
+_INSERT_STOCK = 'INSERT INTO EtsyListingStock ( RecordId, QuantityInStock ) VALUES ( ?, ? )'
+_UPDATE_STOCK = 'UPDATE EtsyListingStock SET QuantityInStock = ? WHERE RecordId = ?'
+_UPSERT_STOCK = _INSERT_STOCK + \
+                ' ON CONFLICT ( RecordId ) DO UPDATE SET QuantityInStock = excluded.QuantityInStock'
+_REPLACE_REQUEST = 'INSERT OR REPLACE INTO RecentRequest ( RequestKey, Response, Recorded ) VALUES ( ?, ?, ? )'
+
+class DBConnection:
+    """
+    The storage of the WOLFF servers: the record of each listing created,
+    the client each listing belongs to, and the stock of each listing.
+
+    A listing is recorded with the id given to it by the service, its
+    listing id, and is given a record id by the storage, which is what
+    clients refer to it by. Listing ids are returned as strings, record
+    ids and quantities as integers. Looking up a record or listing that is
+    not stored raises a KeyError. Every method may be called from any thread.
+
+    Subclasses implement the methods that raise NotImplementedError, and
+    may override the others, which are built on them, when they can be
+    done more efficiently. scripts/check_db_backend.py checks that a
+    subclass behaves as described here.
+    """
+    def migrate( self, version = None ):
+        """
+        Bring the storage up to date, creating it if it does not exist.
+
+        @returns the version of the schema of the storage, or None if it has none
+        """
+        return None
+
+    def add_listing( self, listing_id, client_id ):
+        """
+        Record a listing created for a client, without its stock.
+
+        @returns the record id of the listing
+        """
+        raise NotImplementedError()
+
+    def record_created_listing( self, listing_id, client_id, quantity ):
+        """
+        Record a listing created for a client, and its stock, atomically:
+        if an error is raised, e.g. because the listing id is already
+        recorded, nothing is recorded.
+
+        @param listing_id The id given to the listing by the service
+        @param client_id The id of the client the listing was created for
+        @param quantity The quantity in stock of the listing
+        @returns the record id of the listing
+        """
+        raise NotImplementedError()
+
+    def get_client_by_listing_id( self, listing_id ):
+        raise NotImplementedError()
+
+    def get_listing_id( self, record_id ):
+        raise NotImplementedError()
+
+    def get_record_id( self, listing_id ):
+        raise NotImplementedError()
+
+    def get_listing_stock( self, record_id ):
+        raise NotImplementedError()
+
+    def get_stock_records( self, record_ids ):
+        """
+        Look up the listing id, client and stock of several records.
+
+        @param record_ids The record ids to look up
+        @returns a dictionary mapping each record id that was found to a
+                 tuple ( listing id, client id, quantity in stock )
+        """
+        records = dict()
+        for record_id in record_ids:
+            try:
+                listing_id = self.get_listing_id( record_id )
+                records[ int( record_id ) ] = ( listing_id,
+                                                self.get_client_by_listing_id( listing_id ),
+                                                self.get_listing_stock( record_id )
+                                              )
+            except KeyError:
+                pass
+        return records
+
+    def add_listing_stock( self, record_id, quantity ):
+        """
+        Record the stock of a listing recorded by add_listing().
+        """
+        raise NotImplementedError()
+
+    def update_listing_stock( self, record_id, quantity ):
+        """
+        Update the stock of a listing. Nothing is changed if
+        the record has no stock.
+        """
+        raise NotImplementedError()
+
+    def update_listings_stock( self, quantities ):
+        """
+        Update the stock of several listings.
+
+        @param quantities A dictionary mapping record ids to their quantity in stock
+        """
+        for record_id, quantity in quantities.items():
+            self.update_listing_stock( record_id, quantity )
+
+    def get_request_response( self, request_key ):
+        """
+        @returns the response recorded for a request by record_request_response()
+        """
+        raise NotImplementedError()
+
+    def record_request_response( self, request_key, response ):
+        """
+        Record the response to a request, replacing any response recorded for it.
+
+        @param request_key The key that identifies the request
+        @param response The encoded response, as bytes
+        """
+        raise NotImplementedError()
+
+    def forget_request_responses( self, before ):
+        """
+        Forget the responses recorded before a time.
+
+        @param before A time, as returned by time.time()
+        @returns the number of responses forgotten
+        """
+        raise NotImplementedError()
+
+    def flush( self ):
+        """
+        Write any changes that are waiting to be written.
+        """
+        pass
+
+    def close( self ):
+        """
+        Flush, then release the resources of the storage.
+        """
+        self.flush()
+
+class SQLite3DBConnection( DBConnection ):
+    """
+    A connection to the WOLFF database that can be shared between threads.
+
+    Writes are made through a single connection, one at a time. Reads are
+    made through a connection of each reading thread's own, so they neither
+    wait for writes nor for each other: in WAL mode readers see the last
+    committed state of the database while a write is in progress.
+
+    Writes of listing stock can optionally be made behind the caller, see
+    stock_write_interval.
+    """
+    def __init__( self, file_name,
+                  journal_mode = 'wal',
+                  synchronous = 'normal',
+                  cache_size_kb = 8192,
+                  busy_timeout = 5.0,
+                  per_thread_readers = True,
+                  stock_write_interval = 0,
+                  stock_write_batch = 256
+                ):
+        """
+        @param file_name The name of the SQLite3 database file, or ':memory:'
+        @param journal_mode The journal mode of the database. In 'wal' mode readers
+               do not block the writer, and a commit only appends to the log.
+        @param synchronous When SQLite waits for writes to reach the disk. With 'normal'
+               in WAL mode, a committed transaction can only be lost to a power failure
+               or an OS crash, never to the server crashing; 'full' also survives those,
+               at the cost of an fsync on every commit.
+        @param cache_size_kb The size of the page cache of each connection, in KiB
+        @param busy_timeout The number of seconds to wait for a lock held by another
+               process, e.g. a script updating the database, before failing.
+        @param per_thread_readers If True, each thread reads through a connection of
+               its own. Otherwise reads are made through the writer's connection.
+               An in-memory database is only visible to the connection that created
+               it, so it is always read through the writer's connection.
+        @param stock_write_interval If greater than 0, add_listing_stock() and
+               update_listing_stock() return without writing to the database. The
+               stock of each record is written, with the last quantity given for it,
+               by a background thread, every this many seconds or as soon as the stock
+               of stock_write_batch records is waiting, in a single transaction.
+               get_listing_stock() returns the stock waiting to be written, if any.
+               Adding the stock of a record that already has stock replaces it, rather
+               than raising an error.
+               The stock waiting is written by flush() and close(), which is called
+               when the interpreter exits. It is lost if the process is killed or
+               crashes before then, so up to stock_write_interval seconds of stock
+               updates can be lost on top of what the synchronous setting allows.
+        @param stock_write_batch The number of records whose stock is waiting to be
+               written at which it is written without waiting for the interval.
+        """
         self.db_file_name = file_name
-        self.conn = sqlite3.connect( file_name, check_same_thread = False )
+        self._pragmas = [ f'PRAGMA synchronous = {synchronous}',
+                          f'PRAGMA cache_size = -{int( cache_size_kb )}',
+                          'PRAGMA temp_store = MEMORY'
+                        ]
+        self._busy_timeout = busy_timeout
+        self._per_thread_readers = per_thread_readers and file_name != ':memory:'
+
+        self.conn = self._connect()
+        self.conn.execute( f'PRAGMA journal_mode = {journal_mode}' )
+
+        # writes are serialized, the lock is reentrant so that
+        # a write can be made while it is held by the caller
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = list()
+        self._readers_lock = threading.Lock()
+
+        # { record id: ( 'add' or 'update', quantity ) }, the stock waiting to
+        # be written, and the stock being written by flush()
+        self._pending_stock = dict()
+        self._flushing_stock = dict()
+        self._stock_lock = threading.Lock()
+        self._stock_write_interval = stock_write_interval
+        self._stock_write_batch = stock_write_batch
+        self._flush_requested = threading.Event()
+        self._closing = threading.Event()
+        self._flusher = None
+        if stock_write_interval > 0:
+            self._flusher = threading.Thread( target = self._flush_periodically,
+                                              name = 'stock-writer', daemon = True
+            )
+            self._flusher.start()
+            atexit.register( self.close )
+
+    def migrate( self, version = None ):
+        """
+        Bring the schema of the database up to version, by default the latest,
+        see schema.migrate().
+
+        @returns the version of the schema of the database
+        """
+        with self._write_lock:
+            return schema.migrate( self.conn, schema.LATEST_VERSION if version is None else version )
+
+    def _connect( self ):
+        conn = sqlite3.connect( self.db_file_name, timeout = self._busy_timeout,
+                                check_same_thread = False
+        )
+        for pragma in self._pragmas:
+            conn.execute( pragma )
+        return conn
+
+    def _read( self, query, params, all_rows = False ):
+        """
+        Run a query through the calling thread's reader.
+
+        @param all_rows If True, every row of the result is returned
+        @returns the first row of the result, or None
+        """
+        if not self._per_thread_readers:
+            with self._write_lock:
+                cursor = self.conn.execute( query, params )
+                return cursor.fetchall() if all_rows else cursor.fetchone()
+
+        reader = getattr( self._local, 'conn', None )
+        if reader is None:
+            reader = self._local.conn = self._connect()
+            reader.execute( 'PRAGMA query_only = ON' )
+            with self._readers_lock:
+                self._readers.append( reader )
+
+        cursor = reader.execute( query, params )
+        return cursor.fetchall() if all_rows else cursor.fetchone()
+
+    def _read_value( self, query, key ):
+        """
+        Run a query for a single value, through the calling thread's reader.
+
+        @param key The value the query looks up, its only parameter
+        @throws KeyError if the query returns no rows
+        """
+        row = self._read( query, ( key, ) )
+        if row is None:
+            raise KeyError( key )
+        return row[ 0 ]
 
     def add_listing( self, listing_id, client_id ):
-        c = self.conn.cursor()
-        c.execute( '''INSERT INTO 
-                      AppRecord (ListingValue) 
-                      VALUES( ? )''',
-                   ( listing_id, )
-                 )
-        self.conn.commit()
-        c.execute( '''SELECT last_insert_rowid()''' )
-
-        res = c.fetchone()[ 0 ]
-
-        c.execute( '''INSERT INTO 
-                      AppUser (EtsyListingID, ClientID )
-                      VALUES( ?, ? )''',
-                   ( listing_id, client_id )
-                 )
-        self.conn.commit()
+        with self._write_lock:
+            c = self.conn.cursor()
+            c.execute( '''INSERT INTO
+                          AppRecord (ListingValue)
+                          VALUES( ? )''',
+                       ( listing_id, )
+                     )
+            self.conn.commit()
+            c.execute( '''SELECT last_insert_rowid()''' )
+
+            res = c.fetchone()[ 0 ]
+
+            c.execute( '''INSERT INTO
+                          AppUser (EtsyListingID, ClientID )
+                          VALUES( ?, ? )''',
+                       ( listing_id, client_id )
+                     )
+            self.conn.commit()
 
         return res
 
-    def get_client_by_listing_id( self, listing_id ):
-        c = self.conn.cursor()
-        c.execute( '''SELECT ClientID 
-                      FROM AppUser
-                      WHERE EtsyListingID = (?)''',
-                   ( listing_id, )
-                   )
-        return c.fetchone()[ 0 ]
+    def record_created_listing( self, listing_id, client_id, quantity ):
+        """
+        Record a listing created for a client, and its stock, in a single
+        transaction: either every row is written, or none is.
+
+        @param listing_id The id given to the listing by the service
+        @param client_id The id of the client the listing was created for
+        @param quantity The quantity in stock of the listing
+        @returns the record id of the listing
+        """
+        with self._write_lock, self.conn:
+            record_id = self.conn.execute( _INSERT_RECORD, ( listing_id, ) ).lastrowid
+            self.conn.execute( _INSERT_USER, ( listing_id, client_id ) )
+            self.conn.execute( _INSERT_STOCK, ( record_id, quantity ) )
+
+        return record_id
 
-        
+    def get_client_by_listing_id( self, listing_id ):
+        return self._read_value( '''SELECT ClientID
+                                    FROM AppUser
+                                    WHERE EtsyListingID = (?)''',
+                                 listing_id
+        )
 
     def get_listing_id( self, record_id ):
-        c = self.conn.cursor()
-        c.execute( '''SELECT ListingValue 
-                      FROM AppRecord 
-                      WHERE RecordID = ?
-                   ''', ( record_id, )
-                 )
-        return c.fetchone()[ 0 ]
+        return self._read_value( '''SELECT ListingValue
+                                    FROM AppRecord
+                                    WHERE RecordID = ?
+                                 ''', record_id
+        )
 
     def get_listing_stock( self, record_id ):
-        c = self.conn.cursor()
-        c.execute(
-            '''SELECT QuantityInStock
-               FROM EtsyListingStock
-               WHERE RecordId = ?
-            ''', ( record_id, )
+        if self._flusher:
+            with self._stock_lock:
+                for stock in ( self._pending_stock, self._flushing_stock ):
+                    if int( record_id ) in stock:
+                        return stock[ int( record_id ) ][ 1 ]
 
+        return self._read_value( '''SELECT QuantityInStock
+                                    FROM EtsyListingStock
+                                    WHERE RecordId = ?
+                                 ''', record_id
         )
 
-        return c.fetchone()[ 0 ]
+    def get_stock_records( self, record_ids ):
+        """
+        Look up the listing id, client and stock of several records in a single query.
+
+        @param record_ids The record ids to look up
+        @returns a dictionary mapping each record id that was found to a
+                 tuple ( listing id, client id, quantity in stock )
+        """
+        record_ids = list( set( int( record_id ) for record_id in record_ids ) )
+        rows = self._read( f'''SELECT AppRecord.RecordId, ListingValue, ClientID, QuantityInStock
+                               FROM AppRecord
+                               JOIN AppUser ON AppUser.EtsyListingID = AppRecord.ListingValue
+                               LEFT JOIN EtsyListingStock ON EtsyListingStock.RecordId = AppRecord.RecordId
+                               WHERE AppRecord.RecordId IN ( {', '.join( '?' * len( record_ids ) )} )
+                            ''', record_ids, all_rows = True
+        )
+        records = { record_id: ( listing_id, client_id, quantity )
+                    for record_id, listing_id, client_id, quantity in rows
+                  }
+
+        # the stock of a record may be waiting to be written, and a record
+        # without stock is not returned
+        if self._flusher:
+            with self._stock_lock:
+                for record_id, ( listing_id, client_id, quantity ) in records.items():
+                    for stock in ( self._pending_stock, self._flushing_stock ):
+                        if record_id in stock:
+                            records[ record_id ] = ( listing_id, client_id, stock[ record_id ][ 1 ] )
+                            break
+        return { record_id: record for record_id, record in records.items() if record[ 2 ] is not None }
+
+    def update_listings_stock( self, quantities ):
+        """
+        Update the stock of several records in a single transaction.
+
+        @param quantities A dictionary mapping record ids to their quantity in stock
+        """
+        if self._flusher:
+            for record_id, quantity in quantities.items():
+                self._queue_stock( record_id, 'update', quantity )
+            return
+
+        with self._write_lock, self.conn:
+            self.conn.executemany( _UPDATE_STOCK, [ ( quantity, record_id )
+                                                    for record_id, quantity in quantities.items()
+                                                  ]
+            )
 
     def update_listing_stock( self, record_id, quantity ):
-        c = self.conn.cursor()
-        c.execute(
-            '''UPDATE EtsyListingStock 
-               SET QuantityInStock = ?
-               WHERE RecordId = ?
-            ''', ( quantity, record_id, )
+        if self._flusher:
+            self._queue_stock( record_id, 'update', quantity )
+            return
 
-        )
-        self.conn.commit()
+        with self._write_lock:
+            c = self.conn.cursor()
+            c.execute(
+                '''UPDATE EtsyListingStock
+                   SET QuantityInStock = ?
+                   WHERE RecordId = ?
+                ''', ( quantity, record_id, )
+
+            )
+            self.conn.commit()
 
     def add_listing_stock( self, record_id, quantity ):
-        c = self.conn.cursor()
-        c.execute(
-            '''
-            INSERT INTO EtsyListingStock (RecordId, QuantityInStock)
-            VALUES ( ?, ? )''',
-            ( record_id, quantity )
-        )
-        self.conn.commit()
+        if self._flusher:
+            self._queue_stock( record_id, 'add', quantity )
+            return
+
+        with self._write_lock:
+            c = self.conn.cursor()
+            c.execute(
+                '''
+                INSERT INTO EtsyListingStock (RecordId, QuantityInStock)
+                VALUES ( ?, ? )''',
+                ( record_id, quantity )
+            )
+            self.conn.commit()
+
+    def _queue_stock( self, record_id, operation, quantity ):
+        record_id = int( record_id )
+        with self._stock_lock:
+            # the last quantity given for a record is written, and it is
+            # added if it was added since it was last written
+            pending = self._pending_stock.get( record_id )
+            if pending is not None and pending[ 0 ] == 'add':
+                operation = 'add'
+            self._pending_stock[ record_id ] = ( operation, quantity )
+            full = len( self._pending_stock ) >= self._stock_write_batch
+
+        if full:
+            self._flush_requested.set()
+
+    def _flush_periodically( self ):
+        while not self._closing.is_set():
+            self._flush_requested.wait( self._stock_write_interval )
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.getLogger().error( "Failed to write the listing stock: %s", e )
+
+    def _write_stock( self, stock ):
+        for record_id, ( operation, quantity ) in stock:
+            if operation == 'add':
+                self.conn.execute( _UPSERT_STOCK, ( record_id, quantity ) )
+            else:
+                self.conn.execute( _UPDATE_STOCK, ( quantity, record_id ) )
+
+    def flush( self ):
+        """
+        Write the listing stock waiting to be written, in a single transaction.
+        If the transaction fails, the stock of each record is written on its own,
+        and the stock that cannot be written is logged and dropped.
+        """
+        with self._write_lock:
+            with self._stock_lock:
+                if not self._pending_stock:
+                    return
+                self._flushing_stock, self._pending_stock = self._pending_stock, dict()
+
+            try:
+                try:
+                    with self.conn:
+                        self._write_stock( self._flushing_stock.items() )
+                except sqlite3.Error as e:
+                    logging.getLogger().warning( "Failed to write the stock of %d records at once, "
+                                                 "writing them one by one: %s",
+                                                 len( self._flushing_stock ), e
+                    )
+                    for record_id, write in self._flushing_stock.items():
+                        try:
+                            with self.conn:
+                                self._write_stock( [ ( record_id, write ) ] )
+                        except sqlite3.Error as e:
+                            logging.getLogger().error( "Dropping the stock %s of record %s: %s",
+                                                       write, record_id, e
+                            )
+            finally:
+                with self._stock_lock:
+                    self._flushing_stock = dict()
+
+    def get_request_response( self, request_key ):
+        return self._read_value( 'SELECT Response FROM RecentRequest WHERE RequestKey = ?', request_key )
+
+    def record_request_response( self, request_key, response ):
+        with self._write_lock, self.conn:
+            self.conn.execute( _REPLACE_REQUEST, ( request_key, bytes( response ), time.time() ) )
+
+    def forget_request_responses( self, before ):
+        with self._write_lock, self.conn:
+            return self.conn.execute( 'DELETE FROM RecentRequest WHERE Recorded < ?', ( before, ) ).rowcount
 
     def get_record_id( self, listing_id ):
-        c = self.conn.cursor()
-        c.execute( '''SELECT RecordID 
-                      FROM AppRecord 
-                      WHERE ListingValue = ?
-                   ''', ( listing_id, )
-                 )
-        return c.fetchone()[ 0 ]
+        return self._read_value( '''SELECT RecordID
+                                    FROM AppRecord
+                                    WHERE ListingValue = ?
+                                 ''', listing_id
+        )
+
+    def close( self ):
+        """
+        Write the listing stock waiting to be written, then close the
+        writer's connection and every thread's reader.
+        """
+        if self._flusher:
+            if self._closing.is_set():
+                return
+            self._closing.set()
+            self._flush_requested.set()
+            self._flusher.join()
+            self.flush()
+            atexit.unregister( self.close )
+
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers = list()
+
+        with self._write_lock:
+            self.conn.close()
@@ -8,16 +8,21 @@ class APIMap:
     the base url, methods and their arguments, 
     and authentication types for services.
     """
-    def __init__( self ):
+    def __init__( self, base_urls = None ):
         """
         Create the api map.
         For each service, we list its base url,
         its methods, and the authentication type.
         
         For each method, the uri, http method, and service 
-        identifier are listed. The service_identifier is an identifier 
+        identifier are listed, and the batch size if several
+        can be requested at once. The service_identifier is an identifier 
         that is unique to a user that wants to perform a method.
         From this service identifier, a user can be identified.
+
+        @param base_urls A dictionary mapping services to base urls that 
+               replace the services' default base urls, for example to 
+               send requests to a local stub server.
         """
         self.api_map = { "etsy": { 'base_url': 'https://openapi.etsy.com/v2',
                                    'create_listing': { 'uri': 'listings',
@@ -31,17 +36,22 @@ class APIMap:
                                                      },
                                    'check_listing_stock': { 'uri': '/listings/:listing_id',
                                                             'http_method': 'get',
-                                                            'service_identifier': 'listing_id'
+                                                            'service_identifier': 'listing_id',
+                                                            'batch_size': 100
                                                      },
                                    'auth_type': "oauth1",
                                    'uri_re': re.compile( ":((?:[a-zA-Z]|_)+)" )
                                   }
                        }
 
+        if base_urls:
+            for service, base_url in base_urls.items():
+                self.api_map[ service ][ 'base_url' ] = base_url.rstrip( '/' )
+
     def get_base_url( self, service ):
         return self.api_map[ service ][ 'base_url' ]
     def get_uri( self, service, method ):
-        logging.getLogger().debug( f"Retrieving URI for: {service}/{method}" )
+        logging.getLogger().debug( "Retrieving URI for: %s/%s", service, method )
         return self.api_map[ service ][ method ][ 'uri' ]
 
     def uri_is_substitutable( self, uri ):
@@ -99,16 +109,25 @@ class APIMap:
                                                         self.api_map[ service ][ 'uri_re' ],
                                                         replace
                                                       )
-            logging.getLogger().debug( f"URI after replacement: {request_uri}" )
+            logging.getLogger().debug( "URI after replacement: %s", request_uri )
 
         complete_url += f"/{request_uri}/"
 
-        logging.getLogger().debug( f"Complete url: {complete_url}" )
+        logging.getLogger().debug( "Complete url: %s", complete_url )
         return complete_url
 
     def get_http_method( self, service, method ):
         return self.api_map[ service ][ method ][ 'http_method' ]
 
+    def get_batch_size( self, service, method ):
+        """
+        Get the number of items, e.g. listings, that a single request to a method
+        can be made for, by joining their ids with commas in its uri.
+
+        @returns the batch size, or None if the method takes a single item
+        """
+        return self.api_map[ service ][ method ].get( 'batch_size' )
+
     def get_auth_type( self, service ):
         return self.api_map[ service ][ 'auth_type' ]
 
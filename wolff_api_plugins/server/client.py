@@ -55,6 +55,14 @@ class Client:
     def get_resource( self, service, resource ):
         return self._resources[ '/'.join( [ service, resource ] ) ]
 
+    def get_resources( self ):
+        """
+        Get every resource of this client.
+
+        @returns a dictionary mapping 'service/resource' to the resource
+        """
+        return self._resources
+
 if __name__ == '__main__':
 
     cli = Client( 'client_1', [ ( 'etsy', 'oauth1' ) ] )
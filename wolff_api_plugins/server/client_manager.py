@@ -1,5 +1,6 @@
 import os
-import resource
+import logging
+import threading
 from . client import Client
 
 class ClientManager:
@@ -16,17 +17,113 @@ class ClientManager:
         
         Additionally stores a connection to a WOLFF database 
         containing information regarding records that have been created
+
+        Clients are indexed by the values of their identifier resources 
+        (see FileResource.is_identifier), so get_client_by_service_identifier 
+        does not need to look at every client.
         """
         self._dir = client_dir
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._watching = threading.Event()
+
+        # ( service, identifier, value ) -> client id
+        self._index = dict()
         self._clients = dict()
-        self._clients_from_dir( client_dir )
+        self.reload()
         self.conn = db_connection
 
+    def reload( self ):
+        """
+        Rescan client_dir, replacing the managed clients with the clients 
+        currently found there. Lookups made while the directory is being 
+        scanned continue to use the previous set of clients.
+        """
+        with self._lock:
+            signature = self._get_dir_signature()
+            clients = self._clients_from_dir( self._dir )
+
+            index = dict()
+            for client in clients.values():
+                self._index_client( client, index )
+
+            self._clients = clients
+            self._index = index
+            self._dir_signature = signature
+
+        logging.getLogger().debug( f"Reloaded {len( clients )} clients from '{self._dir}'" )
+
+    def reload_if_changed( self ):
+        """
+        Reload the clients if anything in client_dir has been 
+        added, removed, or modified since they were last loaded.
+
+        @returns True if the clients were reloaded, False otherwise.
+        """
+        if self._get_dir_signature() == self._dir_signature:
+            return False
+
+        self.reload()
+        return True
+
+    def start_watching( self, interval = 5.0 ):
+        """
+        Start a background thread that checks client_dir for changes 
+        every interval seconds, reloading the clients when it changes.
+
+        @param interval The number of seconds between checks
+        """
+        if self._watcher:
+            return
+
+        def watch():
+            while not self._watching.wait( interval ):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logging.getLogger().error( f"Failed to reload clients from '{self._dir}': {e}" )
+
+        self._watching.clear()
+        self._watcher = threading.Thread( target = watch, name = 'client-watcher',
+                                          daemon = True
+        )
+        self._watcher.start()
+
+    def stop_watching( self ):
+        """
+        Stop the thread started by start_watching.
+        """
+        if not self._watcher:
+            return
+
+        self._watching.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def _get_dir_signature( self ):
+        """
+        Get a value that changes whenever a file or directory 
+        in client_dir is added, removed, or modified.
+        """
+        entries = list()
+        for root, dirs, files in os.walk( self._dir ):
+            for name in dirs + files:
+                path = os.path.join( root, name )
+                try:
+                    entries.append( ( path, os.stat( path ).st_mtime_ns ) )
+                except OSError:
+                    # removed while we were walking, the next check will notice
+                    pass
+        return hash( frozenset( entries ) )
+
     def _clients_from_dir( self, search_dir ):
         """
         Get clients from a specified search_dir. 
         Each client is retrieved with its resources.
+
+        @returns a dictionary mapping client ids to clients
         """
+        output = dict()
         clients = dict()
 
         # get the full path for each client
@@ -44,7 +141,66 @@ class ClientManager:
             # logging.getLogger().debug( f"Created new client {client.get_id()} "
             #                            f"with resources: {''.join( resources )}"
             # )
-            self._clients[ new_client.get_id() ] = new_client
+            output[ new_client.get_id() ] = new_client
+
+        return output
+
+    def _index_client( self, client, index ):
+        """
+        Add the values of a client's identifier resources to an index, 
+        and keep the index up to date when those resources are written.
+
+        @param client The client to index
+        @param index The index to add the client to
+        """
+        for name, resource in client.get_resources().items():
+            if not resource.is_identifier:
+                continue
+
+            service, identifier = name.split( '/' )
+            resource.add_write_listener( self._get_index_updater( client, service, identifier ) )
+
+            try:
+                values = resource.get_data()
+            except OSError:
+                logging.getLogger().warning( f"Unable to read resource '{name}' "
+                                             f"of client {client.get_id()}"
+                )
+                continue
+
+            for value in values:
+                self._add_to_index( index, ( service, identifier, str( value ) ), client.get_id() )
+
+    def _add_to_index( self, index, key, client_id ):
+        existing = index.get( key )
+        if existing is not None and existing != client_id:
+            logging.getLogger().warning( f"Clients {existing} and {client_id} share the "
+                                         f"identifier {key}, using {existing}."
+            )
+            return
+        index[ key ] = client_id
+
+    def _get_index_updater( self, client, service, identifier ):
+        """
+        Get a write listener that moves a client's entries in the 
+        index from the resource's old values to its new values.
+        """
+        def update( old_values, new_values ):
+            with self._lock:
+                # the client was replaced by a reload, which indexed its new values
+                if self._clients.get( client.get_id() ) is not client:
+                    return
+
+                for value in old_values:
+                    key = ( service, identifier, str( value ) )
+                    if self._index.get( key ) == client.get_id():
+                        del self._index[ key ]
+
+                for value in new_values:
+                    self._add_to_index( self._index, ( service, identifier, str( value ) ),
+                                        client.get_id()
+                    )
+        return update
 
     def get_client_by_id( self, client_id ):
         return self._clients[ client_id ]
@@ -59,7 +215,7 @@ class ClientManager:
            ValueError if the client with client_id already exists.
         """
         if client_id in self._clients:
-            raise ValueError( f"Client with id {new_client.get_id()}"
+            raise ValueError( f"Client with id {client_id} "
                                "already exists!"
                             )
 
@@ -83,26 +239,22 @@ class ClientManager:
         identifier_value = str( identifier_value )
 
         if identifier == 'listing_id':
-            listing_id = self.conn.get_listing_id( identifier_value )
-            cli_id = self.conn.get_client_by_listing_id( listing_id )
-            return self.get_client_by_id( cli_id )
-        
-        for client in self.get_clients():
-            
             try:
-                result = client.get_resource( service, identifier ) \
-                               .contains( identifier_value )
-                if result:
-                    return client
+                listing_id = self.conn.get_listing_id( identifier_value )
+                client_id = self.conn.get_client_by_listing_id( listing_id )
+            except KeyError:
+                client_id = None
+        else:
+            client_id = self._index.get( ( service, identifier, identifier_value ) )
 
-            # client doesn't have this service
-            except:
-                pass
+        if client_id is None:
+            logging.getLogger().debug( "Failed to find a client with identifier (%s) for "
+                                       "service %s.", identifier, service
+            )
+            return None
+
+        return self.get_client_by_id( client_id )
 
-        logging.getLogger().debug( f"Failed to find a client with identifier ({identifier}) for "
-                                   f"service {service}."
-        )
-        
     def get_clients( self ):
         return self._clients.values()
 
@@ -114,8 +266,12 @@ class ClientManager:
         
         @pre new_client.get_id() cannot be in self.client_dir
         """
-        self.check_existing_client( new_client.get_id() )
-        self._clients[ new_client.get_id() ] = new_client
+        with self._lock:
+            self.check_existing_client( new_client.get_id() )
+            clients = self._clients.copy()
+            clients[ new_client.get_id() ] = new_client
+            self._clients = clients
+            self._index_client( new_client, self._index )
 
     def _get_client_nums( self ):
         """
@@ -132,18 +288,23 @@ class ClientManager:
         """
         Register a client with certain resources.
         Creates the necessary file structure for each resource.
+
+        @returns the newly registered Client
         """
-        client_num = max( self._get_client_nums() ) + 1
+        with self._lock:
+            client_num = max( self._get_client_nums() ) + 1
+
+            new_cl_id = f'client_{client_num}'
 
-        new_cl_id = f'client_{client_num}'
+            self.check_existing_client( new_cl_id )
 
-        self.check_existing_client( new_cl_id )
+            new_client = Client( new_cl_id, resources,
+                                 base_path = self._dir
+                               )
 
-        new_client = Client( new_cl_id, resources,
-                             base_path = self._dir
-                           )
+            self.register_existing_client( new_client )
 
-        self.register_existing_client( new_client )
+        return new_client
 
 if __name__ == '__main__':
     cli = ClientManager( 'clients' )
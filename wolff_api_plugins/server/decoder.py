@@ -1,5 +1,11 @@
 from enum import Enum
 import logging
+from .. common import codec
+
+"""
+The number of bytes ( application and opcode ) that start every message.
+"""
+HEADER_SIZE = codec.HEADER.size
 
 class Applications( Enum ):
     ETSY = 1
@@ -13,6 +19,13 @@ class DecoderFactory:
            is reduced
     @returns A decoder that can decode the message
     """
+
+    """
+    Decoders hold no state, so a single decoder for 
+    each application is shared by every message.
+    """
+    _decoders = dict()
+
     def get_decoder( self, message ):
         decoder = self.get_service( message )
         return decoder
@@ -24,12 +37,17 @@ class DecoderFactory:
         application = message[ 0 ]
 
         if application == Applications.ETSY.value:
-            return EtsyDecoder()
+            decoder = DecoderFactory._decoders.get( application )
+            if decoder is None:
+                decoder = DecoderFactory._decoders.setdefault( application, EtsyDecoder() )
+            return decoder
 
 class EtsyDecoder:
     """
     A class that is capable of decoding
     messages for the Etsy service.
+
+    The layout of each message is declared in wolff_api_plugins.common.codec.
     """
     class Services( Enum ):
         """
@@ -42,6 +60,10 @@ class EtsyDecoder:
 
         UPDATE_LISTING = 3
 
+        CREATE_LISTING_BATCH = 4
+
+        CHECK_LISTING_STOCK_BATCH = 5
+
         @classmethod
         def has_value( cls, value ):
             """
@@ -57,97 +79,134 @@ class EtsyDecoder:
 
     def __init__( self ):
         """
-        A map associating bytes with titles.
-        """
-        self.title_map       = { 0x01: 'title_1' }
-        self.description_map = { 0x02: 'desc_1' }
-        self.who_made_map    = { 0x01: 'i_did',
-                                 0x02: 'collective',
-                                 0x03: 'someone_else'
-                               }
-        self.when_made_map   = { 0x01: 'made_to_order',
-                                 0x02: '2010_2019',
-                                 0x03: '2000_2009',
-                                 0x04: 'before_2000',
-                                 0x05: '1990s',
-                                 0x06: '1980s',
-                                 0x07: '1970s',
-                                 0x08: '1960s'
-                               }
-
+        Maps each opcode to the method that decodes its messages.
+        """
+        self._service_decoders = { EtsyDecoder.Services.CREATE_LISTING.value:
+                                       self._decode_create_listing_message,
+                                   EtsyDecoder.Services.CHECK_LISTING_STOCK.value:
+                                       self._decode_check_listing_stock_message,
+                                   EtsyDecoder.Services.CREATE_LISTING_BATCH.value:
+                                       self._decode_create_listing_batch_message,
+                                   EtsyDecoder.Services.CHECK_LISTING_STOCK_BATCH.value:
+                                       self._decode_check_listing_stock_batch_message
+                                 }
 
     def is_etsy_message( self, message ):
-        return EtsyDecoder.Services.has_value( message[ 0 ] )
+        return message[ 0 ] == Applications.ETSY.value
 
     def get_service_decoder( self, message ):
         """
         Get a method that will decode messages for a certain service.
         """
-        if message[ 1 ] == EtsyDecoder.Services.CREATE_LISTING.value:
-            logging.getLogger().debug( "Retrieving a decoder for ( etsy, create_listing )" )
-            return self._decode_create_listing_message
-        elif message[ 1 ] == EtsyDecoder.Services.CHECK_LISTING_STOCK.value:
-            logging.getLogger().debug( "Retrieving a decoder for ( etsy, check_listing_stock )" )
-            return self._decode_check_listing_stock_message
-        else:
-            logging.getLogger().error( f"No decoder can be created for the message: {message}" )
+        decode_fn = self._service_decoders.get( message[ 1 ] )
+        if decode_fn is None:
+            logging.getLogger().error( f"No decoder can be created for the message: {bytes( message )}" )
+        return decode_fn
 
     def decode( self, message ):
-        try:
-            assert( self.is_etsy_message( message ) )
-        except AssertionError:
-            logging.getLogger().error( f"The supplied message: '{message}', was not an Etsy message!" )
+        """
+        Decode a message. 
 
-        decode_fn = self.get_service_decoder( message )
+        @param message The encoded message, any object supporting the buffer 
+               protocol, such as bytes or a memoryview.
+        @returns a dictionary of the arguments of the message and their values
+        """
+        if not self.is_etsy_message( message ):
+            logging.getLogger().error( f"The supplied message: '{bytes( message )}', "
+                                       "was not an Etsy message!"
+            )
 
-        logging.getLogger().debug( f"Successfully retrieved a decoder ('{decode_fn.__name__}') "
-                                   f"for the message: {message}" )
+        decode_fn = self.get_service_decoder( message )
+        if decode_fn is None:
+            raise ValueError( f"Unsupported Etsy opcode: {message[ 1 ]}" )
 
         return decode_fn( message )
 
     def _decode_check_listing_stock_message( self, message ):
-        logging.getLogger().debug( "Attempting to decode a 'check_listing_stock' message" )
-        output = dict()
+        output = codec.ETSY_CHECK_LISTING_STOCK.decode( message, HEADER_SIZE )
         output[ 'api_details' ] = ( 'etsy', 'check_listing_stock' )
-        listing_id_bytes = message[ 2:6 ]
+        return output
 
-        logging.getLogger().debug( f"Listing bytes: {listing_id_bytes}" )
+    def _decode_check_listing_stock_batch_message( self, message ):
+        """
+        Decode a message that checks the stock of several Etsy listings at once.
+        The message has the form:
+
+          [ application ][ opcode ][ count ][ record id 1 ] ... [ record id count ]
 
-        listing_id = int.from_bytes( listing_id_bytes, byteorder = 'big' )
-        logging.getLogger().debug( f"Listing id integer: {listing_id}" )
+        where each record id is 4 bytes.
 
-        output [ 'listing_id' ] = listing_id
-        logging.getLogger().debug( f"Final decoded message: {output}" )
+        @param message an encoded message
+        @returns A dictionary of the form:
+        {
+          'api_details': ( 'etsy', 'check_listing_stock_batch' ),
+          'batch': [ ... ]
+        }
+        where 'batch' holds a decoded check_listing_stock message for each record.
+        """
+        count = message[ 2 ]
+        size = codec.ETSY_STOCK_CHECK_RECORD.size
+        if count == 0:
+            raise ValueError( "A batch must contain at least one record" )
+        if len( message ) != 3 + count * size:
+            raise ValueError( f"A batch of {count} records should be {3 + count * size} "
+                              f"bytes, not {len( message )}"
+            )
 
+        output = dict()
+        output[ 'api_details' ] = ( 'etsy', 'check_listing_stock_batch' )
+        output[ 'batch' ] = list()
+        for start in range( 3, len( message ), size ):
+            item = codec.ETSY_STOCK_CHECK_RECORD.decode( message, start )
+            item[ 'api_details' ] = ( 'etsy', 'check_listing_stock' )
+            output[ 'batch' ].append( item )
+
+        logging.getLogger().debug( "Decoded a stock check of %d records", count )
         return output
 
-    def _get_price( self, price_bytes ):
-        """
-        Get the price of the product from 
-        a list of two bytes representing the price of the product.
-        @param price_bytes Two bytes of an encoded method 
-               that represent the price portion.
-        @returns the price of the product
+    def decode_update_listing_message( self, message ):
         """
-        integral_byte   = price_bytes[ 0 ]
 
-        # mask off first 4 bits
-        fractional_byte = price_bytes[ 1 ] & 0x0F
-        fractional_price = int( fractional_byte ) / 100.0
-
-        integral_second_half = ( price_bytes[ 1 ] & 0xF0 ) >> 4
+        """
+        return message
 
-        integral_price = ( int( integral_byte ) * 16 ) + int( integral_second_half )
+    def _decode_create_listing_batch_message( self, message ):
+        """
+        Decode a message that creates several Etsy listings at once.
+        The message has the form:
 
-        price = integral_price + fractional_price
+          [ application ][ opcode ][ count ][ listing 1 ] ... [ listing count ]
 
-        return price
+        where each listing is the 11 bytes that follow the application 
+        and opcode in a create_listing message.
 
-    def decode_update_listing_message( self, message ):
+        @param message an encoded message
+        @returns A dictionary of the form:
+        {
+          'api_details': ( 'etsy', 'create_listing_batch' ),
+          'batch': [ ... ]
+        }
+        where 'batch' holds the decoded create_listing message of each listing.
         """
+        count = message[ 2 ]
+        size = codec.ETSY_CREATE_LISTING.size
+        if count == 0:
+            raise ValueError( "A batch must contain at least one listing" )
+        if len( message ) != 3 + count * size:
+            raise ValueError( f"A batch of {count} listings should be {3 + count * size} "
+                              f"bytes, not {len( message )}"
+            )
 
-        """
-        return message
+        output = dict()
+        output[ 'api_details' ] = ( 'etsy', 'create_listing_batch' )
+        output[ 'batch' ] = [ { 'api_details': ( 'etsy', 'create_listing' ),
+                                'message': codec.ETSY_CREATE_LISTING.decode( message, start )
+                              }
+                              for start in range( 3, len( message ), size )
+                            ]
+
+        logging.getLogger().debug( "Decoded a batch of %d listings", count )
+        return output
 
     def _decode_create_listing_message( self, message ):
         """
@@ -171,48 +230,7 @@ class EtsyDecoder:
 
         }
         """
-        decoded_message = dict()
         output = dict()
-
         output[ 'api_details' ] = ( 'etsy', 'create_listing' )
-
-        title = message[ 2 ]
-        decoded_message[ 'title' ] = self.title_map[ title ]
-
-        description = message[ 3 ]
-        decoded_message[ 'description' ] = self.description_map[ description ]
-
-        quantity = message[ 4 ]
-        decoded_message[ 'quantity' ] = quantity
-
-        price = self._get_price( message[ 5:7 ] )
-        decoded_message[ 'price' ] = price
-
-        who_made = message[ 7 ] & 0b00001111
-        decoded_message[ 'who_made' ] = self.who_made_map[ who_made ]
-
-        when_made_mask = 0b01110000
-        when_made = ( message[ 7 ] & when_made_mask ) >> 4
-        decoded_message[ 'when_made' ] = self.when_made_map[ when_made ]
-
-        is_supply = ( message[ 7 ] & 0b10000000 ) >> 7
-        decoded_message[ 'is_supply' ] = is_supply
-
-        # stp = shipping_template_part
-        stp1 = message[ 8 ]
-        stp2 = message[ 9 ]
-        stp3 = message[ 10 ]
-        stp4 = message[ 11 ]
-        stp5 = message[ 12 ]
-
-        shipping_template_id = ( stp1 * ( 256 ** 4 ) ) + \
-                               ( stp2 * ( 256 ** 3 ) ) + \
-                               ( stp3 * ( 256 ** 2 ) ) + \
-                               ( stp4 * ( 256 ** 1 ) ) + \
-                               ( stp5 * ( 256 ** 0 ) )
-        decoded_message[ 'shipping_template_id' ] = shipping_template_id
-
-        output[ 'message' ] = decoded_message
-
+        output[ 'message' ] = codec.ETSY_CREATE_LISTING.decode( message, HEADER_SIZE )
         return output
-        
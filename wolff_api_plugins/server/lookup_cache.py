@@ -0,0 +1,185 @@
+from collections import OrderedDict
+import threading
+from . DBConnection import DBConnection
+
+class LookupCache:
+    """
+    A bounded mapping, evicting entries in least-recently-used order
+    once it holds more than max_entries, that counts its hits and misses.
+    """
+    def __init__( self, max_entries ):
+        """
+        @param max_entries The maximum number of entries to keep. If 0,
+               nothing is kept, and every lookup misses.
+        """
+        if max_entries < 0:
+            raise ValueError( "max_entries cannot be negative" )
+
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get( self, key ):
+        """
+        @returns the value of key, or None if it is not cached
+        """
+        with self._lock:
+            value = self._entries.get( key )
+            if value is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._entries.move_to_end( key )
+            return value
+
+    def put( self, key, value ):
+        with self._lock:
+            if not self._max_entries:
+                return
+
+            self._entries[ key ] = value
+            self._entries.move_to_end( key )
+            while len( self._entries ) > self._max_entries:
+                self._entries.popitem( last = False )
+                self._evictions += 1
+
+    def clear( self ):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats( self ):
+        """
+        @returns a dictionary containing the number of cached entries,
+                 hits, misses, the hit rate and evictions.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return { 'entries': len( self._entries ),
+                     'max_entries': self._max_entries,
+                     'hits': self._hits,
+                     'misses': self._misses,
+                     'hit_rate': self._hits / lookups if lookups else 0.0,
+                     'evictions': self._evictions
+                   }
+
+class CachingDBConnection( DBConnection ):
+    """
+    A read-through cache in front of a DBConnection, e.g. a
+    SQLite3DBConnection, for the mappings between a listing's record id,
+    its listing id and its client. A listing's record id, listing id and
+    client never change once it is recorded, so the cached mappings are
+    never invalidated. Every other method is passed to the connection.
+
+    Listings recorded through the cache are cached as they are recorded,
+    so the first lookup of a listing created by this server is a hit.
+    """
+    MAPPINGS = ( 'record_to_listing', 'listing_to_record', 'listing_to_client' )
+
+    def __init__( self, db_connection, max_entries = 65536, metrics_registry = None ):
+        """
+        @param db_connection The connection to the database
+        @param max_entries The maximum number of entries cached for each mapping
+        @param metrics_registry If not None, a MetricsRegistry the hits and misses
+               of each mapping are registered with.
+        """
+        self._db = db_connection
+        self._caches = { mapping: LookupCache( max_entries ) for mapping in CachingDBConnection.MAPPINGS }
+
+        if metrics_registry is not None:
+            for mapping, cache in self._caches.items():
+                for stat in ( 'hits', 'misses' ):
+                    metrics_registry.gauge( f'wolff_db_cache_{mapping}_{stat}',
+                                            f"Lookups of the {mapping.replace( '_', ' ' )} "
+                                            f"mapping that were {stat} of the cache.",
+                                            function = lambda cache = cache, stat = stat:
+                                                           cache.get_stats()[ stat ]
+                    )
+
+    def __getattr__( self, name ):
+        # the methods of a particular connection, e.g. SQLite3DBConnection's conn
+        return getattr( self._db, name )
+
+    def migrate( self, version = None ):
+        return self._db.migrate( version )
+
+    def get_listing_stock( self, record_id ):
+        return self._db.get_listing_stock( record_id )
+
+    def get_stock_records( self, record_ids ):
+        return self._db.get_stock_records( record_ids )
+
+    def add_listing_stock( self, record_id, quantity ):
+        self._db.add_listing_stock( record_id, quantity )
+
+    def update_listing_stock( self, record_id, quantity ):
+        self._db.update_listing_stock( record_id, quantity )
+
+    def update_listings_stock( self, quantities ):
+        self._db.update_listings_stock( quantities )
+
+    def get_request_response( self, request_key ):
+        return self._db.get_request_response( request_key )
+
+    def record_request_response( self, request_key, response ):
+        self._db.record_request_response( request_key, response )
+
+    def forget_request_responses( self, before ):
+        return self._db.forget_request_responses( before )
+
+    def flush( self ):
+        self._db.flush()
+
+    def close( self ):
+        self._db.close()
+
+    def _remember( self, record_id, listing_id, client_id ):
+        listing_id = str( listing_id )
+        self._caches[ 'record_to_listing' ].put( int( record_id ), listing_id )
+        self._caches[ 'listing_to_record' ].put( listing_id, int( record_id ) )
+        self._caches[ 'listing_to_client' ].put( listing_id, str( client_id ) )
+
+    def add_listing( self, listing_id, client_id ):
+        record_id = self._db.add_listing( listing_id, client_id )
+        self._remember( record_id, listing_id, client_id )
+        return record_id
+
+    def record_created_listing( self, listing_id, client_id, quantity ):
+        record_id = self._db.record_created_listing( listing_id, client_id, quantity )
+        self._remember( record_id, listing_id, client_id )
+        return record_id
+
+    # record ids are integers and listing ids are text in the database, but
+    # both are given as either, so they are normalized to key the caches
+
+    def get_listing_id( self, record_id ):
+        listing_id = self._caches[ 'record_to_listing' ].get( int( record_id ) )
+        if listing_id is None:
+            listing_id = self._db.get_listing_id( record_id )
+            self._caches[ 'record_to_listing' ].put( int( record_id ), listing_id )
+        return listing_id
+
+    def get_record_id( self, listing_id ):
+        record_id = self._caches[ 'listing_to_record' ].get( str( listing_id ) )
+        if record_id is None:
+            record_id = self._db.get_record_id( listing_id )
+            self._caches[ 'listing_to_record' ].put( str( listing_id ), record_id )
+        return record_id
+
+    def get_client_by_listing_id( self, listing_id ):
+        client_id = self._caches[ 'listing_to_client' ].get( str( listing_id ) )
+        if client_id is None:
+            client_id = self._db.get_client_by_listing_id( listing_id )
+            self._caches[ 'listing_to_client' ].put( str( listing_id ), client_id )
+        return client_id
+
+    def get_cache_stats( self ):
+        """
+        @returns a dictionary mapping the name of each mapping to
+                 the dictionary returned by its LookupCache.get_stats()
+        """
+        return { mapping: cache.get_stats() for mapping, cache in self._caches.items() }
@@ -0,0 +1,101 @@
+import itertools
+import threading
+import time
+from . DBConnection import DBConnection
+
+class InMemoryDBConnection( DBConnection ):
+    """
+    Storage kept in dictionaries, for tests and benchmarks. Nothing is
+    written to disk, and nothing is shared with other processes.
+    """
+    def __init__( self ):
+        self._lock = threading.Lock()
+        self._record_ids = itertools.count( 1 )
+
+        # record id -> listing id, and the reverse
+        self._listings = dict()
+        self._records = dict()
+        # listing id -> client id
+        self._clients = dict()
+        # record id -> quantity in stock
+        self._stock = dict()
+        # request key -> ( response, time recorded )
+        self._requests = dict()
+
+    def add_listing( self, listing_id, client_id ):
+        listing_id = str( listing_id )
+        with self._lock:
+            if listing_id in self._clients:
+                raise ValueError( f"The listing {listing_id} is already recorded" )
+
+            record_id = next( self._record_ids )
+            self._listings[ record_id ] = listing_id
+            self._records[ listing_id ] = record_id
+            self._clients[ listing_id ] = str( client_id )
+        return record_id
+
+    def record_created_listing( self, listing_id, client_id, quantity ):
+        listing_id = str( listing_id )
+        with self._lock:
+            if listing_id in self._clients:
+                raise ValueError( f"The listing {listing_id} is already recorded" )
+
+            record_id = next( self._record_ids )
+            self._listings[ record_id ] = listing_id
+            self._records[ listing_id ] = record_id
+            self._clients[ listing_id ] = str( client_id )
+            self._stock[ record_id ] = int( quantity )
+        return record_id
+
+    def get_client_by_listing_id( self, listing_id ):
+        return self._clients[ str( listing_id ) ]
+
+    def get_listing_id( self, record_id ):
+        return self._listings[ int( record_id ) ]
+
+    def get_record_id( self, listing_id ):
+        return self._records[ str( listing_id ) ]
+
+    def get_listing_stock( self, record_id ):
+        return self._stock[ int( record_id ) ]
+
+    def get_stock_records( self, record_ids ):
+        with self._lock:
+            return { int( record_id ): ( self._listings[ int( record_id ) ],
+                                         self._clients[ self._listings[ int( record_id ) ] ],
+                                         self._stock[ int( record_id ) ]
+                                       )
+                     for record_id in record_ids
+                     if int( record_id ) in self._stock and int( record_id ) in self._listings
+                   }
+
+    def add_listing_stock( self, record_id, quantity ):
+        with self._lock:
+            if int( record_id ) in self._stock:
+                raise ValueError( f"The record {record_id} already has stock" )
+            self._stock[ int( record_id ) ] = int( quantity )
+
+    def update_listing_stock( self, record_id, quantity ):
+        with self._lock:
+            if int( record_id ) in self._stock:
+                self._stock[ int( record_id ) ] = int( quantity )
+
+    def update_listings_stock( self, quantities ):
+        with self._lock:
+            for record_id, quantity in quantities.items():
+                if int( record_id ) in self._stock:
+                    self._stock[ int( record_id ) ] = int( quantity )
+
+    def get_request_response( self, request_key ):
+        return self._requests[ request_key ][ 0 ]
+
+    def record_request_response( self, request_key, response ):
+        with self._lock:
+            self._requests[ request_key ] = ( bytes( response ), time.time() )
+
+    def forget_request_responses( self, before ):
+        with self._lock:
+            forgotten = [ key for key, ( _, recorded ) in self._requests.items() if recorded < before ]
+            for key in forgotten:
+                del self._requests[ key ]
+        return len( forgotten )
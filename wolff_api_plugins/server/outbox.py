@@ -0,0 +1,110 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+_CREATE_OUTBOX = '''CREATE TABLE IF NOT EXISTS Outbox ( Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                        Topic TEXT NOT NULL,
+                                                        Payload BLOB NOT NULL,
+                                                        Enqueued REAL NOT NULL
+                                                      )'''
+_INSERT_MESSAGE = 'INSERT INTO Outbox ( Topic, Payload, Enqueued ) VALUES ( ?, ?, ? )'
+_SELECT_MESSAGES = 'SELECT Seq, Topic, Payload FROM Outbox ORDER BY Seq LIMIT ?'
+_DELETE_MESSAGE = 'DELETE FROM Outbox WHERE Seq = ?'
+
+class Outbox:
+    """
+    A queue of messages waiting to be published, kept in a SQLite database
+    so that it survives restarts and does not grow in memory. Messages are
+    taken in the order they were put, and stay in the queue until they are
+    removed, once the broker has acknowledged them.
+
+    May be used from any thread.
+    """
+    def __init__( self, file_name, max_depth = 100000, synchronous = 'normal' ):
+        """
+        @param file_name The database file the queue is kept in
+        @param max_depth The maximum number of messages in the queue
+        @param synchronous The SQLite synchronous setting. With 'normal', a
+               message put in the queue survives the proxy crashing, but may
+               not survive the host losing power; with 'full' it survives both,
+               at the cost of a sync to disk for each message.
+        """
+        if max_depth < 1:
+            raise ValueError( "max_depth must be at least 1" )
+
+        self._max_depth = max_depth
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect( file_name, check_same_thread = False )
+        self._conn.execute( 'PRAGMA journal_mode = wal' )
+        self._conn.execute( f'PRAGMA synchronous = {synchronous}' )
+        with self._conn:
+            self._conn.execute( _CREATE_OUTBOX )
+
+        self._depth = self._conn.execute( 'SELECT COUNT( * ) FROM Outbox' ).fetchone()[ 0 ]
+        self._put = 0
+        self._removed = 0
+        if self._depth:
+            logging.getLogger().info( "%d messages left in the outbox %s will be sent",
+                                      self._depth, file_name
+            )
+
+    def put( self, topic, payload ):
+        """
+        Add a message to the end of the queue.
+
+        @returns the sequence number of the message
+        @throws queue.Full if the queue holds max_depth messages
+        """
+        with self._lock:
+            if self._depth >= self._max_depth:
+                raise queue.Full( f"The outbox holds {self._depth} messages" )
+            with self._conn:
+                seq = self._conn.execute( _INSERT_MESSAGE, ( topic, bytes( payload ), time.time() ) ).lastrowid
+            self._depth += 1
+            self._put += 1
+        return seq
+
+    def peek( self, limit ):
+        """
+        @returns a list of up to limit ( sequence number, topic, payload )
+                 tuples, from the front of the queue
+        """
+        with self._lock:
+            return self._conn.execute( _SELECT_MESSAGES, ( limit, ) ).fetchall()
+
+    def remove( self, seqs ):
+        """
+        Remove messages from the queue, in one transaction.
+
+        @param seqs The sequence numbers of the messages
+        """
+        if not seqs:
+            return
+        with self._lock:
+            with self._conn:
+                removed = self._conn.executemany( _DELETE_MESSAGE, ( ( seq, ) for seq in seqs ) ).rowcount
+            self._depth -= removed
+            self._removed += removed
+
+    def get_depth( self ):
+        return self._depth
+
+    def get_stats( self ):
+        """
+        @returns a dictionary containing the number of messages in the queue,
+                 the age in seconds of the oldest one, and the number of
+                 messages put and removed since the queue was opened
+        """
+        with self._lock:
+            oldest = self._conn.execute( 'SELECT Enqueued FROM Outbox ORDER BY Seq LIMIT 1' ).fetchone()
+            return { 'depth': self._depth,
+                     'oldest_age': time.time() - oldest[ 0 ] if oldest else 0.0,
+                     'put': self._put,
+                     'removed': self._removed
+                   }
+
+    def close( self ):
+        with self._lock:
+            self._conn.close()
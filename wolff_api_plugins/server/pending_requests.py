@@ -0,0 +1,87 @@
+from concurrent.futures import Future
+import threading
+
+class PendingRequests:
+    """
+    The requests sent that are waiting for a response, by request id.
+    Each request is given a Future when it is added, which is resolved
+    with its response by whichever thread receives the response, so any
+    number of requests can be waiting at once.
+    """
+    def __init__( self ):
+        self._futures = dict()
+        self._lock = threading.Lock()
+
+        self._resolved = 0
+        self._timed_out = 0
+        self._unmatched = 0
+
+    def add( self, request_id ):
+        """
+        Start waiting for the response to a request.
+
+        @param request_id The id of the request, which its response is sent with
+        @returns a Future that is resolved with the response
+        @throws ValueError if a request with request_id is already waiting
+        """
+        future = Future()
+        with self._lock:
+            if request_id in self._futures:
+                raise ValueError( f"A request with id {request_id} is already waiting" )
+            self._futures[ request_id ] = future
+        return future
+
+    def resolve( self, request_id, response ):
+        """
+        Hand the response to a request to whoever is waiting for it.
+
+        @returns False if no request with request_id is waiting, e.g. because
+                 it timed out, in which case the response is dropped
+        """
+        with self._lock:
+            future = self._futures.pop( request_id, None )
+            if future is None:
+                self._unmatched += 1
+                return False
+            self._resolved += 1
+        future.set_result( response )
+        return True
+
+    def wait( self, request_id, future, timeout = None ):
+        """
+        Wait for the response to a request added with add().
+
+        @param timeout The number of seconds to wait, or None to wait as long as necessary
+        @returns the response
+        @throws TimeoutError if the response does not arrive within timeout
+                seconds. The request stops waiting, and a response that arrives
+                later is dropped.
+        """
+        try:
+            return future.result( timeout )
+        except TimeoutError:
+            with self._lock:
+                if self._futures.pop( request_id, None ) is None:
+                    # resolved as it timed out
+                    return future.result()
+                self._timed_out += 1
+            raise
+
+    def discard( self, request_id ):
+        """
+        Stop waiting for the response to a request, e.g. because it could not be sent.
+        """
+        with self._lock:
+            self._futures.pop( request_id, None )
+
+    def get_stats( self ):
+        """
+        @returns a dictionary containing the number of requests waiting, and the
+                 number resolved, timed out, and of responses that matched no request
+        """
+        with self._lock:
+            return { 'pending': len( self._futures ),
+                     'resolved': self._resolved,
+                     'timed_out': self._timed_out,
+                     'unmatched': self._unmatched
+                   }
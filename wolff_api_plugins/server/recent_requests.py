@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+class RecentRequests:
+    """
+    The requests a server has recently handled, by a key that identifies
+    each request, and the response to each, so that a request delivered
+    more than once is only handled once. MQTT delivers messages sent with
+    QoS 1 at least once, so the same request can arrive again, e.g. when a
+    node proxy resends a request whose acknowledgement was lost.
+
+    The responses are kept in memory, up to max_entries of them, and in the
+    database, for ttl seconds, so requests delivered again after the server
+    restarts are still recognized.
+    """
+
+    """
+    Returned by start() for a request that is still being handled.
+    """
+    IN_PROGRESS = object()
+
+    """
+    The number of responses recorded between removing the expired ones from the database.
+    """
+    FORGET_INTERVAL = 1000
+
+    def __init__( self, db_connection = None, max_entries = 10000, ttl = 86400 ):
+        """
+        @param db_connection The DBConnection responses are recorded in. If None,
+               responses are only kept in memory.
+        @param max_entries The maximum number of responses kept in memory
+        @param ttl The number of seconds responses are kept in the database
+        """
+        if max_entries < 0:
+            raise ValueError( "max_entries cannot be negative" )
+
+        self._db = db_connection
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._responses = OrderedDict()
+        self._in_progress = set()
+        self._lock = threading.Lock()
+
+        self._recorded = 0
+        self._answered = 0
+        self._dropped = 0
+
+    def start( self, key ):
+        """
+        Start handling a request, unless it has already been handled or is
+        being handled.
+
+        @param key The key that identifies the request
+        @returns None if the request should be handled, in which case finish()
+                 must be called once it is, or abandon() if it could not be
+                 performed. IN_PROGRESS if it is being handled, otherwise the
+                 response to the request.
+        """
+        with self._lock:
+            if key in self._in_progress:
+                self._dropped += 1
+                return RecentRequests.IN_PROGRESS
+
+            response = self._responses.get( key )
+            if response is not None:
+                self._responses.move_to_end( key )
+                self._answered += 1
+                return response
+
+            self._in_progress.add( key )
+
+        if self._db is not None:
+            try:
+                response = self._db.get_request_response( key )
+            except KeyError:
+                return None
+            except Exception:
+                self.abandon( key )
+                raise
+
+            with self._lock:
+                self._remember( key, response )
+                self._in_progress.discard( key )
+                self._answered += 1
+            return response
+
+        return None
+
+    def _remember( self, key, response ):
+        if self._max_entries:
+            self._responses[ key ] = response
+            self._responses.move_to_end( key )
+            while len( self._responses ) > self._max_entries:
+                self._responses.popitem( last = False )
+
+    def finish( self, key, response ):
+        """
+        Record the response to a request started with start(). If it cannot
+        be recorded in the database, the error is logged, and the response
+        is only kept in memory.
+        """
+        response = bytes( response )
+        with self._lock:
+            self._remember( key, response )
+            self._recorded += 1
+            forget = self._recorded % RecentRequests.FORGET_INTERVAL == 0
+
+        try:
+            if self._db is not None:
+                self._db.record_request_response( key, response )
+                if forget:
+                    forgotten = self._db.forget_request_responses( time.time() - self._ttl )
+                    logging.getLogger().debug( "Forgot %d expired request responses", forgotten )
+        except Exception as e:
+            logging.getLogger().error( "Failed to record the response to request '%s': %s", key, e )
+        finally:
+            with self._lock:
+                self._in_progress.discard( key )
+
+    def abandon( self, key ):
+        """
+        Give up on a request started with start(), e.g. because handling it
+        failed, so that it is handled again if it is delivered again.
+        """
+        with self._lock:
+            self._in_progress.discard( key )
+
+    def get_stats( self ):
+        """
+        @returns a dictionary containing the number of responses kept in memory,
+                 the number of requests being handled, the number of responses
+                 recorded, and the number of requests delivered again that were
+                 answered with a recorded response, or dropped because they were
+                 still being handled.
+        """
+        with self._lock:
+            return { 'entries': len( self._responses ),
+                     'in_progress': len( self._in_progress ),
+                     'recorded': self._recorded,
+                     'answered': self._answered,
+                     'dropped': self._dropped
+                   }
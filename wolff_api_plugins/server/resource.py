@@ -8,6 +8,14 @@ class FileResource:
     This class provides methods for creation, editing, etc. of 
     FileResources.
     """
+
+    """
+    True for resources whose values identify the client that owns them, 
+    such as a shipping template id. ClientManager indexes these values 
+    so that a client can be found by them.
+    """
+    is_identifier = False
+
     def __init__( self, resource_id, base_path, resource_name = "resource.txt",
                   values = None,
                   root_path = '.'
@@ -28,6 +36,7 @@ class FileResource:
         self._root = root_path
         self._resource_name = resource_name
         self._data = None
+        self._write_listeners = list()
 
         self._create_dir( f'{root_path}/{resource_id}/{base_path}' )
 
@@ -53,6 +62,18 @@ class FileResource:
             self._data = self.read()
         return self._data
 
+    def add_write_listener( self, listener ):
+        """
+        Register a callable that is invoked each time this resource is written.
+        
+        @param listener A callable that is invoked as listener( old_values, new_values )
+        """
+        self._write_listeners.append( listener )
+
+    def _notify_write( self, old_values, new_values ):
+        for listener in self._write_listeners:
+            listener( old_values, new_values )
+
     def _create_dir( self, path ):
         pathlib.Path( path ).mkdir( parents = True, exist_ok = True )
                 
@@ -174,6 +195,8 @@ class ShippingTemplateIdResource( FileResource ):
     A resource representing the ShippingTemplateId 
     for Etsy's create listing method.
     """
+    is_identifier = True
+
     def __init__( self, resource_id, base_path, root_path = '.',
                   values = None
                 ):
@@ -181,20 +204,35 @@ class ShippingTemplateIdResource( FileResource ):
                           root_path = root_path
                         )
 
-        self._data = dict()
+        self._data = set()
 
         if values:
             self.write( values )
-            self._data = values
 
     def write( self, values, override = False ):
-        if not( override ) and os.path.exists( self.get_full_file_path() ):
+        """
+        Write shipping template ids to this resource, one per line.
+
+        @throws OSError if override is false and the specified file already exists
+        @param values the shipping template ids to write
+        @param override include if you want an existing file with this resources'
+                     path to be overwritten.
+        """
+        exists = os.path.exists( self.get_full_file_path() )
+        if not( override ) and exists:
             raise OSError( f"File {self.get_full_file_path()} exists!" )
 
+        old_values = self._data
+        if not old_values and exists:
+            old_values = self.read()
+
         with open( self.get_full_file_path(), 'w' ) as of:
             for val in values:
                 of.write( f'{val}\n' )
 
+        self._data = set( str( val ) for val in values )
+        self._notify_write( old_values, self._data )
+
     def read( self ):
         output = set()
 
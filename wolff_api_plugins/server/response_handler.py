@@ -1,5 +1,6 @@
 import json
 import logging
+from .. common import codec
 
 class ResponseHandler:
     def __init__( self, db_conn  ):
@@ -20,8 +21,22 @@ class ResponseHandler:
                 )
                 return CheckListingStockResponseHandler( self._conn )
 
+            elif api_tuple[ 1 ] == 'create_listing_batch':
+                logging.getLogger().debug( "Creating a ResponseHandler for "
+                                           "etsy/create_listing_batch"
+                )
+                return CreateListingBatchResponseHandler( self._conn, data_dict[ 'batch' ] )
+
+            elif api_tuple[ 1 ] == 'check_listing_stock_batch':
+                logging.getLogger().debug( "Creating a ResponseHandler for "
+                                           "etsy/check_listing_stock_batch"
+                )
+                return CheckListingStockBatchResponseHandler( self._conn, data_dict[ 'batch' ] )
+
             else:
-                logging.getLogger().error( "{api_tuple[ 0 ]}/{api_tuple[ 1 ]} is not a valid service/method specifier." )
+                logging.getLogger().error( "%s/%s is not a valid service/method specifier.",
+                                           api_tuple[ 0 ], api_tuple[ 1 ]
+                )
                 raise ValueError( "Invalid service/method specifier included" ) 
 
 
@@ -35,11 +50,13 @@ class CreateListingResponseHandler:
         logging.getLogger().debug( "Attempting to retrieve a result from the database." )
         decoded_response = json.loads( resp_message )[ 'results' ][ 0 ]
         listing_id = decoded_response[ 'listing_id' ]
-        logging.getLogger().debug( f"Etsy Listing ID Retrieved: {listing_id}" )
-        record_id = self._db.add_listing( listing_id, client_id )
-        logging.getLogger().debug( f"Database record id: {record_id}" )
-        logging.getLogger().debug( f"Writing quantity: {decoded_response[ 'quantity' ]} to the database." )
-        self._db.add_listing_stock( record_id, decoded_response[ 'quantity' ] )
+        logging.getLogger().debug( "Etsy Listing ID Retrieved: %s", listing_id )
+        record_id = self._db.record_created_listing( listing_id, client_id,
+                                                    decoded_response[ 'quantity' ]
+        )
+        logging.getLogger().debug( "Database record id: %s, quantity: %s", record_id,
+                                   decoded_response[ 'quantity' ]
+        )
         record_bytes = record_id.to_bytes( 4, byteorder = 'big' )
 
         ret_val = bytearray( 2 )
@@ -50,6 +67,69 @@ class CreateListingResponseHandler:
 
         return ret_val
 
+    def get_failure_response( self ):
+        """
+        @returns the response sent when the listing could not be created, 
+                 or could not be recorded: a response with a record id of 0
+        """
+        ret_val = bytearray( 2 )
+        ret_val[ 0 ] = 0x01
+        ret_val[ 1 ] = 0x01
+        ret_val += bytearray( 4 + 7 )
+
+        return ret_val
+
+
+class CreateListingBatchResponseHandler:
+    """
+    Handles the responses to the requests of a create_listing_batch message, 
+    aggregating them into a single response of the form:
+
+      [ 0x01 ][ 0x04 ][ count ][ record id 1 ] ... [ record id count ]
+
+    where each record id is 4 bytes, and is 0 if the listing was not created.
+    """
+    def __init__( self, db_connection, batch ):
+        """
+        @param batch The decoded create_listing message of each listing created
+        """
+        self._listing_handler = CreateListingResponseHandler( db_connection )
+        self._batch = batch
+
+    def handle_responses( self, responses ):
+        """
+        @param responses A list containing a tuple ( response message, client id ) 
+               for each listing of the batch, in order. The response message is 
+               None if the request for that listing failed.
+        @returns the aggregated response
+        """
+        ret_val = bytearray( 3 )
+        ret_val[ 0 ] = 0x01
+        ret_val[ 1 ] = 0x04
+        ret_val[ 2 ] = len( responses )
+
+        for resp_message, client_id in responses:
+            record_bytes = bytes( 4 )
+
+            if resp_message is not None:
+                try:
+                    # the record id is in bytes 2 to 6 of a create_listing response
+                    record_bytes = self._listing_handler \
+                                       .handle_response( resp_message, client_id )[ 2:6 ]
+                except Exception as e:
+                    logging.getLogger().error( "Failed to record a listing of a batch: %s", e )
+
+            ret_val += record_bytes
+
+        return ret_val
+
+    def get_failure_response( self ):
+        """
+        @returns the response sent when none of the listings of the batch 
+                 could be recorded: a response with every record id 0
+        """
+        return self.handle_responses( [ ( None, None ) ] * len( self._batch ) )
+
 
 class CheckListingStockResponseHandler:
     def __init__( self, db_connection ):
@@ -64,22 +144,22 @@ class CheckListingStockResponseHandler:
         listing_id = decoded_response[ 'listing_id' ]
         record_id = self._db.get_record_id( listing_id )
 
-        logging.getLogger().debug( f"The record id of listing '{listing_id}' is '{record_id}'" )
+        logging.getLogger().debug( "The record id of listing '%s' is '%s'", listing_id, record_id )
 
         num_listings_db = self._db.get_listing_stock( record_id )
 
-        logging.getLogger().debug( f"Quantity of product currently: {num_listings_now}" )
-        logging.getLogger().debug( f"Quantity of product in database: {num_listings_db}" )
-        logging.getLogger().debug( f"Updating the quantity of record: {record_id}" )
+        logging.getLogger().debug( "Quantity of product currently: %s", num_listings_now )
+        logging.getLogger().debug( "Quantity of product in database: %s", num_listings_db )
+        logging.getLogger().debug( "Updating the quantity of record: %s", record_id )
 
         self._db.update_listing_stock( record_id, num_listings_now )
 
         num_listings_sold = num_listings_db - num_listings_now 
 
-        logging.getLogger().debug( f"Number of listings that have been sold (int): {num_listings_sold}" )
+        logging.getLogger().debug( "Number of listings that have been sold (int): %s", num_listings_sold )
         num_listings_sold_bytes = num_listings_sold.to_bytes( 4, byteorder = 'big' )
         logging.getLogger().debug( "Number of listings that have "
-                                   f"been sold (bytes): {num_listings_sold_bytes}" )
+                                   "been sold (bytes): %s", num_listings_sold_bytes )
 
         ret_val = bytearray( 2 )
         ret_val[ 0 ] = 0x01
@@ -89,3 +169,104 @@ class CheckListingStockResponseHandler:
         ret_val += bytearray( 7 )
 
         return ret_val
+
+    def get_failure_response( self ):
+        """
+        @returns the response sent when the stock of the listing could not 
+                 be checked: a response with codec.STOCK_CHECK_FAILED sold
+        """
+        ret_val = bytearray( 2 )
+        ret_val[ 0 ] = 0x01
+        ret_val[ 1 ] = 0x02
+
+        ret_val += codec.ETSY_STOCK_CHECK_SOLD.encode( { 'sold': codec.STOCK_CHECK_FAILED } )
+        ret_val += bytearray( 7 )
+
+        return ret_val
+
+
+class CheckListingStockBatchResponseHandler:
+    """
+    Handles the responses to the requests of a check_listing_stock_batch
+    message, aggregating them into a single response of the form:
+
+      [ 0x01 ][ 0x05 ][ count ][ sold 1 ] ... [ sold count ]
+
+    where each number sold is 4 bytes, signed, and is codec.STOCK_CHECK_FAILED
+    if the stock of the listing could not be checked. The stock of every
+    listing checked is updated in a single transaction.
+    """
+    def __init__( self, db_connection, batch ):
+        """
+        @param batch The decoded check_listing_stock message of each record checked
+        """
+        self._db = db_connection
+        self._batch = batch
+
+    def handle_responses( self, responses ):
+        """
+        @param responses A list containing a tuple ( response message, client id )
+               for each record of the batch, in order. The response message is
+               None if the request for that record failed. Records whose
+               listings were requested together share the same response message.
+        @returns the aggregated response
+        """
+        # the quantity of each listing in the responses, by listing id
+        quantities = dict()
+        parsed = set()
+        for resp_message, client_id in responses:
+            if resp_message is None or resp_message in parsed:
+                continue
+            parsed.add( resp_message )
+            try:
+                for result in json.loads( resp_message )[ 'results' ]:
+                    quantities[ str( result[ 'listing_id' ] ) ] = result[ 'quantity' ]
+            except Exception as e:
+                logging.getLogger().error( "Failed to read the stock of a batch of listings: %s", e )
+
+        record_ids = [ item[ 'listing_id' ] for item in self._batch ]
+        records = self._db.get_stock_records( record_ids )
+        stock = { record_id: record[ 2 ] for record_id, record in records.items() }
+        updates = dict()
+
+        ret_val = bytearray( 3 )
+        ret_val[ 0 ] = 0x01
+        ret_val[ 1 ] = 0x05
+        ret_val[ 2 ] = len( record_ids )
+
+        for record_id in record_ids:
+            record = records.get( record_id )
+            num_listings_now = quantities.get( str( record[ 0 ] ) ) if record else None
+
+            if num_listings_now is None:
+                logging.getLogger().error( "The stock of record %s could not be checked", record_id )
+                num_listings_sold = codec.STOCK_CHECK_FAILED
+            else:
+                num_listings_sold = stock[ record_id ] - num_listings_now
+                stock[ record_id ] = updates[ record_id ] = num_listings_now
+
+            logging.getLogger().debug( "Number of listings of record %s that have been sold: %s",
+                                       record_id, num_listings_sold
+            )
+            ret_val += codec.ETSY_STOCK_CHECK_SOLD.encode( { 'sold': num_listings_sold } )
+
+        if updates:
+            self._db.update_listings_stock( updates )
+
+        return ret_val
+
+    def get_failure_response( self ):
+        """
+        @returns the response sent when the stock of none of the records 
+                 could be checked: a response with codec.STOCK_CHECK_FAILED 
+                 sold for every record, without touching the database
+        """
+        ret_val = bytearray( 3 )
+        ret_val[ 0 ] = 0x01
+        ret_val[ 1 ] = 0x05
+        ret_val[ 2 ] = len( self._batch )
+
+        for item in self._batch:
+            ret_val += codec.ETSY_STOCK_CHECK_SOLD.encode( { 'sold': codec.STOCK_CHECK_FAILED } )
+
+        return ret_val
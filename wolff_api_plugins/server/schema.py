@@ -0,0 +1,82 @@
+import logging
+
+"""
+The migrations of the WOLFF database schema, in order. Migration N, whose
+statements are MIGRATIONS[ N - 1 ], brings the schema from version N - 1
+to version N. The version of a database is kept in its user_version, which
+is 0 for a new database and for a database created before migrations were
+introduced, so the statements of the first migration must not fail if the
+tables already exist.
+
+Never change a migration once it is released, add a new one instead.
+"""
+MIGRATIONS = [
+    # 1: the original tables
+    [ '''CREATE TABLE IF NOT EXISTS AppRecord ( RecordId INTEGER NOT NULL PRIMARY KEY,
+                                                ListingValue text
+                                              )''',
+      '''CREATE TABLE IF NOT EXISTS AppUser ( EtsyListingID TEXT NOT NULL PRIMARY KEY,
+                                              ClientID TEXT
+                                            )''',
+      '''CREATE TABLE IF NOT EXISTS EtsyListingStock ( RecordId INTEGER NOT NULL PRIMARY KEY,
+                                                       QuantityInStock INTEGER NOT NULL
+                                                     )'''
+    ],
+    # 2: listings are looked up by their listing id, and by client
+    [ 'CREATE INDEX IF NOT EXISTS AppRecordListingValue ON AppRecord ( ListingValue )',
+      'CREATE INDEX IF NOT EXISTS AppUserClientID ON AppUser ( ClientID )'
+    ],
+    # 3: the responses to recent requests, to answer requests delivered again
+    [ '''CREATE TABLE IF NOT EXISTS RecentRequest ( RequestKey TEXT NOT NULL PRIMARY KEY,
+                                                     Response BLOB NOT NULL,
+                                                     Recorded REAL NOT NULL
+                                                   )''',
+      'CREATE INDEX IF NOT EXISTS RecentRequestRecorded ON RecentRequest ( Recorded )'
+    ]
+]
+
+"""
+The version of the schema once every migration is applied.
+"""
+LATEST_VERSION = len( MIGRATIONS )
+
+def get_version( conn ):
+    """
+    @param conn A sqlite3 connection to the database
+    @returns the version of the schema of the database
+    """
+    return conn.execute( 'PRAGMA user_version' ).fetchone()[ 0 ]
+
+def migrate( conn, version = LATEST_VERSION ):
+    """
+    Apply the migrations the database is missing, up to version. Each
+    migration is applied in a transaction of its own, along with the
+    change to the version, so a migration that fails leaves the database
+    at the version before it.
+
+    @param conn A sqlite3 connection to the database
+    @param version The version to migrate to
+    @returns the version of the schema of the database
+    @throws ValueError if the database is newer than version
+    """
+    current = get_version( conn )
+    if current > version:
+        raise ValueError( f"The database is at schema version {current}, "
+                          f"which is newer than version {version}"
+        )
+
+    for number in range( current + 1, version + 1 ):
+        logging.getLogger().info( "Migrating the database to schema version %d", number )
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute( 'BEGIN' )
+        try:
+            for statement in MIGRATIONS[ number - 1 ]:
+                conn.execute( statement )
+            conn.execute( f'PRAGMA user_version = {number}' )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return get_version( conn )
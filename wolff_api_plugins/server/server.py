@@ -1,31 +1,123 @@
-from requests_oauthlib import OAuth1Session
+import contextlib
 import socket
+import queue
 import traceback
 import json
 import paho.mqtt.client as mqtt
 import time
 from threading import Thread
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
 import binascii
+import re
 import struct
+import uuid
 from . client_manager import ClientManager
 from . decoder import *
 from . api_map import *
 from . response_handler import *
+from . work_queue import FairWorkQueue
+from . pending_requests import PendingRequests
+from . outbox import Outbox
+from . recent_requests import RecentRequests
+from . session_pool import SessionPool
+from . transport import RequestsTransport
+from . server_metrics import ServerMetrics
+from .. common.framing import FrameReader, get_framer
+from .. common.metrics import MetricsRegistry
+from .. common.tracing import NULL_TRACE, Tracer
 
 class WOLFFServer:
     """ 
         A server for handling messages sent over 
         the WOLFF network.
     """
+
+    """
+    Serving modes for start(). In 'serial' mode connections are handled 
+    one at a time by the accepting thread. In 'threaded' mode each accepted 
+    connection is handed to a bounded pool of worker threads.
+    """
+    SERIAL   = 'serial'
+    THREADED = 'threaded'
+    MODES    = ( SERIAL, THREADED )
+
     def __init__( self, db_connection,
                   ip = "127.0.0.1",
-                  port = 5555
+                  port = 5555,
+                  mode = SERIAL,
+                  max_workers = 8,
+                  client_dir = 'clients',
+                  client_watch_interval = 0,
+                  session_pool = None,
+                  transport = None,
+                  api_map = None,
+                  framing = 'opcode',
+                  tracer = None,
+                  metrics_registry = None
                 ):
+        """
+        Create a WOLFFServer.
+
+        @param db_connection A connection to the WOLFF database
+        @param ip The ip to listen on
+        @param port The port to listen on
+        @param mode The serving mode, either WOLFFServer.SERIAL or 
+               WOLFFServer.THREADED
+        @param max_workers The maximum number of connections handled 
+               concurrently in 'threaded' mode. Once this many connections 
+               are being handled, no more connections are accepted until 
+               one of them finishes, so any further clients wait in the 
+               listen backlog.
+        @param client_dir The directory clients are loaded from
+        @param client_watch_interval If greater than 0, client_dir is checked for 
+               changes every client_watch_interval seconds and the clients are 
+               reloaded when it changes.
+        @param session_pool The SessionPool that sessions used to make requests on 
+               behalf of clients are taken from. If None, a SessionPool with 
+               default settings is used.
+        @param transport The UpstreamTransport requests to services are made with.
+               If None, a RequestsTransport using session_pool is used.
+        @param api_map The APIMap describing the services requests are made to.
+               If None, an APIMap with the services' default base urls is used.
+        @param framing How messages are framed on connections, one of the names 
+               in wolff_api_plugins.common.framing.FRAMERS. 'opcode' frames messages 
+               by the size of their opcode and is understood by every client, 
+               'length' prefixes each message with its length.
+        @param tracer The Tracer the latency of each message is recorded with.
+               If None, a Tracer that does not export traces is used.
+        @param metrics_registry The MetricsRegistry this server's metrics are 
+               registered with. If None, a registry of its own is created.
+        """
+        if mode not in WOLFFServer.MODES:
+            raise ValueError( f"Invalid serving mode '{mode}', expected one of {WOLFFServer.MODES}" )
+        if max_workers < 1:
+            raise ValueError( "max_workers must be at least 1" )
+
         self.ip = ip
         self.port = port
         self.conn = db_connection
+        self._mode = mode
+        self._max_workers = max_workers
+        self._client_dir = client_dir
+        self._client_watch_interval = client_watch_interval
+        self._client_manager = None
+        self._client_manager_lock = threading.Lock()
+        self._session_pool = session_pool if session_pool is not None else SessionPool()
+        self._transport = transport if transport else RequestsTransport( self._session_pool )
+        self._api_map = api_map if api_map else APIMap()
+        self._framer = get_framer( framing )
+        self._tracer = tracer if tracer else Tracer()
+        self._metrics = ServerMetrics( metrics_registry )
+        self._metrics.registry.gauge( 'wolff_session_pool_sessions',
+                                      "Client sessions kept open for reuse.",
+                                      function = lambda: self._session_pool.get_stats()[ 'sessions' ]
+        )
+
+        # serializes database writes made while handling responses,
+        # the database connection is shared between worker threads
+        self._db_lock = threading.Lock()
 
     def get_ip( self ):
         return self.ip
@@ -39,6 +131,12 @@ class WOLFFServer:
     def get_port( self ):
         return self.port
 
+    def get_tracer( self ):
+        return self._tracer
+
+    def get_metrics_registry( self ):
+        return self._metrics.registry
+
     def encode_data( self, data ):
         return json.dumps( data )
 
@@ -49,9 +147,16 @@ class WOLFFServer:
         Details of the encoded message can be found here:
         https://github.com/CANIS-NAU/WOLFF_Protocol/wiki
         """
-        decoder_factory = DecoderFactory()
-        decoder = decoder_factory.get_decoder( data )
-        data_dict = decoder.decode( data )
+        if len( data ) >= HEADER_SIZE:
+            self._metrics.messages_received.inc( data[ 0 ], data[ 1 ] )
+
+        try:
+            decoder_factory = DecoderFactory()
+            decoder = decoder_factory.get_decoder( data )
+            data_dict = decoder.decode( data )
+        except Exception:
+            self._metrics.decode_failures.inc()
+            raise
         return data_dict 
 
     def do_request( self, data_dict ):
@@ -69,23 +174,217 @@ class WOLFFServer:
                         url: the base url + the uri to submit the request to.
                         params: The paramaters (and their arguments) to include in the request
 
-        @returns the result object returned by OAuthRequestsLib
+        @returns the response returned by this server's UpstreamTransport, 
+                 an object with status_code, content and text
         """
-        request_handler = self.get_request_handler( data_dict[ 'credentials' ] )
-        logging.getLogger().debug( f"Performing a '{data_dict[ 'method' ][ 'http_method' ]}"
-                                   "' request on behalf of "
-                                   f"client to URL: {data_dict[ 'url' ]}."
+        logging.getLogger().debug( "Performing a '%s' request on behalf of "
+                                   "client to URL: %s.",
+                                   data_dict[ 'method' ][ 'http_method' ], data_dict[ 'url' ]
         )
+        start = self._metrics.start_request()
+        response = None
+        try:
+            response = self._transport.request( *self._get_request_args( data_dict ) )
+            return response
+        finally:
+            self._metrics.finish_request( *data_dict[ 'api_details' ], start, response )
+
+    def check_response( self, response ):
+        """
+        Check that a service performed a request.
 
+        @param response The response returned by do_request
+        @throws ValueError if the response does not have a 2xx status
+        """
+        if not 200 <= response.status_code < 300:
+            raise ValueError( f"The request failed with status {response.status_code}: "
+                              f"{response.text[ :200 ]}"
+            )
 
-        logging.getLogger().info( f"TIMESTAMP Message to etsy: {time.time()}" )
-        if data_dict[ 'method' ][ 'http_method' ] == 'get':
-            result = getattr( request_handler, data_dict[ 'method' ][ 'http_method' ] )( data_dict[ 'url' ] )
-        else:
-            result = getattr( request_handler, data_dict[ 'method' ][ 'http_method' ] )( data_dict[ 'url' ], data = data_dict[ 'message' ] )
+    def submit_request( self, data_dict ):
+        """
+        Start a request on behalf of the user without waiting for the response.
+        
+        @param data_dict The same dictionary taken by do_request
+        @returns a concurrent.futures.Future whose result is the response
+        """
+        logging.getLogger().debug( "Submitting a '%s' request to URL: %s.",
+                                   data_dict[ 'method' ][ 'http_method' ], data_dict[ 'url' ]
+        )
+        service, method = data_dict[ 'api_details' ]
+        start = self._metrics.start_request()
+
+        def on_done( future ):
+            response = None if future.exception() else future.result()
+            self._metrics.finish_request( service, method, start, response )
+
+        future = self._transport.submit( *self._get_request_args( data_dict ) )
+        future.add_done_callback( on_done )
+        return future
+
+    def submit_batch( self, data_dict, client_manager, trace = NULL_TRACE ):
+        """
+        Annotate each message of a batch and start its request, 
+        so the requests of the batch are performed concurrently.
+
+        @param data_dict A decoded message containing a 'batch' of messages
+        @param client_manager The ClientManager used to identify clients
+        @param trace The Trace of the batch. Its upstream span begins before the 
+               first request is started, and is ended by finish_batch.
+        @returns a list with a concurrent.futures.Future for each message of 
+                 the batch, whose result is the response to its request
+        """
+        futures = list()
+        trace.begin( 'upstream' )
+        if data_dict[ 'api_details' ][ 1 ] == 'check_listing_stock_batch':
+            with trace.span( 'annotate' ):
+                return self._submit_stock_checks( data_dict, client_manager )
+
+        for item in data_dict[ 'batch' ]:
+            try:
+                with trace.span( 'annotate' ):
+                    self.annotate_data( item, client_manager, trace )
+                futures.append( self.submit_request( item ) )
+            except Exception as e:
+                # the other messages of the batch are still sent
+                future = Future()
+                future.set_exception( e )
+                futures.append( future )
+        return futures
 
-        logging.getLogger().info( f"TIMESTAMP Response from etsy: {time.time()}" )
-        return result
+    def _submit_stock_checks( self, data_dict, client_manager ):
+        """
+        Start the requests for the stock of the records of a check_listing_stock_batch 
+        message. The records are looked up in a single query, and the listings of 
+        each client are requested together, as many at once as the service's method 
+        allows, or one at a time if it takes a single listing.
+
+        @returns a list with a concurrent.futures.Future for each record of the batch, 
+                 whose result is the response to the request for its listing
+        """
+        def failed( e ):
+            future = Future()
+            future.set_exception( e )
+            return future
+
+        batch = data_dict[ 'batch' ]
+        futures = [ None ] * len( batch )
+        records = self.conn.get_stock_records( [ item[ 'listing_id' ] for item in batch ] )
+
+        # the index in the batch of the records of each client
+        clients = dict()
+        for index, item in enumerate( batch ):
+            record = records.get( item[ 'listing_id' ] )
+            if record is None:
+                futures[ index ] = failed( ValueError( "No listing is recorded with the record "
+                                                       f"id {item[ 'listing_id' ]}"
+                                         ) )
+                continue
+            item[ 'client_id' ] = record[ 1 ]
+            clients.setdefault( record[ 1 ], list() ).append( index )
+
+        service, method = batch[ 0 ][ 'api_details' ]
+        batch_size = self._api_map.get_batch_size( service, method ) or 1
+        auth_type = self._api_map.get_auth_type( service )
+
+        for client_id, indices in clients.items():
+            try:
+                credentials = client_manager \
+                              .get_client_by_id( client_id ) \
+                              .get_resource( service, auth_type ) \
+                              .get_data()
+            except Exception as e:
+                # the records of other clients are still checked
+                for index in indices:
+                    futures[ index ] = failed( e )
+                continue
+
+            for start in range( 0, len( indices ), batch_size ):
+                chunk = indices[ start:start + batch_size ]
+                listing_ids = ','.join( str( records[ batch[ index ][ 'listing_id' ] ][ 0 ] )
+                                        for index in chunk
+                                      )
+                request = { 'api_details': ( service, method ),
+                            'method': { 'http_method': self._api_map.get_http_method( service, method ) },
+                            'url': self._api_map.get_complete_url( service, method, replace = listing_ids ),
+                            'credentials': credentials
+                          }
+                future = self.submit_request( request )
+                for index in chunk:
+                    futures[ index ] = future
+
+        return futures
+
+    def finish_batch( self, data_dict, futures, trace = NULL_TRACE ):
+        """
+        Wait for the requests started by submit_batch and handle their responses.
+
+        @returns the aggregated response to the batch
+        """
+        responses = list()
+        # messages of a batch may share a request, whose response is decoded once
+        decoded = dict()
+        for item, future in zip( data_dict[ 'batch' ], futures ):
+            try:
+                if future not in decoded:
+                    response = future.result()
+                    self.check_response( response )
+                    decoded[ future ] = response.content.decode( 'utf-8' )
+                responses.append( ( decoded[ future ], item[ 'client_id' ] ) )
+            except Exception as e:
+                logging.getLogger().error( f"Request for a message of a batch failed: {e}" )
+                responses.append( ( None, item.get( 'client_id' ) ) )
+        trace.end( 'upstream' )
+
+        result_handler = ResponseHandler( self.conn ) \
+                         .get_handler( data_dict )
+        with self._writing_db( data_dict, trace ):
+            return result_handler.handle_responses( responses )
+
+    @contextlib.contextmanager
+    def _writing_db( self, data_dict, trace ):
+        """
+        Hold the database lock for the duration of a with statement, recording 
+        the time taken, including waiting for the lock, as the db span of trace 
+        and in this server's metrics.
+        """
+        with trace.span( 'db' ), \
+             self._metrics.db_latency.time( data_dict[ 'api_details' ][ 1 ] ), \
+             self._db_lock:
+            yield
+
+    def _get_request_args( self, data_dict ):
+        """
+        Get the arguments for UpstreamTransport.request from an annotated data_dict.
+        """
+        http_method = data_dict[ 'method' ][ 'http_method' ]
+        data = None if http_method == 'get' else data_dict[ 'message' ]
+        return http_method, data_dict[ 'url' ], data_dict[ 'credentials' ], data
+
+    def get_transport( self ):
+        return self._transport
+
+    def get_client_manager( self ):
+        """
+        Get the ClientManager shared by every request this server handles.
+        It is created the first time it is needed, after which 
+        identifying a client does not touch the clients directory. 
+        Call reload() on it to pick up clients that were added 
+        outside of this server.
+        """
+        with self._client_manager_lock:
+            if not self._client_manager:
+                self._client_manager = ClientManager( self._client_dir, self.conn )
+
+                if self._client_watch_interval > 0:
+                    self._client_manager.start_watching( self._client_watch_interval )
+        return self._client_manager
+
+    def get_mode( self ):
+        return self._mode
+
+    def get_max_workers( self ):
+        return self._max_workers
 
     def start( self ):
         """
@@ -99,46 +398,136 @@ class WOLFFServer:
             # listen
             sock.listen() 
 
-            client_manager = ClientManager( 'clients', self.conn )
+            client_manager = self.get_client_manager()
 
+            if self.get_mode() == WOLFFServer.THREADED:
+                self._serve_threaded( sock, client_manager )
+            else:
+                self._serve_serial( sock, client_manager )
+
+    def _serve_serial( self, sock, client_manager ):
+        """
+        Accept connections one at a time, handling each one 
+        completely before accepting the next.
+        """
+        while True:
+            # accept a connection
+            conn, addr = sock.accept()
+            self.handle_connection( conn, client_manager )
+
+    def _serve_threaded( self, sock, client_manager ):
+        """
+        Accept connections and hand each one to a pool of worker threads.
+        At most max_workers connections are handled at once. When every 
+        worker is busy the accept loop blocks until one becomes free, 
+        leaving new connections in the listen backlog.
+        """
+        slots = threading.BoundedSemaphore( self.get_max_workers() )
+
+        def on_done( future ):
+            slots.release()
+            if future.exception():
+                logging.getLogger().error( "Failed to handle a client connection: "
+                                           f"{future.exception()}"
+                )
+
+        logging.getLogger().debug( "Handling connections with a pool of "
+                                   f"{self.get_max_workers()} workers"
+        )
+        with ThreadPoolExecutor( max_workers = self.get_max_workers() ) as executor:
             while True:
-                # accept a connection
-                conn, addr = sock.accept()
-                with conn:
-                    # receive message
-                    while True:
+                slots.acquire()
+                try:
+                    conn, addr = sock.accept()
+                except Exception:
+                    slots.release()
+                    raise
 
-                        data = conn.recv( 4096 )
+                executor.submit( self.handle_connection, conn, client_manager ) \
+                        .add_done_callback( on_done )
 
-                        if not data:
-                            break
+    def handle_connection( self, conn, client_manager ):
+        """
+        Handle every message sent over a single client connection. 
+        Messages from one connection are handled in the order they are 
+        received, so responses are sent back in the same order.
 
-                        data_str = binascii.hexlify( bytearray( data ) )
+        @param conn A connected socket
+        @param client_manager The ClientManager used to identify clients
+        """
+        # responses are small, send each as soon as it is ready instead of
+        # waiting for the client to acknowledge the previous one
+        conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+        with conn:
+            # a client may send several messages without waiting for each response
+            for data in FrameReader( conn, self._framer ):
+                # hexlify() costs more than the rest of the logging, only call it when needed
+                if logging.getLogger().isEnabledFor( logging.DEBUG ):
+                    logging.getLogger().debug( "Data of length %d received from client: 0x%s",
+                                               len( data ), binascii.hexlify( data ).decode()
+                    )
 
-                        logging.getLogger().debug( f"Data of length {len(data)} "
-                                                   f"received from client: 0x{data_str}"
-                        )
+                trace = self._tracer.start_trace()
+                try:
+                    response = self.process_message( data, client_manager, trace )
+                    with trace.span( 'publish' ):
+                        conn.sendall( self._framer.encode( response ) )
+                except Exception as e:
+                    trace.finish( error = e )
+                    raise
+                trace.finish()
 
-                        data_dict = self.decode_data( data )
-                        result_handler = ResponseHandler( self.conn ) \
-                                         .get_handler( data_dict )
-                        self.annotate_data( data_dict, client_manager )
+    def process_message( self, data, client_manager, trace = NULL_TRACE ):
+        """
+        Handle a single encoded WOLFF message: decode it, perform the 
+        request on behalf of the client and handle the response.
 
-                        result = self.do_request( data_dict )
-                        id = result_handler \
-                             .handle_response( result.content.decode( 'utf-8' ) )
-                        conn.sendall( str( id ).encode() )
+        @param data The encoded message
+        @param client_manager The ClientManager used to identify clients
+        @param trace The Trace the stages of handling the message are recorded in
+        @returns the encoded response to send back to the client
+        """
+        with trace.span( 'decode' ):
+            data_dict = self.decode_data( data )
+        trace.set_api( *data_dict[ 'api_details' ] )
+
+        result_handler = ResponseHandler( self.conn ) \
+                         .get_handler( data_dict )
+
+        if 'batch' in data_dict:
+            futures = self.submit_batch( data_dict, client_manager, trace )
+            return bytes( self.finish_batch( data_dict, futures, trace ) )
+
+        with trace.span( 'annotate' ):
+            self.annotate_data( data_dict, client_manager, trace )
+
+        with trace.span( 'upstream' ):
+            result = self.do_request( data_dict )
+        self.check_response( result )
+        with self._writing_db( data_dict, trace ):
+            response = result_handler \
+                       .handle_response( result.content.decode( 'utf-8' ),
+                                         data_dict[ 'client_id' ]
+                       )
+        return bytes( response )
 
     def get_request_handler( self, credentials ):
         """
         Get the request handler that allows us to perform
         authenticated http requests on behalf of the client.
         
+        Sessions are reused between requests made with the same credentials, 
+        see SessionPool.
+
         @param credentials: The user credentials to use for authenticating the user 
         """
-        return OAuth1Session( **credentials )
+        return self._session_pool.get( credentials )
+
+    def get_session_pool( self ):
+        return self._session_pool
 
-    def annotate_data( self, data_dict, client_manager ):
+    def annotate_data( self, data_dict, client_manager, trace = NULL_TRACE ):
         """
         Annotate a data dictionary with client and 
         service-specific information that comes from the 
@@ -181,32 +570,33 @@ class WOLFFServer:
                upon a service.
         @param A dictionary containing the data from a 
                decoded message
+        @param trace The Trace the client lookup is recorded in
         @returns a dictionary that is ready to be sent 
                  as an api request by do_request
         
         """
-        api_map = APIMap()
+        api_map = self._api_map
         data_dict[ 'method' ] = dict()
         service, method = data_dict[ 'api_details' ]
 
 
-        logging.getLogger().debug( f"Service: {service}, Method: {method}" )
+        logging.getLogger().debug( "Service: %s, Method: %s", service, method )
         http_method =  api_map.get_http_method( service, method )
-        logging.getLogger().debug( f"HTTP Method for request: {http_method}" )
+        logging.getLogger().debug( "HTTP Method for request: %s", http_method )
         auth_type = api_map.get_auth_type( service )
-        logging.getLogger().debug( f"Auth type for request: {auth_type}" )
+        logging.getLogger().debug( "Auth type for request: %s", auth_type )
         service_identifier = api_map.get_service_identifier( service, method )
-        logging.getLogger().debug( f"Service identifier type for {service} "
-                                   f"{method}: {service_identifier}"
+        logging.getLogger().debug( "Service identifier type for %s %s: %s",
+                                   service, method, service_identifier
         )
 
         replacement_value = None
 
         if api_map.uri_is_substitutable( api_map.get_uri( service, method ) ):
-            logging.getLogger().debug( f"URI for {service}/{method} deemed to be substitutable." )
+            logging.getLogger().debug( "URI for %s/%s deemed to be substitutable.", service, method )
             replacement_value = api_map.get_replacement( service, method, data_dict, self.conn )
             
-        logging.getLogger().debug( f"URI Replacement value (may be None): {replacement_value}" )
+        logging.getLogger().debug( "URI Replacement value (may be None): %s", replacement_value )
 
         data_dict[ 'url' ] = api_map.get_complete_url( service, method,
                                                        replace = replacement_value
@@ -216,15 +606,21 @@ class WOLFFServer:
         service_identifier_value = api_map.get_identifier_value( service, method, data_dict )
         api_map.add_special_params( service, method, data_dict )
 
-        logging.getLogger().debug( f"Service identifier for request: {service_identifier}" )
-        logging.getLogger().debug( f"Service identifier value for request: {service_identifier_value}" )
-        logging.getLogger().debug( f"URL for request: {data_dict[ 'url' ]}" )
-
-        client_id = client_manager \
-                    .get_client_by_service_identifier( service,
-                                                       service_identifier,
-                                                       service_identifier_value
-                                                     ).get_id()
+        logging.getLogger().debug( "Service identifier for request: %s", service_identifier )
+        logging.getLogger().debug( "Service identifier value for request: %s", service_identifier_value )
+        logging.getLogger().debug( "URL for request: %s", data_dict[ 'url' ] )
+
+        with trace.span( 'client_lookup' ):
+            client = client_manager \
+                     .get_client_by_service_identifier( service,
+                                                        service_identifier,
+                                                        service_identifier_value
+                                                      )
+        if client is None:
+            raise ValueError( f"No client is registered with {service}/{service_identifier} "
+                              f"'{service_identifier_value}'"
+            )
+        client_id = client.get_id()
 
         data_dict[ 'method' ][ 'http_method' ] = http_method
         credentials = client_manager \
@@ -245,12 +641,117 @@ class MQTTServer( WOLFFServer ):
     a client. 
 
     The server expects any requests coming from a client to be in the 'posts/#' topic.
-    The response will be sent to the client via the 'respones/client_x' topic.
+    The response to a message posted to 'posts/<rest>' is published to 'responses/<rest>',
+    so a sender that includes an id of its own in the topic, e.g. 'posts/client_x/req/<request id>',
+    can tell which of its requests each response belongs to, and need only subscribe to
+    'responses/client_x/#' instead of being sent the responses to every other sender.
+
+    A message posted to 'posts/<sender>/req/<request id>' is only handled once, however many
+    times it is delivered: the response to it is recorded, and published again if the
+    message is delivered again. See get_request_key().
     """
-    def __init__( self, db_connection, ip, port, update_port, channels = None ):
-        super().__init__( db_connection, ip, port )
+
+    """
+    The topic level that marks the next level as a request id, see get_request_key().
+    """
+    REQUEST_ID_LEVEL = 'req'
+
+    def __init__( self, db_connection, ip, port, update_port, channels = None,
+                  num_workers = 0,
+                  queue_depth = 100,
+                  enqueue_timeout = None,
+                  client_dir = 'clients',
+                  client_watch_interval = 0,
+                  session_pool = None,
+                  transport = None,
+                  api_map = None,
+                  update_framing = 'json',
+                  tracer = None,
+                  metrics_registry = None,
+                  recent_requests = None
+                ):
+        """
+        Create an MQTTServer.
+
+        @param db_connection A connection to the WOLFF database
+        @param ip The ip of the MQTT broker
+        @param port The port of the MQTT broker
+        @param update_port The port to listen on for update requests
+        @param channels Additional channels to subscribe to
+        @param num_workers The number of worker threads that handle messages.
+               If 0, messages are handled by paho's network thread as they arrive.
+        @param queue_depth The maximum number of messages waiting for a worker
+        @param enqueue_timeout The number of seconds paho's network thread will wait 
+               for space in a full queue before the message is dropped.
+               If None, it waits as long as necessary.
+        @param client_dir The directory clients are loaded from
+        @param client_watch_interval If greater than 0, client_dir is checked for 
+               changes every client_watch_interval seconds.
+        @param session_pool The SessionPool that request sessions are taken from
+        @param transport The UpstreamTransport requests are made with. If the 
+               transport is asynchronous and num_workers is 0, paho's network 
+               thread only decodes each message and starts its request; 
+               responses are handled by a separate thread as they arrive.
+        @param api_map The APIMap describing the services requests are made to
+        @param update_framing How update requests are framed on connections to 
+               update_port. 'json' reads back to back JSON documents, 'length' 
+               expects each document to be prefixed with its length.
+        @param tracer The Tracer the latency of each message is recorded with.
+               The trace of a message starts when it is received from the broker.
+        @param metrics_registry The MetricsRegistry this server's metrics are 
+               registered with. If None, a registry of its own is created.
+        @param recent_requests The RecentRequests the responses to requests are 
+               recorded in, to answer requests that are delivered more than once.
+               If None, one recording responses in db_connection is used.
+        """
+        super().__init__( db_connection, ip, port,
+                          client_dir = client_dir,
+                          client_watch_interval = client_watch_interval,
+                          session_pool = session_pool,
+                          transport = transport,
+                          api_map = api_map,
+                          tracer = tracer,
+                          metrics_registry = metrics_registry
+        )
         self._update_port = update_port
+        self._update_framer = get_framer( update_framing )
         self._channels = channels if channels else None
+        self._enqueue_timeout = enqueue_timeout
+        self._work_queue = None
+        self._response_executor = None
+        self._recent_requests = recent_requests if recent_requests else RecentRequests( db_connection )
+        self.get_metrics_registry().gauge( 'wolff_repeated_requests_answered',
+                                           "Requests delivered again that were answered with the "
+                                           "response recorded for them.",
+                                           function = lambda: self._recent_requests.get_stats()[ 'answered' ]
+        )
+        self.get_metrics_registry().gauge( 'wolff_repeated_requests_dropped',
+                                           "Requests delivered again while they were being handled.",
+                                           function = lambda: self._recent_requests.get_stats()[ 'dropped' ]
+        )
+
+        if num_workers == 0 and self.get_transport().is_async:
+            # responses are written to the database one at a time
+            self._response_executor = ThreadPoolExecutor( max_workers = 1,
+                                                          thread_name_prefix = 'mqtt-response'
+            )
+
+        if num_workers > 0:
+            self._work_queue = FairWorkQueue( lambda item: self.handle_message( *item ),
+                                              num_workers = num_workers,
+                                              max_depth = queue_depth,
+                                              name = 'mqtt-worker'
+            )
+            registry = self.get_metrics_registry()
+            registry.gauge( 'wolff_work_queue_depth', "Messages waiting for a worker.",
+                            function = lambda: self._work_queue.get_stats()[ 'depth' ]
+            )
+            registry.gauge( 'wolff_work_queue_busy_workers', "Workers handling a message.",
+                            function = lambda: self._work_queue.get_stats()[ 'busy' ]
+            )
+            registry.gauge( 'wolff_work_queue_rejected', "Messages dropped because the queue was full.",
+                            function = lambda: self._work_queue.get_stats()[ 'rejected' ]
+            )
 
         self._client = mqtt.Client()
         self._client.subscribe( 'posts/#' )
@@ -264,8 +765,8 @@ class MQTTServer( WOLFFServer ):
 
             client.subscribe( 'posts/#' )
             logging.getLogger().debug( "Subscribing to channel: 'posts/#'" )
-            for chan in channels:
-                logging.getLogger().debug( "Subscribing to channel: {chan}" )
+            for chan in channels or []:
+                logging.getLogger().debug( "Subscribing to channel: %s", chan )
                 client.subscribe( chan )
 
         def on_message( client, userdata, msg ):
@@ -273,47 +774,29 @@ class MQTTServer( WOLFFServer ):
             Callback used by Paho MQTT upon reception of a message 
             from the MQTT broker.
             """
-
-
             logging.getLogger().debug( "A message has been received from the "
                                        "MQTT server."
             )
+            trace = self.get_tracer().start_trace()
 
-            logging.getLogger().info( f"TIMESTAMP Message from broker at: {time.time()}" )
-
-            client_manager = ClientManager( 'clients', self.conn )
-            # get the method name from the URL 
-            logging.getLogger().debug( "Attempting to decode the data" )
-            data_dict = self.decode_data( msg.payload )
-
-            logging.getLogger().debug( f"Decoded data: {data_dict}" )
-            self.annotate_data( data_dict, client_manager )
-            logging.getLogger().debug( f"Annotated data: {data_dict}" )
-
-            result = self.do_request( data_dict )
-            decoded_content = result.content.decode( 'utf-8' )
-            logging.getLogger().debug( f"Decoded Response from server: {decoded_content}"  )
-
-            result_handler = ResponseHandler( self.conn ) \
-                             .get_handler( data_dict )
-
-            try:
-                id = result_handler \
-                     .handle_response( decoded_content,
-                                       data_dict[ 'client_id' ]
-                     )
-                logging.getLogger().debug( f"Response from ResultHandler: {str( id )}" )
-            except Exception as e:
-                logging.getLogger().error( f"ERROR: {str(e)}" )
-                sys.exit( 1 )
-        
-            topic = 'responses'
-
-            # Note: topic is of the form /posts/client_x, where x is the ID for the client
-            logging.getLogger().debug( "Publishing response to MQTT server." )
-            logging.getLogger().info( f"TIMESTAMP Publish response to client: {time.time()}" )
-            self.get_client().publish( topic, id, qos = 1 )
-            logging.getLogger().debug( "Successfully published response." )
+            if self._work_queue:
+                # hand the message off so that paho's network thread is never 
+                # blocked on the request. put() only blocks when the queue is full.
+                trace.begin( 'queue' )
+                try:
+                    self._work_queue.put( self.get_fairness_key( msg.topic ),
+                                          ( msg.topic, msg.payload, trace ),
+                                          timeout = self._enqueue_timeout
+                    )
+                except queue.Full:
+                    logging.getLogger().error( "Dropping message on topic '%s', "
+                                               "the work queue is full.", msg.topic
+                    )
+                    trace.finish( error = "The work queue is full" )
+            elif self._response_executor:
+                self.start_message( msg.topic, msg.payload, trace )
+            else:
+                self.handle_message( msg.topic, msg.payload, trace )
 
         self.on_connect = lambda client, userdata, flags, rc: \
                           on_connect( client, userdata, flags, rc, channels = self._channels )
@@ -327,17 +810,365 @@ class MQTTServer( WOLFFServer ):
         self.get_client().on_connect = self.on_connect
         self.get_client().on_message = self.on_message
 
+        # load the clients before any messages arrive
+        self.get_client_manager()
+
         logging.getLogger().debug( "Connecting to the MQTT server "
                                    f"with IP: {self.get_ip()}, port: {self.get_port()}"
         )
 
         self.get_client().connect( self.get_ip(), self.get_port(), timeout )
 
+        if self._work_queue:
+            self._work_queue.start()
+
         Thread( target = self.handle_update_requests ).start()
         self.get_client().loop_forever()
 
+    def get_fairness_key( self, topic ):
+        """
+        Get the key messages are grouped by when they are queued for a worker.
+        Messages are posted to 'posts/<sender>/...', so the first two levels
+        of the topic identify who sent the message.
+
+        @param topic The topic a message was received on
+        """
+        return '/'.join( topic.split( '/' )[ 0:2 ] )
+
+    def get_reply_topic( self, topic ):
+        """
+        Get the topic the response to a message is published to.
+
+        @param topic The topic the message was received on
+        @returns 'responses/<rest>' for a message received on 'posts/<rest>',
+                 and 'responses' for a message received on any other channel
+        """
+        if topic.startswith( 'posts/' ):
+            return 'responses/' + topic[ len( 'posts/' ): ]
+        return 'responses'
+
+    def get_request_key( self, topic ):
+        """
+        Get the key that identifies the request in a message, by which a request 
+        delivered more than once is recognized. A message posted to 
+        'posts/<sender>/req/<request id>' is identified by its topic, so a sender 
+        that posts to such topics must never reuse a request id. Messages posted 
+        to any other topic, e.g. 'posts/<sender>/create_listing', are handled 
+        each time they are delivered.
+
+        @param topic The topic the message was received on
+        @returns the key, or None if the message is not identified
+        """
+        levels = topic.split( '/' )
+        if len( levels ) == 4 and levels[ 0 ] == 'posts' and levels[ 1 ] \
+           and levels[ 2 ] == MQTTServer.REQUEST_ID_LEVEL and levels[ 3 ]:
+            return topic
+        return None
+
+    def get_recent_request_stats( self ):
+        """
+        Get statistics for the requests that were delivered more than once.
+
+        @returns the dictionary returned by RecentRequests.get_stats
+        """
+        return self._recent_requests.get_stats()
+
+    def _answer_repeated( self, topic, trace = NULL_TRACE ):
+        """
+        Answer a message that was already handled, or is being handled, 
+        with the response recorded for it, if any.
+
+        @returns True if the message must not be handled
+        """
+        key = self.get_request_key( topic )
+        if key is None:
+            return False
+
+        response = self._recent_requests.start( key )
+        if response is None:
+            return False
+
+        if response is RecentRequests.IN_PROGRESS:
+            logging.getLogger().info( "Dropping request '%s', which was delivered again "
+                                      "while it is being handled", key
+            )
+        else:
+            logging.getLogger().info( "Answering request '%s', which was delivered again, "
+                                      "with the response recorded for it", key
+            )
+            with trace.span( 'publish' ):
+                self.get_client().publish( self.get_reply_topic( topic ), response, qos = 1 )
+        trace.finish()
+        return True
+
+    def _abandon( self, topic ):
+        """
+        Forget a message whose request could not be performed, so that 
+        it is handled again if it is delivered again. Must not be called 
+        once the request has been performed upstream, as performing it 
+        again could e.g. create a listing twice.
+        """
+        key = self.get_request_key( topic )
+        if key is not None:
+            self._recent_requests.abandon( key )
+
+    def get_work_queue_stats( self ):
+        """
+        Get statistics for the queue of messages waiting for a worker.
+
+        @returns the dictionary returned by FairWorkQueue.get_stats, or None 
+                 if messages are not being handled by workers.
+        """
+        if not self._work_queue:
+            return None
+        return self._work_queue.get_stats()
+
+    def handle_message( self, topic, payload, trace = NULL_TRACE ):
+        """
+        Handle a message received from the MQTT broker: perform the request 
+        on behalf of the client and publish the response.
+
+        @param topic The topic the message was received on
+        @param payload The encoded WOLFF message
+        @param trace The Trace of the message, which is finished once its 
+               response is published
+        """
+        trace.end( 'queue' )
+        if self._answer_repeated( topic, trace ):
+            return
+
+        data_dict = None
+        try:
+            data_dict = self._prepare_message( payload, trace )
+
+            if 'batch' in data_dict:
+                futures = self.submit_batch( data_dict, self.get_client_manager(), trace )
+            else:
+                with trace.span( 'upstream' ):
+                    result = self.do_request( data_dict )
+                self.check_response( result )
+        except Exception as e:
+            self._fail_message( topic, data_dict, False, e, trace )
+            raise
+
+        # the request has been performed upstream, so it must not be 
+        # performed again if handling its response fails
+        try:
+            if 'batch' in data_dict:
+                response = self.finish_batch( data_dict, futures, trace )
+            else:
+                response = self._handle_result( data_dict, result, trace )
+        except Exception as e:
+            self._fail_message( topic, data_dict, True, e, trace )
+            raise
+
+        try:
+            self._publish_response( topic, response, trace )
+        except Exception as e:
+            trace.finish( error = e )
+            raise
+        trace.finish()
+
+    def start_message( self, topic, payload, trace = NULL_TRACE ):
+        """
+        Start handling a message received from the MQTT broker without 
+        waiting for the response to its request. The response is handled
+        and published by this server's response thread once it arrives.
+
+        @param topic The topic the message was received on
+        @param payload The encoded WOLFF message
+        @param trace The Trace of the message, which is finished once its 
+               response is published
+        """
+        if self._answer_repeated( topic, trace ):
+            return
+
+        data_dict = None
+        try:
+            data_dict = self._prepare_message( payload, trace )
+            if 'batch' in data_dict:
+                futures = self.submit_batch( data_dict, self.get_client_manager(), trace )
+        except Exception as e:
+            self._fail_message( topic, data_dict, False, e, trace )
+            raise
+
+        def publish( response ):
+            try:
+                self._publish_response( topic, response, trace )
+            except Exception as e:
+                logging.getLogger().error( f"Failed to publish the response to a message "
+                                           f"on topic '{topic}': {e}"
+                )
+                trace.finish( error = e )
+                return
+            trace.finish()
+
+        if 'batch' in data_dict:
+            def on_batch_response():
+                try:
+                    response = self.finish_batch( data_dict, futures, trace )
+                except Exception as e:
+                    logging.getLogger().error( f"Failed to handle the responses to a batch "
+                                               f"on topic '{topic}': {e}"
+                    )
+                    self._fail_message( topic, data_dict, True, e, trace )
+                    return
+                publish( response )
+
+            remaining = [ len( futures ) ]
+            lock = threading.Lock()
+
+            def on_done( future ):
+                with lock:
+                    remaining[ 0 ] -= 1
+                    if remaining[ 0 ] > 0:
+                        return
+                trace.end( 'upstream' )
+                self._response_executor.submit( on_batch_response )
+
+            for future in futures:
+                future.add_done_callback( on_done )
+            return
+
+        def on_response( future ):
+            try:
+                result = future.result()
+                self.check_response( result )
+            except Exception as e:
+                logging.getLogger().error( f"Failed to perform the request of a message "
+                                           f"on topic '{topic}': {e}"
+                )
+                self._fail_message( topic, data_dict, False, e, trace )
+                return
+
+            try:
+                response = self._handle_result( data_dict, result, trace )
+            except Exception as e:
+                logging.getLogger().error( f"Failed to handle the response to a message "
+                                           f"on topic '{topic}': {e}"
+                )
+                self._fail_message( topic, data_dict, True, e, trace )
+                return
+            publish( response )
+
+        def on_done( future ):
+            trace.end( 'upstream' )
+            self._response_executor.submit( on_response, future )
+
+        trace.begin( 'upstream' )
+        self.submit_request( data_dict ).add_done_callback( on_done )
+
+    def _prepare_message( self, payload, trace = NULL_TRACE ):
+        """
+        Decode and annotate a message, making it ready for do_request.
+        """
+        client_manager = self.get_client_manager()
+        # get the method name from the URL 
+        logging.getLogger().debug( "Attempting to decode the data" )
+        with trace.span( 'decode' ):
+            data_dict = self.decode_data( payload )
+        trace.set_api( *data_dict[ 'api_details' ] )
+
+        logging.getLogger().debug( "Decoded data: %s", data_dict )
+
+        # the messages of a batch are annotated by submit_batch
+        if 'batch' not in data_dict:
+            with trace.span( 'annotate' ):
+                self.annotate_data( data_dict, client_manager, trace )
+            logging.getLogger().debug( "Annotated data: %s", data_dict )
+        return data_dict
+
+    def _handle_result( self, data_dict, result, trace = NULL_TRACE ):
+        """
+        Handle the response to a message's request.
+
+        @returns the response to the message
+        """
+        decoded_content = result.content.decode( 'utf-8' )
+        logging.getLogger().debug( "Decoded Response from server: %s", decoded_content )
+
+        result_handler = ResponseHandler( self.conn ) \
+                         .get_handler( data_dict )
+
+        try:
+            with self._writing_db( data_dict, trace ):
+                id = result_handler \
+                     .handle_response( decoded_content,
+                                       data_dict[ 'client_id' ]
+                     )
+            logging.getLogger().debug( "Response from ResultHandler: %s", id )
+        except Exception as e:
+            logging.getLogger().error( "ERROR: %s", e )
+            raise
+
+        return id
+
+    def _fail_message( self, topic, data_dict, performed, error, trace = NULL_TRACE ):
+        """
+        Answer a message that could not be handled with the failure response 
+        to its request, if it was decoded, so its sender is not left waiting, 
+        and finish its trace.
+
+        If the request was performed upstream, the failure response is recorded 
+        as the response to the message, so the request is not performed again 
+        if the message is delivered again. Otherwise the message is forgotten, 
+        and handled again if it is delivered again.
+
+        @param data_dict The decoded message, or None if it was not decoded
+        @param performed True if the request was performed upstream
+        @param error The exception handling the message failed with
+        """
+        response = None
+        if data_dict is not None:
+            try:
+                response = ResponseHandler( self.conn ) \
+                           .get_handler( data_dict ) \
+                           .get_failure_response()
+            except Exception as e:
+                logging.getLogger().error( "Failed to create the failure response to a message "
+                                           "on topic '%s': %s", topic, e
+                )
+
+        try:
+            if performed and response is not None:
+                self._publish_response( topic, response, trace )
+            else:
+                self._abandon( topic )
+                if response is not None:
+                    with trace.span( 'publish' ):
+                        self.get_client().publish( self.get_reply_topic( topic ), response, qos = 1 )
+        except Exception as e:
+            logging.getLogger().error( "Failed to publish the failure response to a message "
+                                       "on topic '%s': %s", topic, e
+            )
+        trace.finish( error = error )
+
+    def _publish_response( self, topic, response, trace = NULL_TRACE ):
+        """
+        Publish the response to a message received on topic.
+        """
+        reply_topic = self.get_reply_topic( topic )
+
+        logging.getLogger().debug( "Publishing response to MQTT server on topic '%s'.", reply_topic )
+        try:
+            with trace.span( 'publish' ):
+                self.get_client().publish( reply_topic, response, qos = 1 )
+            logging.getLogger().debug( "Successfully published response." )
+        finally:
+            # the request has been performed, so if it is delivered again 
+            # it is answered with this response rather than performed again
+            key = self.get_request_key( topic )
+            if key is not None:
+                self._recent_requests.finish( key, response )
+
     def handle_update_requests( self ):
-        client_manager = ClientManager( 'clients', self.conn )
+        """
+        Listen on update_port for requests to update listings. Each request 
+        is a JSON document; a client may send several requests over one 
+        connection, and is sent 'SUCCESS' or 'FAILURE' (and a newline) 
+        for each, in order.
+        """
+        client_manager = self.get_client_manager()
 
         logging.getLogger().debug( "Creating a socket to listen to incoming "
                                    f"update requests on IP: {self.get_ip()}, "
@@ -345,11 +1176,11 @@ class MQTTServer( WOLFFServer ):
         )
         with socket.socket( socket.AF_INET, socket.SOCK_STREAM ) as sock:
             sock.bind( (self.get_ip(), self._update_port ) )
+            sock.listen()
 
             while True:
 
                 logging.getLogger().debug( "Waiting for a client to connect" )
-                sock.listen()
 
                 conn, addr = sock.accept()
                 host, port = conn.getpeername()
@@ -357,49 +1188,66 @@ class MQTTServer( WOLFFServer ):
                                            f"IP: {host}, on port: {port}. "
                 )
 
-                logging.getLogger().info( "TIMESTAMP Connected to client at: {time.time()}" )
-
                 try:
-                    data = conn.recv( 4096 )
+                    with conn:
+                        for data in FrameReader( conn, self._update_framer ):
+                            trace = self.get_tracer().start_trace()
+                            try:
+                                response = self.handle_update_request( data, client_manager, trace )
+                                with trace.span( 'publish' ):
+                                    conn.sendall( self._update_framer.encode( response ) )
+                            except Exception as e:
+                                trace.finish( error = e )
+                                raise
+                            trace.finish()
                 except Exception as e:
-                    logging.getLogger().error( "Failure to receive bytes from client." )
-                    
-
-                logging.getLogger().debug( f"Received {len( data ) } bytes from client." )
+                    logging.getLogger().error( f"Failed to handle update requests from {host}:{port}: {e}" )
 
-                if not data:
-                    break
-
-                decoded_data = data.decode( "utf-8" )
-                logging.getLogger().debug( f"Data received: {decoded_data}")
-                data_dict = json.loads( decoded_data )
-                logging.getLogger().debug( f"Data dictionary (pre-annotation): {data_dict}")
+    def handle_update_request( self, data, client_manager, trace = NULL_TRACE ):
+        """
+        Handle a single update request.
 
-                self.annotate_data( data_dict, client_manager )
-                logging.getLogger().debug( f"Data dictionary (post-annotation): {data_dict}")
+        @param data The JSON encoded request
+        @param client_manager The ClientManager used to identify clients
+        @param trace The Trace the stages of handling the request are recorded in
+        @returns the response to send back to the client
+        """
+        logging.getLogger().debug( "Received %d bytes from client.", len( data ) )
 
-                result = self.do_request( data_dict )
-                result_status = result.status_code
-                logging.getLogger().debug( f"Request returned status: {result_status}, reason: '{result.text}'" )
-                if result_status == 200:
-                    record_id = data_dict[ 'listing_id' ]
-                    quantity = data_dict[ 'message' ][ 'quantity' ]
+        with trace.span( 'decode' ):
+            decoded_data = data.decode( "utf-8" )
+            data_dict = json.loads( decoded_data )
+        trace.set_api( *data_dict[ 'api_details' ] )
+        logging.getLogger().debug( "Data received: %s", decoded_data )
+        logging.getLogger().debug( "Data dictionary (pre-annotation): %s", data_dict )
 
-                    logging.getLogger().debug( f"Updating listing with record id '{record_id}' "
-                                               f"with quantity {quantity}"
-                    )
-                    self.conn.update_listing_stock( record_id,
-                                                    quantity
-                    )
-                    logging.getLogger().debug( "Sending success response back to client." )
-                    conn.sendall( "SUCCESS\n".encode( 'utf-8' ) )
-                else:
-                    logging.getLogger().debug( "Sending failure response back to client." )
-                    conn.sendall( "FAILURE\n".encode( 'utf-8' ) )
+        with trace.span( 'annotate' ):
+            self.annotate_data( data_dict, client_manager, trace )
+        logging.getLogger().debug( "Data dictionary (post-annotation): %s", data_dict )
 
-                logging.getLogger().debug( f"TIMESTAMP Sending response back to client: {time.time()}" )
+        with trace.span( 'upstream' ):
+            result = self.do_request( data_dict )
+        result_status = result.status_code
+        logging.getLogger().debug( "Request returned status: %s, reason: '%s'",
+                                   result_status, result.text
+        )
+        if result_status == 200:
+            record_id = data_dict[ 'listing_id' ]
+            quantity = data_dict[ 'message' ][ 'quantity' ]
 
-                logging.getLogger().debug( "Sent response back to client." )
+            logging.getLogger().debug( "Updating listing with record id '%s' "
+                                       "with quantity %s", record_id, quantity
+            )
+            with self._writing_db( data_dict, trace ):
+                self.conn.update_listing_stock( record_id,
+                                                quantity
+                )
+            logging.getLogger().debug( "Sending success response back to client." )
+            response = "SUCCESS\n".encode( 'utf-8' )
+        else:
+            logging.getLogger().debug( "Sending failure response back to client." )
+            response = "FAILURE\n".encode( 'utf-8' )
+        return response
 
     def get_client( self ):
         return self._client
@@ -414,64 +1262,161 @@ class MQTTServer( WOLFFServer ):
 
 class WOLFFNodeProxy( MQTTServer ):
     """
-    A WOLFFNodeProxy is a MQTTServer that sends requests on behalf of a user 
+    A WOLFFNodeProxy is a MQTTServer that sends requests on behalf of a user
     to the WOLFF gateway through MQTT via TCP/IP.
-    Incoming messages are expected to have the form posts/client_x, where x uniquely identifies 
-    a client. 
 
-    The server expects any requests coming from a client to be in the 'posts/#' topic.
-    The response will be sent to the client via the 'respones/client_x' topic.
+    Each request is posted to 'posts/<node id>/req/<request id>', where the request
+    id is unique to the request, and the gateway publishes its response to
+    'responses/<node id>/req/<request id>'. Responses are handed to the connection
+    waiting for them by their request id, so any number of requests, from any
+    number of connections, can be waiting for a response at once.
+
+    The proxy only subscribes to 'responses/<node id>/#', so the broker does not
+    send it the responses to other nodes. Every node must have an id of its own.
+
+    Requests can be put in an Outbox instead of being published directly, and are
+    then published from a thread of its own whenever the proxy is connected to the
+    broker, in batches. A request is removed from the outbox once the broker has
+    acknowledged it, so requests accepted while the link to the broker is down, or
+    before the proxy is restarted, are sent once it is back up. A request may be
+    sent more than once if the link goes down before it is acknowledged. No one is
+    waiting for the responses to requests sent before a restart, they are dropped.
+    """
+    """
+    The number of seconds the outbox thread waits for the broker to acknowledge a batch.
     """
+    OUTBOX_ACK_TIMEOUT = 10
     def __init__( self, client_ip = "127.0.0.1", client_port = 5555,
                   broker_ip = "127.0.0.1", broker_port = 1883,
-                  channels = None
+                  channels = None,
+                  framing = 'opcode',
+                  node_id = None,
+                  mode = WOLFFServer.SERIAL,
+                  max_workers = 8,
+                  response_timeout = 30,
+                  outbox_file = None,
+                  outbox_max_depth = 100000,
+                  outbox_batch = 64,
+                  outbox_rate = 0,
+                  metrics_registry = None
                 ):
+        """
+        Create a WOLFFNodeProxy.
+
+        @param client_ip The ip to listen for client connections on
+        @param client_port The port to listen for client connections on
+        @param broker_ip The ip of the MQTT broker
+        @param broker_port The port of the MQTT broker
+        @param channels Additional channels to subscribe to
+        @param framing How messages are framed on client connections,
+               see WOLFFServer
+        @param node_id The id of this node, which requests are posted and
+               responses are received under. If None, the host name is used,
+               with any characters MQTT gives a meaning to replaced.
+        @param mode How client connections are served, see WOLFFServer
+        @param max_workers The maximum number of connections handled
+               concurrently in 'threaded' mode, see WOLFFServer
+        @param response_timeout The number of seconds to wait for the response
+               to a request. If it does not arrive in time, the client's
+               connection is closed. If None, the proxy waits as long as necessary.
+        @param outbox_file If not None, the database file of the Outbox requests
+               are put in, otherwise requests are published directly
+        @param outbox_max_depth The maximum number of requests in the outbox. Once
+               it is full, the connections of clients sending more are closed.
+        @param outbox_batch The maximum number of requests published from the
+               outbox before waiting for the broker to acknowledge them
+        @param outbox_rate If greater than 0, the maximum number of requests
+               published from the outbox per second
+        @param metrics_registry The MetricsRegistry the depth of the outbox and the
+               number of requests waiting for a response are registered with.
+               If None, a registry of its own is created.
+        """
+        if mode not in WOLFFServer.MODES:
+            raise ValueError( f"Invalid serving mode '{mode}', expected one of {WOLFFServer.MODES}" )
+        if max_workers < 1:
+            raise ValueError( "max_workers must be at least 1" )
+        if node_id is None:
+            node_id = re.sub( '[/+#]', '_', socket.gethostname() )
+        if not node_id or '/' in node_id or '+' in node_id or '#' in node_id:
+            raise ValueError( f"Invalid node id '{node_id}', it cannot contain '/', '+' or '#'" )
+
         self.client_ip = client_ip
         self.client_port = client_port
         self.broker_ip = broker_ip
         self.broker_port = broker_port
         self._channels = channels if channels else None
-        self.cond = threading.Condition()
+        self._framer = get_framer( framing )
+        self._node_id = node_id
+        self._mode = mode
+        self._max_workers = max_workers
+        self._response_timeout = response_timeout
+        self._pending = PendingRequests()
+        self._metrics_registry = metrics_registry if metrics_registry is not None else MetricsRegistry()
+        self._metrics_registry.gauge( 'wolff_proxy_pending_requests', "Requests waiting for a response.",
+                                      function = lambda: self._pending.get_stats()[ 'pending' ]
+        )
+        self._metrics_registry.gauge( 'wolff_proxy_timed_out_requests',
+                                      "Requests whose response did not arrive in time.",
+                                      function = lambda: self._pending.get_stats()[ 'timed_out' ]
+        )
 
-        self._client = mqtt.Client()
-        self.message_buffer = None
+        self._connected = threading.Event()
+        self._outbox = None
+        if outbox_file is not None:
+            self._outbox = Outbox( outbox_file, max_depth = outbox_max_depth )
+            self._outbox_batch = outbox_batch
+            self._outbox_rate = outbox_rate
+            self._outbox_ready = threading.Event()
+            self._metrics_registry.gauge( 'wolff_outbox_depth', "Requests waiting to be published.",
+                                          function = self._outbox.get_depth
+            )
+            self._metrics_registry.gauge( 'wolff_outbox_oldest_age_seconds',
+                                          "The time the oldest request in the outbox has been waiting.",
+                                          function = lambda: self._outbox.get_stats()[ 'oldest_age' ]
+            )
+            Thread( target = self._drain_outbox, name = 'outbox', daemon = True ).start()
 
+        self._client = mqtt.Client()
 
         def on_connect( client, userdata, flags, rc, channels = None ):
             """
-            Callback used by Paho MQTT upon connection 
+            Callback used by Paho MQTT upon connection
             with the MQTT broker.
             """
-            logging.getLogger().debug( "Connected with result code " + str( rc )  )
+            logging.getLogger().debug( "Connected with result code %s", rc )
 
-            client.subscribe( 'responses' )
-            for chan in channels:
+            client.subscribe( self.get_response_topic(), qos = 1 )
+            for chan in channels or []:
                 client.subscribe( chan )
+            if rc == 0:
+                self._connected.set()
+
+        def on_disconnect( client, userdata, rc ):
+            logging.getLogger().warning( "Disconnected from the MQTT broker with result code %s", rc )
+            self._connected.clear()
 
         def on_message( client, userdata, msg ):
             """
-            Callback used by Paho MQTT upon reception of a message 
+            Callback used by Paho MQTT upon reception of a message
             from the MQTT broker.
             """
+            logging.getLogger().debug( "Received a message on topic: %s", msg.topic )
 
-            logging.getLogger().debug( "Received a message!" )
-            # get the method name from the URL 
-
-            logging.getLogger().debug( f"Message topic: {msg.topic}")
-            # logging.getLogger().debug( f"Data: {int.from_bytes( msg.msg, byteorder = 'big' )}" )
-            if msg.payload is None:
-                logging.getLogger().debug( "Message received is None!" )
-            self.message_buffer = msg.payload
-            with self.cond:
-                self.cond.notify()
-            logging.getLogger().debug( f"Message data: {self.message_buffer}" )
-
-            ## Note: topic is of the form /posts/client_x, where x is the ID for the client
+            # topic is of the form responses/<node id>/req/<request id>
+            levels = msg.topic.split( '/' )
+            if len( levels ) != 4 or levels[ 1 ] != self._node_id \
+               or levels[ 2 ] != MQTTServer.REQUEST_ID_LEVEL:
+                return
 
+            if not self._pending.resolve( levels[ 3 ], msg.payload ):
+                logging.getLogger().warning( "Dropping a response to request %s, which is "
+                                             "not waiting for one", levels[ 3 ]
+                )
 
         self.on_connect = lambda client, userdata, flags, rc: \
                           on_connect( client, userdata, flags, rc, channels = self._channels )
         self.on_message = on_message
+        self.on_disconnect = on_disconnect
 
     def get_client_ip( self ):
         return self.client_ip
@@ -479,6 +1424,37 @@ class WOLFFNodeProxy( MQTTServer ):
     def get_client_port( self ):
         return self.client_port
 
+    def get_node_id( self ):
+        return self._node_id
+
+    def get_response_topic( self ):
+        """
+        @returns the topic filter the responses to this node's requests match
+        """
+        return f'responses/{self._node_id}/#'
+
+    def get_pending_stats( self ):
+        """
+        Get statistics for the requests waiting for a response.
+
+        @returns the dictionary returned by PendingRequests.get_stats
+        """
+        return self._pending.get_stats()
+
+    def get_outbox_stats( self ):
+        """
+        Get statistics for the requests waiting to be published.
+
+        @returns the dictionary returned by Outbox.get_stats, or None
+                 if requests are published directly
+        """
+        if not self._outbox:
+            return None
+        return self._outbox.get_stats()
+
+    def get_metrics_registry( self ):
+        return self._metrics_registry
+
     def decode_data( self, encoded_message ):
         logging.getLogger().warning( "Uh oh! This implementation of 'decode_data' is empty! "
                                      "Are you sure you meant to call it?"
@@ -487,33 +1463,101 @@ class WOLFFNodeProxy( MQTTServer ):
 
     def do_request( self, data, topic ):
         """
-        Send a request ot the MQTT broker, with the 
+        Send a request ot the MQTT broker, with the
         specified topic.
-        
+
         @param data_dict A dictionary containing the data to send.
         @param topic the string topic to publish the message to,
                'posts/client_1' for example.
+        @throws queue.Full if the request is put in the outbox, and it is full
         """
+        if self._outbox:
+            self._outbox.put( topic, data )
+            self._outbox_ready.set()
+            return
+
         self.get_client().publish( topic,
                                    data,
                                    qos = 1
                                  )
 
+    def _drain_outbox( self ):
+        """
+        Publish the requests in the outbox, in order, whenever the proxy is
+        connected to the broker, removing each once it is acknowledged.
+        """
+        while True:
+            self._connected.wait()
+
+            self._outbox_ready.clear()
+            messages = self._outbox.peek( self._outbox_batch )
+            if not messages:
+                self._outbox_ready.wait( 1 )
+                continue
+
+            start = time.monotonic()
+            published = list()
+            try:
+                infos = [ self.get_client().publish( topic, payload, qos = 1 )
+                          for seq, topic, payload in messages
+                        ]
+                for ( seq, topic, payload ), info in zip( messages, infos ):
+                    info.wait_for_publish( WOLFFNodeProxy.OUTBOX_ACK_TIMEOUT )
+                    if not info.is_published():
+                        break
+                    published.append( seq )
+            except ( ValueError, RuntimeError ) as e:
+                logging.getLogger().warning( "Failed to publish from the outbox: %s", e )
+            self._outbox.remove( published )
+
+            logging.getLogger().debug( "Published %d of %d requests from the outbox",
+                                       len( published ), len( messages )
+            )
+            if len( published ) < len( messages ):
+                # the rest are published again once the link to the broker is back
+                time.sleep( 1 )
+            elif self._outbox_rate > 0:
+                time.sleep( max( 0, len( published ) / self._outbox_rate - ( time.monotonic() - start ) ) )
+
+    def forward( self, data ):
+        """
+        Post a request to the gateway and wait for its response.
+
+        @param data The encoded WOLFF message
+        @returns the encoded response
+        @throws TimeoutError if the response does not arrive within response_timeout seconds
+        """
+        request_id = uuid.uuid4().hex
+        future = self._pending.add( request_id )
+        try:
+            self.do_request( data, f'posts/{self._node_id}/{MQTTServer.REQUEST_ID_LEVEL}/{request_id}' )
+        except Exception:
+            self._pending.discard( request_id )
+            raise
+
+        logging.getLogger().debug( "Waiting for the response to request %s.", request_id )
+        return self._pending.wait( request_id, future, self._response_timeout )
+
     def start( self ):
         """
-        Start the server, allow it to run continuously. Requests will be 
-        forwarded to the MQTT broker on behalf of the user. 
+        Start the server, allow it to run continuously. Requests will be
+        forwarded to the MQTT broker on behalf of the user.
         """
 
         self.get_client().on_connect = self.on_connect
         self.get_client().on_message = self.on_message
+        self.get_client().on_disconnect = self.on_disconnect
 
-        self.get_client().connect( self.broker_ip, self.broker_port, 60 )
+        if self._outbox:
+            # requests are kept in the outbox until the broker is reachable
+            self.get_client().connect_async( self.broker_ip, self.broker_port, 60 )
+        else:
+            self.get_client().connect( self.broker_ip, self.broker_port, 60 )
 
         self.get_client().loop_start()
 
         with socket.socket( socket.AF_INET, socket.SOCK_STREAM ) as sock:
-            # bind to the socket 
+            # bind to the socket
             sock.bind( ( self.get_client_ip(), self.get_client_port() ) )
             logging.getLogger().debug( "Creating a socket to listen to incoming "
                                        f"requests on IP: {self.client_ip}, "
@@ -522,39 +1566,53 @@ class WOLFFNodeProxy( MQTTServer ):
 
 
             # listen
-            sock.listen() 
+            sock.listen()
 
+            # clients are not identified by the proxy, there is no client manager
+            if self.get_mode() == WOLFFServer.THREADED:
+                self._serve_threaded( sock, None )
+            else:
+                self._serve_serial( sock, None )
 
-            while True:
-                # accept a connection
-                conn, addr = sock.accept()
-
-                with conn:
-                    # receive message
-                    host, port = conn.getpeername()
-                    logging.getLogger().debug( "Received a client connection with "
-                                               f"IP: {host}, on port: {port}. "
-                    )
-
-
-                    data = conn.recv( 4096 )
-
-                    if not data:
-                        logging.getLogger().error( "ERROR: Data received is empty!" )
-                        break
-
-                    data_str = binascii.hexlify( bytearray( data ) )
-                    logging.getLogger().debug( f"Data received from client: {data_str}" )
-                    topic = "posts/1"
-                    result = self.do_request( data, topic )
+    def handle_connection( self, conn, client_manager = None ):
+        """
+        Forward every message sent over a single client connection,
+        sending back each response in the order the messages were received.
+        If a response does not arrive in time, the connection is closed.
 
-                    logging.getLogger().debug( f"Waiting for response." )
-                    with self.cond:
-                        self.cond.wait_for( lambda: self.message_buffer is not None )
+        @param conn A connected socket
+        @param client_manager Unused
+        """
+        conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
 
+        with conn:
+            # receive message
+            host, port = conn.getpeername()
+            logging.getLogger().debug( "Received a client connection with "
+                                       f"IP: {host}, on port: {port}. "
+            )
 
-                    logging.getLogger().debug( "Response received, "
-                                               f"sending '{self.message_buffer}' to client."
+            # messages sent back to back are forwarded one at a time
+            for data in FrameReader( conn, self._framer ):
+                if logging.getLogger().isEnabledFor( logging.DEBUG ):
+                    logging.getLogger().debug( "Data received from client: %s",
+                                               binascii.hexlify( data ).decode()
+                    )
+                try:
+                    response = self.forward( data )
+                except TimeoutError:
+                    logging.getLogger().error( "No response to a request from %s:%s within "
+                                               "%s seconds, closing the connection",
+                                               host, port, self._response_timeout
+                    )
+                    return
+                except queue.Full:
+                    logging.getLogger().error( "The outbox is full, closing the connection "
+                                               "from %s:%s", host, port
                     )
-                    conn.sendall( self.message_buffer )
-                    self.message_buffer = None
+                    return
+
+                logging.getLogger().debug( "Response received, "
+                                           "sending '%s' to client.", response
+                )
+                conn.sendall( self._framer.encode( response ) )
@@ -0,0 +1,59 @@
+import time
+from .. common.metrics import MetricsRegistry
+
+class ServerMetrics:
+    """
+    The metrics recorded by a WOLFFServer while handling messages.
+    """
+    def __init__( self, registry = None ):
+        """
+        @param registry The MetricsRegistry the metrics are registered with.
+               If None, a new registry is created.
+        """
+        self.registry = registry if registry is not None else MetricsRegistry()
+
+        self.messages_received = self.registry.counter( 'wolff_messages_received_total',
+                                                        "Messages received, by application and opcode.",
+                                                        ( 'application', 'opcode' )
+        )
+        self.decode_failures = self.registry.counter( 'wolff_decode_failures_total',
+                                                      "Messages that could not be decoded."
+        )
+        self.upstream_responses = self.registry.counter( 'wolff_upstream_responses_total',
+                                                         "Responses to requests made to services, "
+                                                         "by status code, or 'error' if the request failed.",
+                                                         ( 'service', 'method', 'status' )
+        )
+        self.upstream_latency = self.registry.histogram( 'wolff_upstream_latency_seconds',
+                                                         "The latency of requests made to services.",
+                                                         ( 'service', 'method' )
+        )
+        self.in_flight = self.registry.gauge( 'wolff_upstream_in_flight_requests',
+                                              "Requests made to services that have not been answered."
+        )
+        self.db_latency = self.registry.histogram( 'wolff_db_latency_seconds',
+                                                   "The time taken to record the response to a message "
+                                                   "in the database, including waiting for the database.",
+                                                   ( 'method', )
+        )
+
+    def start_request( self ):
+        """
+        Count a request made to a service as in flight.
+
+        @returns the time the request started, to pass to finish_request()
+        """
+        self.in_flight.inc()
+        return time.monotonic()
+
+    def finish_request( self, service, method, start, response ):
+        """
+        Record the latency and the status of a request made to a service.
+
+        @param start The time returned by start_request()
+        @param response The response to the request, or None if it failed
+        """
+        self.in_flight.dec()
+        self.upstream_latency.observe( time.monotonic() - start, service, method )
+        status = str( response.status_code ) if response is not None else 'error'
+        self.upstream_responses.inc( service, method, status )
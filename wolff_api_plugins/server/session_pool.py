@@ -0,0 +1,186 @@
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1Session
+import threading
+import time
+
+class SessionPool:
+    """
+    A bounded cache of OAuth1Sessions, one for each set of credentials.
+
+    Reusing a client's session lets requests on behalf of that client
+    reuse its open (keep-alive) connections instead of performing a new
+    TCP and TLS handshake for every request.
+
+    Sessions are evicted in least-recently-used order once more than
+    max_sessions are cached, and are closed once they have not been
+    used for idle_timeout seconds.
+    """
+    def __init__( self, max_sessions = 128,
+                  idle_timeout = 300,
+                  pool_connections = 4,
+                  pool_maxsize = 8
+                ):
+        """
+        Create a SessionPool.
+
+        @param max_sessions The maximum number of sessions to keep. If 0, sessions
+               are not cached and a new session is created for every request.
+        @param idle_timeout The number of seconds a session may go unused
+               before it is closed.
+        @param pool_connections The number of hosts each session keeps
+               connections open to.
+        @param pool_maxsize The maximum number of connections each session
+               keeps open to a single host. This should be at least the number
+               of requests that may be made concurrently for a single client.
+        """
+        if max_sessions < 0:
+            raise ValueError( "max_sessions cannot be negative" )
+
+        self._max_sessions = max_sessions
+        self._idle_timeout = idle_timeout
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+
+        # credentials key -> [ session, time last used ], least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+        # connection counts of sessions that have been closed
+        self._closed_connections = 0
+        self._closed_requests = 0
+
+    def get( self, credentials ):
+        """
+        Get a session that authenticates requests with credentials,
+        creating one if none is cached.
+
+        @param credentials A dictionary of keyword arguments for OAuth1Session,
+               e.g. client_key, client_secret, resource_owner_key and
+               resource_owner_secret.
+        """
+        if self._max_sessions == 0:
+            with self._lock:
+                self._misses += 1
+            return self._create_session( credentials )
+
+        key = tuple( sorted( credentials.items() ) )
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire_idle( now )
+
+            entry = self._sessions.get( key )
+            if entry:
+                self._hits += 1
+                entry[ 1 ] = now
+                self._sessions.move_to_end( key )
+                return entry[ 0 ]
+
+            self._misses += 1
+            session = self._create_session( credentials )
+            self._sessions[ key ] = [ session, now ]
+
+            while len( self._sessions ) > self._max_sessions:
+                old_key, ( old_session, last_used ) = self._sessions.popitem( last = False )
+                self._close_session( old_session )
+                self._evictions += 1
+
+        return session
+
+    def _create_session( self, credentials ):
+        session = OAuth1Session( **credentials )
+        adapter = HTTPAdapter( pool_connections = self._pool_connections,
+                               pool_maxsize = self._pool_maxsize
+        )
+        session.mount( 'https://', adapter )
+        session.mount( 'http://', adapter )
+        return session
+
+    def _expire_idle( self, now ):
+        """
+        Close the sessions that have not been used for idle_timeout seconds.
+        Sessions are ordered by when they were last used, so only the
+        front of the cache needs to be checked.
+        """
+        while self._sessions:
+            key, ( session, last_used ) = next( iter( self._sessions.items() ) )
+            if now - last_used < self._idle_timeout:
+                break
+
+            del self._sessions[ key ]
+            self._close_session( session )
+            self._expirations += 1
+
+    def _close_session( self, session ):
+        connections, requests = self._count_connections( session )
+        self._closed_connections += connections
+        self._closed_requests += requests
+        session.close()
+
+    def _count_connections( self, session ):
+        """
+        Count the connections a session has opened,
+        and the requests it has sent over them.
+
+        @returns a tuple ( connections opened, requests sent )
+        """
+        connections = 0
+        requests = 0
+
+        for adapter in set( session.adapters.values() ):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get( pool_key )
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests += pool.num_requests
+
+        return connections, requests
+
+    def clear( self ):
+        """
+        Close every cached session.
+        """
+        with self._lock:
+            while self._sessions:
+                key, ( session, last_used ) = self._sessions.popitem()
+                self._close_session( session )
+
+    def get_stats( self ):
+        """
+        Get statistics for this pool.
+
+        @returns a dictionary containing the number of cached sessions,
+                 hits, misses, the hit rate, evictions, expirations, the number of
+                 connections opened, the number of requests sent, and the number
+                 of requests that reused an already open connection.
+        """
+        with self._lock:
+            connections = self._closed_connections
+            requests = self._closed_requests
+
+            for session, last_used in self._sessions.values():
+                session_connections, session_requests = self._count_connections( session )
+                connections += session_connections
+                requests += session_requests
+
+            lookups = self._hits + self._misses
+
+            return { 'sessions': len( self._sessions ),
+                     'max_sessions': self._max_sessions,
+                     'hits': self._hits,
+                     'misses': self._misses,
+                     'hit_rate': self._hits / lookups if lookups else 0.0,
+                     'evictions': self._evictions,
+                     'expirations': self._expirations,
+                     'connections_opened': connections,
+                     'requests_sent': requests,
+                     'reused_connections': max( requests - connections, 0 )
+                   }
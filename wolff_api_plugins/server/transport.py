@@ -0,0 +1,323 @@
+from concurrent.futures import ThreadPoolExecutor
+from oauthlib.oauth1 import Client as OAuth1Client
+from urllib.parse import urlencode, urlsplit
+import asyncio
+import json
+import logging
+import ssl
+import threading
+from . session_pool import SessionPool
+
+class UpstreamResponse:
+    """
+    The response to a request made to a service, exposing
+    the parts of a requests.Response that the servers use.
+    """
+    def __init__( self, status_code, headers, content ):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text( self ):
+        return self.content.decode( 'utf-8', errors = 'replace' )
+
+    def json( self ):
+        return json.loads( self.content )
+
+class UpstreamTransport:
+    """
+    An UpstreamTransport performs authenticated HTTP requests to
+    services (Etsy, for example) on behalf of clients.
+
+    Subclasses implement submit(), which starts a request and returns
+    a concurrent.futures.Future for its response.
+    """
+
+    """
+    True if requests in flight do not each occupy a thread.
+    """
+    is_async = False
+
+    def request( self, http_method, url, credentials, data = None ):
+        """
+        Perform a request, blocking until the response arrives.
+
+        @param http_method The (lowercase) http method, e.g. 'get' or 'post'
+        @param url The complete url of the request
+        @param credentials The OAuth1 credentials of the client the request
+               is made on behalf of
+        @param data A dictionary of parameters that is form-encoded into
+               the body of the request, or None.
+        @returns the response, an object with status_code, content and text
+        """
+        return self.submit( http_method, url, credentials, data = data ).result()
+
+    def submit( self, http_method, url, credentials, data = None ):
+        """
+        Start a request without waiting for its response.
+        Takes the same arguments as request().
+
+        @returns a concurrent.futures.Future whose result is the response
+        """
+        raise NotImplementedError()
+
+    def close( self ):
+        pass
+
+class RequestsTransport( UpstreamTransport ):
+    """
+    Performs requests with requests_oauthlib. Each request in flight
+    occupies a thread: request() uses the calling thread, while
+    submit() uses a thread from a pool of max_in_flight threads.
+    """
+    def __init__( self, session_pool = None, max_in_flight = 16 ):
+        """
+        @param session_pool The SessionPool sessions are taken from
+        @param max_in_flight The number of threads used by submit()
+        """
+        self._session_pool = session_pool if session_pool is not None else SessionPool()
+        self._max_in_flight = max_in_flight
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_session_pool( self ):
+        return self._session_pool
+
+    def request( self, http_method, url, credentials, data = None ):
+        session = self._session_pool.get( credentials )
+
+        if http_method == 'get':
+            return session.get( url )
+        return getattr( session, http_method )( url, data = data )
+
+    def submit( self, http_method, url, credentials, data = None ):
+        with self._lock:
+            if not self._executor:
+                self._executor = ThreadPoolExecutor( max_workers = self._max_in_flight,
+                                                     thread_name_prefix = 'upstream'
+                )
+        return self._executor.submit( self.request, http_method, url, credentials, data )
+
+    def close( self ):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+class AsyncioTransport( UpstreamTransport ):
+    """
+    Performs requests on an asyncio event loop that runs in a background
+    thread, so any number of requests can be in flight without a thread
+    for each. Requests are signed with OAuth1 (HMAC-SHA1) and sent over
+    HTTP/1.1, keeping connections to each host open for reuse.
+
+    Coroutines running on the transport's loop can await request_async()
+    directly; any other thread can use request() or submit().
+    """
+    is_async = True
+
+    """
+    The methods a request is sent again with if the connection is lost before its response is read.
+    """
+    IDEMPOTENT_METHODS = frozenset( ( 'GET', 'HEAD' ) )
+
+    def __init__( self, max_in_flight = 256,
+                  connections_per_host = 32,
+                  timeout = 30,
+                  ssl_context = None
+                ):
+        """
+        @param max_in_flight The maximum number of requests in flight at once.
+               Further requests wait until one finishes.
+        @param connections_per_host The maximum number of idle connections
+               kept open to each host
+        @param timeout The number of seconds to wait for a connection,
+               or for a response, before the request fails.
+        @param ssl_context The SSLContext used for https urls, by default
+               one created by ssl.create_default_context()
+        """
+        self._max_in_flight = max_in_flight
+        self._connections_per_host = connections_per_host
+        self._timeout = timeout
+        self._ssl_context = ssl_context if ssl_context else ssl.create_default_context()
+
+        # ( scheme, host, port ) -> list of idle ( reader, writer )
+        self._idle = dict()
+
+        self._loop = asyncio.new_event_loop()
+        self._in_flight = asyncio.Semaphore( max_in_flight )
+        self._thread = threading.Thread( target = self._run_loop, name = 'upstream-loop',
+                                         daemon = True
+        )
+        self._thread.start()
+
+    def _run_loop( self ):
+        asyncio.set_event_loop( self._loop )
+        self._loop.run_forever()
+
+    def get_loop( self ):
+        return self._loop
+
+    def submit( self, http_method, url, credentials, data = None ):
+        return asyncio.run_coroutine_threadsafe( self.request_async( http_method, url,
+                                                                     credentials, data
+                                                                   ),
+                                                 self._loop
+        )
+
+    async def request_async( self, http_method, url, credentials, data = None ):
+        """
+        Perform a request. Must be awaited on this transport's loop.
+        Takes the same arguments as request().
+        """
+        headers = dict()
+        body = None
+
+        if data is not None and http_method != 'get':
+            body = urlencode( data, doseq = True )
+            headers[ 'Content-Type' ] = 'application/x-www-form-urlencoded'
+
+        signer = OAuth1Client( **credentials )
+        url, headers, body = signer.sign( url, http_method = http_method.upper(),
+                                          body = body, headers = headers
+        )
+
+        if isinstance( body, str ):
+            body = body.encode( 'utf-8' )
+
+        async with self._in_flight:
+            return await asyncio.wait_for( self._send( http_method.upper(), url, headers, body ),
+                                           self._timeout
+            )
+
+    async def _send( self, method, url, headers, body ):
+        parts = urlsplit( url )
+        secure = parts.scheme == 'https'
+        port = parts.port if parts.port else ( 443 if secure else 80 )
+        key = ( parts.scheme, parts.hostname, port )
+
+        target = parts.path if parts.path else '/'
+        if parts.query:
+            target += f'?{parts.query}'
+
+        lines = [ f'{method} {target} HTTP/1.1', f'Host: {parts.netloc}' ]
+        for name, value in headers.items():
+            lines.append( f'{name}: {value}' )
+        lines.append( f'Content-Length: {len( body ) if body else 0}' )
+        request = ( '\r\n'.join( lines ) + '\r\n\r\n' ).encode( 'latin-1' )
+        if body:
+            request += body
+
+        # a connection taken from the idle list may have been closed by the
+        # server since it was last used, in which case retry on a new one.
+        # Once the request has been sent, the server may have acted on it, so
+        # only idempotent requests are retried if reading the response fails.
+        while True:
+            reader, writer, reused = await self._acquire( key, secure )
+            sent = False
+            try:
+                writer.write( request )
+                await writer.drain()
+                sent = True
+                response, keep_alive = await self._read_response( reader, method )
+            except ( ConnectionError, asyncio.IncompleteReadError ):
+                writer.close()
+                if reused and ( not sent or method in AsyncioTransport.IDEMPOTENT_METHODS ):
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        if keep_alive:
+            self._release( key, reader, writer )
+        else:
+            writer.close()
+
+        return response
+
+    async def _acquire( self, key, secure ):
+        idle = self._idle.get( key )
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        logging.getLogger().debug( "Opening a connection to %s:%s", host, port )
+        reader, writer = await asyncio.open_connection( host, port,
+                                                        ssl = self._ssl_context if secure else None
+        )
+        return reader, writer, False
+
+    def _release( self, key, reader, writer ):
+        idle = self._idle.setdefault( key, list() )
+        if len( idle ) < self._connections_per_host:
+            idle.append( ( reader, writer ) )
+        else:
+            writer.close()
+
+    async def _read_response( self, reader, method ):
+        """
+        Read an HTTP/1.1 response.
+
+        @returns a tuple ( UpstreamResponse, whether the connection can be reused )
+        """
+        head = await reader.readuntil( b'\r\n\r\n' )
+        status_line, *header_lines = head.decode( 'latin-1' ).split( '\r\n' )
+        version, status, *reason = status_line.split( ' ', 2 )
+
+        headers = dict()
+        for line in header_lines:
+            if line:
+                name, value = line.split( ':', 1 )
+                headers[ name.strip().lower() ] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get( 'connection', '' ).lower() != 'close'
+        status = int( status )
+
+        if method == 'HEAD' or status in ( 204, 304 ) or 100 <= status < 200:
+            content = b''
+        elif headers.get( 'transfer-encoding', '' ).lower() == 'chunked':
+            content = await self._read_chunked( reader )
+        elif 'content-length' in headers:
+            content = await reader.readexactly( int( headers[ 'content-length' ] ) )
+        else:
+            content = await reader.read()
+            keep_alive = False
+
+        return UpstreamResponse( status, headers, content ), keep_alive
+
+    async def _read_chunked( self, reader ):
+        chunks = list()
+        while True:
+            size_line = await reader.readuntil( b'\r\n' )
+            size = int( size_line.split( b';' )[ 0 ], 16 )
+            if size == 0:
+                break
+            chunks.append( await reader.readexactly( size ) )
+            await reader.readexactly( 2 )
+
+        # skip any trailers, up to the blank line ending the response
+        while await reader.readuntil( b'\r\n' ) != b'\r\n':
+            pass
+
+        return b''.join( chunks )
+
+    def close( self ):
+        """
+        Close every idle connection and stop the event loop.
+        """
+        async def close_idle():
+            for idle in self._idle.values():
+                for reader, writer in idle:
+                    writer.close()
+            self._idle = dict()
+
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe( close_idle(), self._loop ).result()
+            self._loop.call_soon_threadsafe( self._loop.stop )
+            self._thread.join()
@@ -0,0 +1,210 @@
+from collections import OrderedDict, deque
+import logging
+import queue
+import threading
+import time
+
+class TimingStats:
+    """
+    Accumulates the count, total, and maximum of a series
+    of durations (in seconds).
+    """
+    def __init__( self ):
+        self.count = 0
+        self.total = 0.0
+        self.max   = 0.0
+
+    def add( self, duration ):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def as_dict( self ):
+        mean = self.total / self.count if self.count else 0.0
+        return { 'count': self.count, 'mean': mean, 'max': self.max }
+
+class FairWorkQueue:
+    """
+    A bounded queue of work items that is served by a pool of
+    worker threads.
+
+    Items are grouped by a key (for example, the client that sent a message).
+    Workers take one item from each key in turn, so a client that sends
+    a burst of messages cannot starve the other clients.
+
+    The total number of queued items is bounded by max_depth. Once the
+    queue is full, put() blocks until a worker takes an item, pushing
+    back on whoever is producing the work.
+    """
+    def __init__( self, handler, num_workers = 4, max_depth = 100,
+                  name = 'wolff-worker'
+                ):
+        """
+        Create a FairWorkQueue. Workers are not started until start() is called.
+
+        @param handler A callable that is invoked with each item taken from the queue
+        @param num_workers The number of worker threads
+        @param max_depth The maximum number of items that can be waiting in the queue
+        @param name The prefix of the name of each worker thread
+        """
+        if num_workers < 1:
+            raise ValueError( "num_workers must be at least 1" )
+        if max_depth < 1:
+            raise ValueError( "max_depth must be at least 1" )
+
+        self._handler = handler
+        self._num_workers = num_workers
+        self._max_depth = max_depth
+        self._name = name
+
+        # key -> deque of ( enqueue time, item ), in round-robin order
+        self._queues = OrderedDict()
+        self._depth = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._workers = list()
+
+        self._submitted = 0
+        self._rejected = 0
+        self._failed = 0
+        self._busy = 0
+        self._wait_times = TimingStats()
+        self._processing_times = TimingStats()
+
+    def start( self ):
+        """
+        Start the worker threads.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+
+        for num in range( self._num_workers ):
+            worker = threading.Thread( target = self._work,
+                                       name = f'{self._name}-{num}',
+                                       daemon = True
+                                     )
+            worker.start()
+            self._workers.append( worker )
+
+        logging.getLogger().debug( f"Started {self._num_workers} workers with a "
+                                   f"maximum queue depth of {self._max_depth}"
+        )
+
+    def stop( self, wait = True ):
+        """
+        Stop the worker threads. Items that are already queued
+        are handled before the workers exit.
+
+        @param wait If True, block until every worker has exited.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = list()
+
+    def put( self, key, item, timeout = None ):
+        """
+        Add an item to the queue.
+
+        @param key The key the item is grouped by for fairness
+        @param item The item to pass to the handler
+        @param timeout The number of seconds to wait for space in the queue.
+               If None, wait as long as necessary.
+        @throws queue.Full if the queue is still full after timeout seconds
+        """
+        with self._cond:
+            if not self._cond.wait_for( lambda: self._depth < self._max_depth,
+                                        timeout = timeout
+                                      ):
+                self._rejected += 1
+                raise queue.Full( f"Work queue is full ({self._max_depth} items)" )
+
+            if key not in self._queues:
+                self._queues[ key ] = deque()
+            self._queues[ key ].append( ( time.monotonic(), item ) )
+
+            self._depth += 1
+            self._submitted += 1
+            self._cond.notify_all()
+
+    def _take( self ):
+        """
+        Take the next item from the queue, blocking until one is available.
+
+        @returns a tuple ( enqueue time, item ), or None if the queue
+                 has been stopped and is empty.
+        """
+        with self._cond:
+            self._cond.wait_for( lambda: self._depth > 0 or not self._running )
+
+            if self._depth == 0:
+                return None
+
+            key, items = next( iter( self._queues.items() ) )
+            entry = items.popleft()
+
+            # move on to the next key so that each key gets a turn
+            if items:
+                self._queues.move_to_end( key )
+            else:
+                del self._queues[ key ]
+
+            self._depth -= 1
+            self._busy += 1
+            self._cond.notify_all()
+            return entry
+
+    def _work( self ):
+        while True:
+            entry = self._take()
+            if entry is None:
+                return
+
+            enqueued_at, item = entry
+            started_at = time.monotonic()
+            failed = False
+
+            try:
+                self._handler( item )
+            except Exception as e:
+                failed = True
+                logging.getLogger().error( f"Failed to handle a queued item: {e}" )
+
+            finished_at = time.monotonic()
+
+            with self._cond:
+                self._busy -= 1
+                self._failed += failed
+                self._wait_times.add( started_at - enqueued_at )
+                self._processing_times.add( finished_at - started_at )
+
+    def get_depth( self ):
+        return self._depth
+
+    def get_stats( self ):
+        """
+        Get statistics for this queue.
+
+        @returns a dictionary containing the current queue depth, the number
+                 of busy workers, counts of submitted, rejected and failed items,
+                 and the mean/max time items spent waiting in the queue
+                 ('queue_wait') versus being handled ('processing'), in seconds.
+        """
+        with self._cond:
+            return { 'depth': self._depth,
+                     'max_depth': self._max_depth,
+                     'workers': self._num_workers,
+                     'busy': self._busy,
+                     'submitted': self._submitted,
+                     'rejected': self._rejected,
+                     'failed': self._failed,
+                     'queue_wait': self._wait_times.as_dict(),
+                     'processing': self._processing_times.as_dict()
+                   }